@@ -50,10 +50,28 @@ __contributors__ = {}
 __url__ = ''
 
 from . import config
+from . import cache
+from . import httpclient
+from . import limits
+from . import memory
+from . import metrics
+from . import paste
+from . import pipeline
+from . import splitter
+from . import workers
 from . import plugin
 from importlib import reload
 # In case we're being reloaded.
 reload(config)
+reload(cache)
+reload(httpclient)
+reload(limits)
+reload(memory)
+reload(metrics)
+reload(paste)
+reload(pipeline)
+reload(splitter)
+reload(workers)
 reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
@@ -0,0 +1,152 @@
+###
+# Copyright (c) 2023, Solareon
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize(prompt):
+    """Folds case, whitespace and trailing punctuation so trivially
+    different prompts share an entry"""
+    return ' '.join(prompt.lower().split()).rstrip(' ?!.')
+
+
+def cache_key(model, prompt, max_tokens):
+    key = '{model}\0{max_tokens}\0{prompt}'.format(
+        model=model, max_tokens=max_tokens or 0, prompt=normalize(prompt))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    """Cache of completions keyed on (model, normalized prompt, max_tokens).
+
+    Entries live in an in-memory LRU and, when a path is given, in a SQLite
+    database as well so they survive restarts.  Both are bounded in size
+    and every entry expires after the ttl it was stored with."""
+
+    def __init__(self, maxsize, path=None, disk_size=10000):
+        self.maxsize = maxsize
+        self.disk_size = disk_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                             'key TEXT PRIMARY KEY, response TEXT NOT NULL, '
+                             'expires REAL NOT NULL, used REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_used '
+                             'ON responses (used)')
+            self._db.commit()
+
+    def _remember(self, key, response, expires):
+        self._entries[key] = (expires, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, model, prompt, max_tokens):
+        key = cache_key(model, prompt, max_tokens)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute('SELECT expires, response FROM '
+                                       'responses WHERE key = ? AND '
+                                       'expires > ?', (key, now)).fetchone()
+                if row is not None:
+                    entry = tuple(row)
+                    self._db.execute('UPDATE responses SET used = ? WHERE '
+                                     'key = ?', (now, key))
+                    self._db.commit()
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry[1], entry[0])
+            return entry[1]
+
+    def set(self, model, prompt, max_tokens, response, ttl):
+        if ttl <= 0 or not response:
+            return
+        key = cache_key(model, prompt, max_tokens)
+        now = time.time()
+        expires = now + ttl
+        with self._lock:
+            self._remember(key, response, expires)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO responses VALUES '
+                                 '(?, ?, ?, ?)', (key, response, expires, now))
+                self._db.execute('DELETE FROM responses WHERE expires <= ? '
+                                 'OR key IN (SELECT key FROM responses ORDER '
+                                 'BY used DESC LIMIT -1 OFFSET ?)',
+                                 (now, self.disk_size))
+                self._db.commit()
+
+    def flush(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            if self._db is not None:
+                count = max(count, self._db.execute(
+                    'DELETE FROM responses').rowcount)
+                self._db.commit()
+            return count
+
+    def stats(self):
+        with self._lock:
+            stored = None
+            if self._db is not None:
+                stored = self._db.execute(
+                    'SELECT COUNT(*) FROM responses').fetchone()[0]
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'stored': stored,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -58,6 +58,65 @@ conf.registerGlobalValue(ChatGPT.openai.api, 'key',
                     private=True))
 conf.registerGlobalValue(ChatGPT.openai, 'maxtokens',
     registry.Integer(1024, _("""Maximum number of tokens for single request""")))
+conf.registerChannelValue(ChatGPT.openai, 'stream',
+    registry.Boolean(False, _("""Stream chatgpt and gpt3 replies, sending each
+    line as soon as it is complete instead of waiting for the whole
+    answer""")))
+conf.registerGroup(ChatGPT, 'memory')
+conf.registerChannelValue(ChatGPT.memory, 'enable',
+    registry.Boolean(True, _("""Send earlier exchanges along with chatgpt
+    prompts so follow-up questions have context""")))
+conf.registerChannelValue(ChatGPT.memory, 'shared',
+    registry.Boolean(False, _("""Share one conversation between everyone in
+    the channel instead of keeping one per nick""")))
+conf.registerGlobalValue(ChatGPT.memory, 'tokens',
+    registry.PositiveInteger(1024, _("""Estimated tokens of earlier exchanges
+    sent with a prompt, older exchanges are summarized and dropped""")))
+conf.registerGlobalValue(ChatGPT.memory, 'idle',
+    registry.PositiveInteger(1800, _("""Seconds after which an idle
+    conversation is forgotten""")))
+conf.registerGlobalValue(ChatGPT.memory, 'conversations',
+    registry.PositiveInteger(256, _("""Maximum number of conversations kept,
+    the least recently used are forgotten first. Takes effect on
+    reload.""")))
+conf.registerGroup(ChatGPT, 'cache')
+conf.registerChannelValue(ChatGPT.cache, 'enable',
+    registry.Boolean(True, _("""Answer repeated prompts from the response
+    cache instead of calling the API again""")))
+conf.registerGlobalValue(ChatGPT.cache, 'ttl',
+    registry.NonNegativeInteger(3600, _("""Seconds a response is cached""")))
+conf.registerGlobalValue(ChatGPT.cache, 'size',
+    registry.NonNegativeInteger(512, _("""Maximum number of responses cached
+    in memory. Takes effect on reload.""")))
+conf.registerGlobalValue(ChatGPT.cache, 'persist',
+    registry.Boolean(False, _("""Also store cached responses in a SQLite
+    database in the data directory so they survive restarts. Takes effect
+    on reload.""")))
+conf.registerGroup(ChatGPT, 'limits')
+conf.registerGlobalValue(ChatGPT.limits, 'maxwait',
+    registry.NonNegativeInteger(30, _("""Maximum seconds a request over the
+    rate limits is queued before it is refused""")))
+conf.registerGroup(ChatGPT.limits, 'nick')
+conf.registerGlobalValue(ChatGPT.limits.nick, 'requests',
+    registry.NonNegativeInteger(10, _("""Requests per minute allowed for
+    each nick, 0 for no limit""")))
+conf.registerGlobalValue(ChatGPT.limits.nick, 'tokens',
+    registry.NonNegativeInteger(0, _("""Estimated tokens per minute, prompt
+    and max_tokens included, allowed for each nick, 0 for no limit""")))
+conf.registerGroup(ChatGPT.limits, 'channel')
+conf.registerGlobalValue(ChatGPT.limits.channel, 'requests',
+    registry.NonNegativeInteger(30, _("""Requests per minute allowed for
+    each channel, 0 for no limit""")))
+conf.registerGlobalValue(ChatGPT.limits.channel, 'tokens',
+    registry.NonNegativeInteger(0, _("""Estimated tokens per minute, prompt
+    and max_tokens included, allowed for each channel, 0 for no limit""")))
+conf.registerGroup(ChatGPT.limits, 'global')
+conf.registerGlobalValue(ChatGPT.limits.get('global'), 'requests',
+    registry.NonNegativeInteger(60, _("""Requests per minute allowed in
+    total, 0 for no limit""")))
+conf.registerGlobalValue(ChatGPT.limits.get('global'), 'tokens',
+    registry.NonNegativeInteger(90000, _("""Estimated tokens per minute,
+    prompt and max_tokens included, allowed in total, 0 for no limit""")))
 conf.registerGroup(ChatGPT, 'privatebin')
 conf.registerGroup(ChatGPT.privatebin, 'url',
     registry.String('', _("""URL for Privatebin Instance""")))
@@ -70,5 +129,41 @@ conf.registerGroup(ChatGPT.shorten, 'url',
     registry.String('', _("""URL for Kutt Instance""")))
 conf.registerGroup(ChatGPT.shorten, 'enable',
     registry.Boolean(True, _("""Shorten URLs?""")))
+conf.registerChannelValue(ChatGPT.shorten, 'followup',
+    registry.Boolean(False, _("""Reply with the full paste URL right away and
+    follow up with the short link once it is ready, instead of waiting for
+    the short link""")))
+conf.registerGroup(ChatGPT, 'http')
+conf.registerGroup(ChatGPT.http, 'timeout')
+conf.registerGlobalValue(ChatGPT.http.timeout, 'connect',
+    registry.PositiveFloat(3.05, _("""Seconds to wait for a connection to
+    an upstream API. Takes effect on reload.""")))
+conf.registerGlobalValue(ChatGPT.http.timeout, 'read',
+    registry.PositiveFloat(60.0, _("""Seconds to wait for an upstream API to
+    respond. Takes effect on reload.""")))
+conf.registerGlobalValue(ChatGPT.http, 'retries',
+    registry.NonNegativeInteger(2, _("""Number of times a request failing
+    with a connection error, 429 or 5xx is retried. Takes effect on
+    reload.""")))
+conf.registerGroup(ChatGPT, 'workers')
+conf.registerGlobalValue(ChatGPT.workers, 'enable',
+    registry.Boolean(False, _("""Run commands on a fixed pool of worker
+    threads with a bounded queue instead of a new thread per command. Takes
+    effect on reload.""")))
+conf.registerGlobalValue(ChatGPT.workers, 'threads',
+    registry.PositiveInteger(4, _("""Number of worker threads. Takes effect
+    on reload.""")))
+conf.registerGlobalValue(ChatGPT.workers, 'queue',
+    registry.PositiveInteger(32, _("""Maximum number of commands waiting for
+    a worker, commands beyond that are refused. Takes effect on
+    reload.""")))
+conf.registerGroup(ChatGPT, 'metrics')
+conf.registerGlobalValue(ChatGPT.metrics, 'port',
+    registry.NonNegativeInteger(0, _("""Port serving metrics at /metrics
+    in Prometheus' text format, 0 disables it. Takes effect on
+    reload.""")))
+conf.registerGlobalValue(ChatGPT.metrics, 'host',
+    registry.String('127.0.0.1', _("""Address the metrics port listens
+    on. Takes effect on reload.""")))
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
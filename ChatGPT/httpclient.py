@@ -0,0 +1,129 @@
+###
+# Copyright (c) 2023, Solareon
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import functools
+import random
+import threading
+from urllib.parse import urlsplit
+
+# Longest wait honoured from a Retry-After header, in seconds, so a server
+# asking for more can't stall a command beyond the retry budget
+MAX_RETRY_AFTER = 5.0
+
+
+@functools.lru_cache(maxsize=None)
+def jitter_retry():
+    """Returns the JitterRetry class, defined on first use so urllib3 is
+    only imported with the session"""
+    from urllib3.util.retry import Retry
+
+    class JitterRetry(Retry):
+        """Retry whose exponential backoff is spread with random jitter, so
+        retries from concurrent commands don't hit a struggling host in
+        step, and whose Retry-After waits are capped"""
+
+        def get_backoff_time(self):
+            backoff = super(JitterRetry, self).get_backoff_time()
+            return random.uniform(backoff / 2, backoff) if backoff else 0
+
+        def get_retry_after(self, response):
+            retry_after = super(JitterRetry, self).get_retry_after(response)
+            if retry_after is None:
+                return None
+            return min(retry_after, MAX_RETRY_AFTER)
+
+    return JitterRetry
+
+
+class HTTPClient(object):
+    """Plugin-lifetime HTTP client.
+
+    Wraps a single requests.Session so connections are kept alive in a pool
+    per host, applies default connect/read timeouts to every request and
+    retries 429 and 5xx responses to idempotent requests a bounded number
+    of times.  POSTs aren't retried, the server may have already created
+    a paste or link when it errors.  Requests are timed per host into
+    metrics when a metrics.Registry is given."""
+
+    def __init__(self, connect_timeout, read_timeout, retries=2,
+                 pool_size=10, metrics=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.metrics = metrics
+        self.retries = retries
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Created by the first request, so loading the plugin doesn't import
+        # requests
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._connect()
+        return self._session
+
+    def _connect(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        retry = jitter_retry()(total=self.retries, backoff_factor=0.5,
+                               status_forcelist=(429, 500, 502, 503, 504),
+                               raise_on_status=False,
+                               respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+        with self.metrics.timed('upstream', host=urlsplit(url).hostname):
+            return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
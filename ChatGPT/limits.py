@@ -0,0 +1,169 @@
+###
+# Copyright (c) 2023, Solareon
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import threading
+import time
+
+
+class _Flight(object):
+    """A call in progress that identical requests wait on"""
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer(object):
+    """Runs a single call for identical requests made at the same time and
+    hands its result, or exception, to all of them"""
+
+    def __init__(self):
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, function):
+        """Returns (result, shared), shared being True when the result came
+        from another thread's call"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = function()
+            return flight.result, False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+
+class TokenBucket(object):
+    """Token bucket refilled at rate per second up to capacity.
+
+    Reservations may take the bucket below zero, which queues them: the
+    returned delay is how long the caller has to wait for its turn."""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, amount):
+        """Seconds until amount would be available"""
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def reserve(self, amount):
+        self.tokens -= amount
+
+
+class RateLimiter(object):
+    """Token buckets per nick, per channel and global, each counting both
+    requests and estimated tokens per minute.  A limit of 0 disables that
+    bucket."""
+
+    def __init__(self, maxbuckets=1024):
+        self.maxbuckets = maxbuckets
+        self.waits = 0
+        self.rejections = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, per_minute, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.maxbuckets:
+                # Full buckets hold no state worth keeping
+                for old_key, old in list(self._buckets.items()):
+                    old.refill(now)
+                    if old.tokens >= old.capacity:
+                        del self._buckets[old_key]
+            bucket = self._buckets[key] = TokenBucket(per_minute / 60.0,
+                                                      per_minute, now)
+        else:
+            bucket.rate = per_minute / 60.0
+            bucket.capacity = per_minute
+        bucket.refill(now)
+        return bucket
+
+    def acquire(self, limits, tokens, maxwait):
+        """Reserves one request and tokens in every bucket of limits, a list
+        of (key, requests per minute, tokens per minute).  Returns the delay
+        to wait before proceeding, or None without reserving anything if
+        that would be longer than maxwait."""
+        with self._lock:
+            now = time.monotonic()
+            reservations = []
+            for key, requests, token_limit in limits:
+                if requests > 0:
+                    bucket = self._bucket((key, 'requests'), requests, now)
+                    reservations.append((bucket, 1))
+                if token_limit > 0:
+                    bucket = self._bucket((key, 'tokens'), token_limit, now)
+                    # A single request may be larger than the whole bucket
+                    reservations.append((bucket, min(tokens, token_limit)))
+            delay = max([bucket.delay(amount)
+                         for bucket, amount in reservations] or [0.0])
+            if delay > maxwait:
+                self.rejections += 1
+                return None
+            for bucket, amount in reservations:
+                bucket.reserve(amount)
+            if delay > 0:
+                self.waits += 1
+            return delay
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
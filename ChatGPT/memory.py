@@ -0,0 +1,153 @@
+###
+# Copyright (c) 2023, Solareon
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Roughly how GPT tokenizers cut text: words, numbers and single
+# punctuation marks, with long runs costing about one token per 4 bytes
+TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+
+def estimate_tokens(text):
+    """Cheap local estimate of the number of tokens in text"""
+    return sum((len(token.encode('utf-8')) + 3) // 4
+               for token in TOKEN_RE.findall(text)) + 4
+
+
+def summarize(role, text, limit=120):
+    """Shortens a turn to its first sentence, for the running summary of
+    turns that fell out of the context window"""
+    text = ' '.join(text.split())
+    end = text.find('. ')
+    if end != -1:
+        text = text[:end + 1]
+    if len(text) > limit:
+        text = text[:limit - 3].rstrip() + '...'
+    return '{role}: {text}'.format(role=role, text=text)
+
+
+class Conversation(object):
+    """Turns of a single conversation, stored as UTF-8 bytes with their
+    token estimate"""
+    __slots__ = ('turns', 'summary', 'tokens', 'last_used')
+
+    def __init__(self):
+        self.turns = deque()
+        self.summary = deque()
+        self.tokens = 0
+        self.last_used = time.monotonic()
+
+    def add(self, role, text):
+        tokens = estimate_tokens(text)
+        self.turns.append((role, text.encode('utf-8'), tokens))
+        self.tokens += tokens
+
+    def trim(self, budget):
+        # Oldest turns are dropped into the summary until the turns and the
+        # summary both fit the budget, the summary getting at most a quarter
+        while self.turns and self.tokens > budget:
+            role, text, tokens = self.turns.popleft()
+            self.tokens -= tokens
+            line = summarize(role, text.decode('utf-8'))
+            tokens = estimate_tokens(line)
+            self.summary.append((line, tokens))
+            self.tokens += tokens
+            while self.summary and (self.tokens > budget or
+                    sum(t for l, t in self.summary) > budget // 4):
+                self.tokens -= self.summary.popleft()[1]
+
+    def messages(self):
+        messages = []
+        if self.summary:
+            messages.append({'role': 'system', 'content':
+                'Summary of the earlier conversation: ' +
+                ' | '.join(line for line, tokens in self.summary)})
+        for role, text, tokens in self.turns:
+            messages.append({'role': role, 'content': text.decode('utf-8')})
+        return messages
+
+
+class ConversationStore(object):
+    """Bounded LRU store of conversations.
+
+    At most maxsize conversations are kept and conversations idle for
+    longer than idle seconds are dropped, so memory stays flat however many
+    channels and nicks talk to the bot."""
+
+    def __init__(self, maxsize, idle):
+        self.maxsize = maxsize
+        self.idle = idle
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _expire(self, now):
+        while self._conversations:
+            key, conversation = next(iter(self._conversations.items()))
+            if now - conversation.last_used <= self.idle:
+                break
+            del self._conversations[key]
+
+    def context(self, key):
+        """Returns the messages of the conversation, oldest first"""
+        with self._lock:
+            self._expire(time.monotonic())
+            conversation = self._conversations.get(key)
+            if conversation is None:
+                return []
+            return conversation.messages()
+
+    def add(self, key, prompt, reply, budget):
+        """Records an exchange and trims the conversation to budget tokens"""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            conversation = self._conversations.pop(key, None)
+            if conversation is None:
+                conversation = Conversation()
+            conversation.add('user', prompt)
+            conversation.add('assistant', reply)
+            conversation.trim(budget)
+            conversation.last_used = now
+            self._conversations[key] = conversation
+            while len(self._conversations) > self.maxsize:
+                self._conversations.popitem(last=False)
+
+    def forget(self, key):
+        with self._lock:
+            return self._conversations.pop(key, None) is not None
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,233 @@
+###
+# Copyright (c) 2023, Solareon
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import bisect
+import contextlib
+import http.server
+import threading
+import time
+
+from supybot import world
+
+# Upper bounds in seconds of the histogram buckets, observations above the
+# last one go to the +Inf bucket
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0)
+
+
+class Histogram(object):
+    """Number of observations per fixed bucket, with their count and sum.
+    Recording one is a bisection over the bounds, memory doesn't grow."""
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        """Returns the upper bound of the bucket holding the given quantile,
+        inf when it's past the last bound"""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return 0.0
+
+
+def _labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '{name}="{value}"'.format(name=name, value=str(value).replace(
+            '\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+
+class Registry(object):
+    """Counters and histograms of a plugin by name and labels, exposed in
+    Prometheus' text format.
+
+    Collectors are functions called when the metrics are read, returning
+    (type, name, labels, value) tuples for values the plugin already keeps,
+    such as cache statistics, so they cost nothing until then."""
+
+    def __init__(self, namespace, buckets=BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timed(self, name, **labels):
+        """Times the block into the name_seconds histogram and counts it in
+        name_total with an ok or error outcome"""
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        finally:
+            self.observe(name + '_seconds', time.perf_counter() - started,
+                         **labels)
+            self.inc(name + '_total', outcome=outcome, **labels)
+
+    def collect(self, collector):
+        self._collectors.append(collector)
+
+    def _samples(self):
+        # Returns {name: (type, [(labels, value or Histogram)])}
+        metrics = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                metrics.setdefault(name, ('counter', []))[1].append(
+                    (labels, value))
+            for (name, labels), histogram in self._histograms.items():
+                copy = Histogram(histogram.bounds)
+                copy.counts = list(histogram.counts)
+                copy.count = histogram.count
+                copy.sum = histogram.sum
+                metrics.setdefault(name, ('histogram', []))[1].append(
+                    (labels, copy))
+        for collector in self._collectors:
+            for type, name, labels, value in collector():
+                metrics.setdefault(name, (type, []))[1].append(
+                    (tuple(sorted(labels.items())), value))
+        return metrics
+
+    def render(self):
+        """Returns every metric in Prometheus' text exposition format"""
+        lines = []
+        for name, (type, samples) in sorted(self._samples().items()):
+            name = '{namespace}_{name}'.format(namespace=self.namespace,
+                                               name=name)
+            lines.append('# TYPE {name} {type}'.format(name=name, type=type))
+            for labels, value in sorted(samples, key=lambda s: s[0]):
+                if type != 'histogram':
+                    lines.append('{name}{labels} {value}'.format(
+                        name=name, labels=_labels(labels), value=value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(value.bounds + ('+Inf',),
+                                        value.counts):
+                    cumulative += count
+                    lines.append('{name}_bucket{labels} {count}'.format(
+                        name=name, labels=_labels(labels, [('le', bound)]),
+                        count=cumulative))
+                lines.append('{name}_sum{labels} {sum}'.format(
+                    name=name, labels=_labels(labels), sum=value.sum))
+                lines.append('{name}_count{labels} {count}'.format(
+                    name=name, labels=_labels(labels), count=value.count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, match=''):
+        """Returns a line per metric whose name contains match, histograms
+        summarized by count, average and the bucket holding the 95th
+        percentile"""
+        lines = []
+        for name, (type, samples) in sorted(self._samples().items()):
+            if match not in name:
+                continue
+            for labels, value in sorted(samples, key=lambda s: s[0]):
+                label = name + _labels(labels).replace('"', '')
+                if type != 'histogram':
+                    lines.append('{label}: {value:g}'.format(label=label,
+                                                             value=value))
+                elif value.count:
+                    lines.append('{label}: {count}, avg {avg:.1f}ms, p95 '
+                                 '<= {p95:g}ms'.format(
+                                     label=label, count=value.count,
+                                     avg=value.sum / value.count * 1000,
+                                     p95=value.quantile(0.95) * 1000))
+        return lines
+
+
+class Exporter(object):
+    """Serves a registry at /metrics over HTTP for Prometheus to scrape"""
+
+    def __init__(self, registry, host, port):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = world.SupyThread(
+            target=self.httpd.serve_forever,
+            name='{namespace} metrics'.format(namespace=registry.namespace))
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,202 @@
+###
+# Copyright (c) 2023, Solareon
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+
+from supybot import log
+
+
+@functools.lru_cache(maxsize=None)
+def paste_class():
+    """Returns pbincli's Paste deriving its key with hashlib's PBKDF2 rather
+    than pycryptodome's pure Python loop, which takes seconds per paste at
+    PrivateBin's 100000 iterations.  pbincli and its crypto libraries are
+    only imported by the first paste.
+
+    pbincli has no public hook for this, so the private method is only
+    replaced while pbincli still has it, pbincli's own is used otherwise."""
+    from pbincli.format import Paste
+
+    if not hasattr(Paste, '_Paste__deriveKey'):
+        log.warning('ChatGPT: pbincli no longer has Paste.__deriveKey, '
+                    'pastes use its slower key derivation')
+        return Paste
+
+    class _Paste(Paste):
+        def _Paste__deriveKey(self, salt):
+            return hashlib.pbkdf2_hmac('sha256',
+                                       self._key + self._password.encode(),
+                                       salt, self._iteration_count,
+                                       self._block_bits // 8)
+
+    return _Paste
+
+
+class PastePipeline(object):
+    """Uploads pastes to PrivateBin and shortens them with Kutt over the
+    plugin's pooled HTTP client.
+
+    The PrivateBin version is fetched once per server instead of before
+    every paste, and links are cached by a hash of the server and paste
+    content so identical outputs are only uploaded and shortened once.  Each stage's
+    latency is recorded."""
+
+    STAGES = ('encrypt', 'upload', 'shorten')
+
+    def __init__(self, http, maxlinks=256, metrics=None):
+        self.http = http
+        self.metrics = metrics
+        self.maxlinks = maxlinks
+        self.timings = dict((stage, deque(maxlen=100))
+                            for stage in self.STAGES)
+        self._versions = {}
+        self._links = OrderedDict()
+        self._lock = threading.Lock()
+        self._version_lock = threading.Lock()
+
+    def _time(self, stage, started):
+        elapsed = time.monotonic() - started
+        self.timings[stage].append(elapsed)
+        if self.metrics is not None:
+            self.metrics.observe('paste_seconds', elapsed, stage=stage)
+        return elapsed
+
+    def version(self, server):
+        # Serialized so an upload waits for a warmup already in progress
+        # instead of asking the server again
+        with self._version_lock:
+            if server not in self._versions:
+                from privatebinapi.common import DEFAULT_HEADERS
+                data = self.http.get(server + '?jsonld=paste',
+                                     headers=DEFAULT_HEADERS).json()
+                try:
+                    self._versions[server] = data['@context']['v']['@value']
+                except (KeyError, TypeError):
+                    self._versions[server] = 1
+            return self._versions[server]
+
+    def warmed(self, server):
+        return server in self._versions
+
+    def warm(self, server):
+        """Fetches the server's version ahead of the first upload, which
+        also opens a pooled connection to it"""
+        try:
+            self.version(server)
+        except Exception:
+            pass
+
+    def key(self, server, formatting, text):
+        return hashlib.sha256('\0'.join((server, formatting, text))
+                              .encode('utf-8')).hexdigest()
+
+    def lookup(self, server, formatting, text):
+        """Returns the cached (full_url, short_url) for a paste on server,
+        either being None when not known yet"""
+        key = self.key(server, formatting, text)
+        with self._lock:
+            links = self._links.get(key)
+            if links is None:
+                return (None, None)
+            self._links.move_to_end(key)
+            return links
+
+    def _remember(self, server, formatting, text, full_url, short_url):
+        key = self.key(server, formatting, text)
+        with self._lock:
+            self._links[key] = (full_url, short_url)
+            self._links.move_to_end(key)
+            while len(self._links) > self.maxlinks:
+                self._links.popitem(last=False)
+
+    def upload(self, server, text, formatting, expiration='never'):
+        """Encrypts and uploads text, returns the paste's full URL"""
+        full_url, short_url = self.lookup(server, formatting, text)
+        if full_url:
+            return full_url
+
+        from privatebinapi.common import DEFAULT_HEADERS
+        from privatebinapi.upload import process_result
+
+        started = time.monotonic()
+        version = self.version(server)
+        paste = paste_class()()
+        paste.setVersion(version)
+        paste.setCompression('zlib' if version == 2 else 'none')
+        paste.setText(text)
+        paste.encrypt(formatting, False, False, expiration)
+        data = paste.getJSON()
+        self._time('encrypt', started)
+
+        started = time.monotonic()
+        response = self.http.post(server, headers=DEFAULT_HEADERS, data=data)
+        full_url = process_result(response, paste.getHash())['full_url']
+        self._time('upload', started)
+        log.info('ChatGPT: pasted %s bytes, encrypt %sms, upload %sms',
+                 len(text), round(self.timings['encrypt'][-1] * 1000),
+                 round(self.timings['upload'][-1] * 1000))
+
+        self._remember(server, formatting, text, full_url, None)
+        return full_url
+
+    def shorten(self, api_url, api_key, server, formatting, text, full_url):
+        """Returns a Kutt short link for the full URL of a paste on
+        server"""
+        cached_url, short_url = self.lookup(server, formatting, text)
+        if short_url and cached_url == full_url:
+            return short_url
+
+        started = time.monotonic()
+        headers = {'X-API-KEY': api_key, 'Content-Type': 'application/json'}
+        response = self.http.post(api_url, headers=headers,
+                                  json={'target': full_url})
+        response.raise_for_status()
+        short_url = response.json()['link']
+        self._time('shorten', started)
+
+        self._remember(server, formatting, text, full_url, short_url)
+        return short_url
+
+    def stats(self):
+        stats = {}
+        for stage, timings in self.timings.items():
+            timings = list(timings)
+            stats[stage] = (len(timings),
+                            sum(timings) / len(timings) if timings else 0.0,
+                            max(timings) if timings else 0.0)
+        stats['links'] = len(self._links)
+        return stats
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,148 @@
+###
+# Copyright (c) 2023, Solareon
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import threading
+import time
+from collections import deque
+
+
+class Command(object):
+    """Describes how a command talks to the API and delivers the reply.
+
+    max_tokens of None sends openai.maxtokens to completion models and no
+    limit to chat models.  paste is the PrivateBin formatting to paste the
+    reply with, or None to send it to IRC, streamed when stream is set and
+    the channel allows it.  memory keeps the conversation as context and
+    strip strips each choice's text."""
+
+    def __init__(self, name, model, chat=False, max_tokens=None,
+                 stream=False, memory=False, paste=None, strip=True):
+        self.name = name
+        self.model = model
+        self.chat = chat
+        self.max_tokens = max_tokens
+        self.stream = stream
+        self.memory = memory
+        self.paste = paste
+        self.strip = strip
+
+    def text(self, choice):
+        if self.chat:
+            return choice.message.content
+        return choice.text
+
+    def delta(self, choice):
+        if self.chat:
+            return choice.delta.get('content')
+        return choice.text
+
+
+class Trace(object):
+    """Times the stages of a single request, each mark closing the stage
+    that started at the previous one"""
+    __slots__ = ('command', 'source', 'tokens', 'started', 'stages', '_last')
+
+    def __init__(self, command):
+        self.command = command
+        self.source = 'api'
+        self.tokens = 0
+        self.started = self._last = time.perf_counter()
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def tokens_per_second(self):
+        api = self.stages.get('api')
+        if self.source != 'api' or not api or not self.tokens:
+            return 0.0
+        return self.tokens / api
+
+
+class _CommandStats(object):
+    __slots__ = ('requests', 'sources', 'tokens', 'api_time', 'timings')
+
+    def __init__(self, maxlen):
+        self.requests = 0
+        self.sources = {'api': 0, 'cache': 0, 'shared': 0}
+        self.tokens = 0
+        self.api_time = 0.0
+        self.timings = dict((stage, deque(maxlen=maxlen))
+                            for stage in PipelineStats.STAGES)
+
+
+class PipelineStats(object):
+    """Keeps request counts, token throughput and the latest timings of
+    each stage per command"""
+
+    STAGES = ('build', 'api', 'format', 'deliver')
+
+    def __init__(self, maxlen=100):
+        self.maxlen = maxlen
+        self._commands = {}
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        with self._lock:
+            stats = self._commands.get(trace.command)
+            if stats is None:
+                stats = self._commands[trace.command] = \
+                    _CommandStats(self.maxlen)
+            stats.requests += 1
+            stats.sources[trace.source] += 1
+            for stage, elapsed in trace.stages.items():
+                stats.timings[stage].append(elapsed)
+            if trace.source == 'api' and trace.tokens:
+                stats.tokens += trace.tokens
+                stats.api_time += trace.stages.get('api', 0.0)
+
+    def stats(self):
+        """Returns {command: {'requests', 'api', 'cache', 'shared',
+        'tokens', 'tokens_per_second', stage: (avg, p95)}}"""
+        result = {}
+        with self._lock:
+            for command, stats in self._commands.items():
+                entry = dict(stats.sources)
+                entry['requests'] = stats.requests
+                entry['tokens'] = stats.tokens
+                entry['tokens_per_second'] = (stats.tokens / stats.api_time
+                                              if stats.api_time else 0.0)
+                for stage, timings in stats.timings.items():
+                    timings = sorted(timings)
+                    entry[stage] = (
+                        sum(timings) / len(timings) if timings else 0.0,
+                        timings[int(len(timings) * 0.95)] if timings else 0.0)
+                result[command] = entry
+        return result
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -29,13 +29,17 @@
 ###
 
 import re
-import openai
-import privatebinapi
-import requests
+import time
+import functools
+from collections import deque
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
-from supybot import utils, plugins, ircutils, callbacks
+from supybot import conf, utils, plugins, ircutils, callbacks, world
 from supybot.commands import *
+
+from . import cache, httpclient, limits, memory, metrics, paste, pipeline
+from . import splitter, workers
 try:
     from supybot.i18n import PluginInternationalization
     _ = PluginInternationalization('ChatGPT')
@@ -45,55 +49,348 @@ except ImportError:
     _ = lambda x: x
 
 
+CHATGPT = pipeline.Command('chatgpt', 'gpt-3.5-turbo', chat=True, stream=True,
+                           memory=True)
+GPT3 = pipeline.Command('gpt3', 'text-davinci-003', stream=True)
+CODEX = pipeline.Command('codex', 'code-davinci-002', max_tokens=512,
+                         paste='markdown', strip=False)
+CODEXL = pipeline.Command('codexl', 'code-davinci-002', max_tokens=512,
+                          paste='markdown', strip=False)
+
+
 class ChatGPT(callbacks.Plugin):
     """A plugin to provide responses via ChatGPT's API"""
     threaded = True
 
-    def get_completion(self, irc, model, max_tokens, message):
-        openai.api_key = self.registryValue('openai.api.key')
-        if not openai.api_key:
-            irc.error('Missing API key, ask the admin to get one and set '
-                      'supybot.plugins.ChatGPT.openai.api.key', Raise=True)
-        
-        try:
-            completion = openai.Completion.create(model=model,prompt=message,max_tokens=max_tokens)
-            return completion
-        except Exception:
-            raise
+    def __init__(self, irc):
+        self.__parent = super(ChatGPT, self)
+        self.__parent.__init__(irc)
+        self.metric_registry = metrics.Registry('chatgpt')
+        self.http = httpclient.HTTPClient(
+            self.registryValue('http.timeout.connect'),
+            self.registryValue('http.timeout.read'),
+            self.registryValue('http.retries'),
+            metrics=self.metric_registry)
+        # Seconds from request to first line sent for the latest streamed
+        # replies
+        self.first_line_times = deque(maxlen=100)
+        self.conversations = memory.ConversationStore(
+            self.registryValue('memory.conversations'),
+            self.registryValue('memory.idle'))
+        path = None
+        if self.registryValue('cache.persist'):
+            path = conf.supybot.directories.data.dirize('ChatGPT.sqlite')
+        self.responses = cache.ResponseCache(self.registryValue('cache.size'),
+                                             path)
+        self.coalescer = limits.Coalescer()
+        self.pastes = paste.PastePipeline(self.http,
+                                          metrics=self.metric_registry)
+        self.limiter = limits.RateLimiter()
+        self.stats = pipeline.PipelineStats()
+        self.workers = None
+        if self.registryValue('workers.enable'):
+            self.workers = workers.WorkerPool(self.name(),
+                self.registryValue('workers.threads'),
+                self.registryValue('workers.queue'))
+            # Commands are handed to the pool instead of a thread each
+            self.threaded = False
+        self.metric_registry.collect(self.collect_metrics)
+        self.exporter = None
+        port = self.registryValue('metrics.port')
+        if port:
+            try:
+                self.exporter = metrics.Exporter(
+                    self.metric_registry, self.registryValue('metrics.host'),
+                    port)
+            except OSError as e:
+                self.log.error('ChatGPT: cannot serve metrics on port %s: %s',
+                               port, e)
+
+    def die(self):
+        self.responses.close()
+        if self.workers is not None:
+            self.workers.stop()
+        self.http.close()
+        if self.exporter is not None:
+            self.exporter.close()
+        self.__parent.die()
+
+    def collect_metrics(self):
+        # Cache statistics the plugin already keeps, read when metrics are
+        stats = self.responses.stats()
+        yield ('counter', 'cache_hits_total', {'cache': 'response'},
+               stats['hits'])
+        yield ('counter', 'cache_misses_total', {'cache': 'response'},
+               stats['misses'])
+        yield ('gauge', 'cache_entries', {'cache': 'response'}, stats['size'])
+        yield ('gauge', 'cache_entries', {'cache': 'paste'},
+               self.pastes.stats()['links'])
 
-    def get_chatgpt(self, irc, model, message):
-        openai.api_key = self.registryValue('openai.api.key')
-        max_tokens = self.registryValue('openai.maxtokens')
-        if not openai.api_key:
+    def _timeCommand(self, command, irc, msg, *args, **kwargs):
+        with self.metric_registry.timed('command', command=' '.join(command)):
+            return self.__parent._callCommand(command, irc, msg, *args,
+                                              **kwargs)
+
+    def _callCommand(self, command, irc, msg, *args, **kwargs):
+        if self.workers is None:
+            return self._timeCommand(command, irc, msg, *args, **kwargs)
+        call = functools.partial(self._timeCommand, command, irc, msg,
+                                 *args, **kwargs)
+        if not self.workers.submit((irc.network, msg.channel or msg.nick),
+                                   call):
+            irc.error('Too busy right now, try again later.')
+
+    def create_completion(self, irc, command, prompt, max_tokens,
+                          stream=False, history=()):
+        # The key goes with each request rather than into the module-wide
+        # openai.api_key
+        api_key = self.registryValue('openai.api.key')
+        if not api_key:
             irc.error('Missing API key, ask the admin to get one and set '
                       'supybot.plugins.ChatGPT.openai.api.key', Raise=True)
-        
+
+        # Imported on the first completion, it's the slowest part of loading
+        # the plugin otherwise
+        import openai
+        # Streamed completions are timed until the response starts
+        with self.metric_registry.timed(
+                'upstream', host=urlsplit(openai.api_base).hostname):
+            if command.chat:
+                messages = list(history) + [{"role": "user",
+                                             "content": prompt}]
+                return openai.ChatCompletion.create(model=command.model,
+                    messages=messages, stream=stream, api_key=api_key,
+                    request_timeout=self.http.timeout)
+            return openai.Completion.create(model=command.model,
+                prompt=prompt, max_tokens=max_tokens, stream=stream,
+                api_key=api_key, request_timeout=self.http.timeout)
+
+    def complete(self, irc, msg, command, prompt):
+        """Answers prompt as described by command: looks up the cache and
+        conversation, calls the API, cleans up the reply and sends it to IRC
+        or a paste, timing each stage"""
+        trace = pipeline.Trace(command.name)
+        max_tokens = command.max_tokens
+        if max_tokens is None and not command.chat:
+            max_tokens = self.registryValue('openai.maxtokens')
+        key = self.conversation_key(irc, msg) if command.memory else None
+        history = self.conversations.context(key) if key else []
+        stream = command.stream and self.registryValue('openai.stream',
+                                                       msg.channel,
+                                                       irc.network)
+
+        # Answers depend on the conversation so far, only cache fresh ones
+        reply = None
+        if not history:
+            reply = self.get_cached(irc, msg, command.model, prompt,
+                                    max_tokens)
+        if reply is not None:
+            trace.source = 'cache'
+            trace.mark('build')
+        else:
+            if command.paste:
+                self.warm_paste()
+            trace.mark('build')
+
+            def fetch():
+                completion = self.create_completion(irc, command, prompt,
+                                                    max_tokens, stream,
+                                                    history)
+                if stream:
+                    text = self.stream_completion(irc, completion,
+                                                  trace.started, command.delta)
+                    return [text], None
+                return ([command.text(choice) for choice in completion.choices],
+                        completion.get('usage'))
+
+            (texts, usage), shared = self.run_completion(irc, msg,
+                command.model, prompt, max_tokens, fetch, history)
+            trace.mark('api')
+            if shared:
+                trace.source = 'shared'
+            if command.strip:
+                texts = [text.strip() for text in texts]
+            reply = ''.join(texts)
+            if usage:
+                trace.tokens = usage['completion_tokens']
+                for kind in ('prompt', 'completion'):
+                    self.metric_registry.inc('openai_tokens_total',
+                                             usage[kind + '_tokens'],
+                                             model=command.model, type=kind)
+            else:
+                # Streamed completions come without usage, their tokens are
+                # estimated and counted apart from those OpenAI reports
+                trace.tokens = memory.estimate_tokens(reply)
+                self.metric_registry.inc('openai_estimated_tokens_total',
+                                         trace.tokens, model=command.model,
+                                         type='completion')
+            trace.mark('format')
+
+        # Streamed replies went out while they arrived, as part of the API
+        # stage
+        if command.paste:
+            self.send_paste(irc, command.paste, reply)
+        elif trace.source != 'api' or not stream:
+            self.send_reply(irc, reply.replace('\n', ' '))
+        trace.mark('deliver')
+
+        if trace.source == 'api' and not history:
+            self.set_cached(irc, msg, command.model, prompt, max_tokens,
+                            reply)
+        if key and reply:
+            self.conversations.add(key, prompt, reply,
+                                   self.registryValue('memory.tokens'))
+
+        self.stats.record(trace)
+        for stage, elapsed in trace.stages.items():
+            self.metric_registry.observe('stage_seconds', elapsed,
+                                         command=command.name, stage=stage)
+        self.log.info('ChatGPT: command=%s source=%s %s tokens=%s '
+                      'tokens_per_s=%s', command.name, trace.source,
+                      ' '.join('%s_ms=%s' % (stage,
+                                             round(trace.stages[stage] * 1000, 1))
+                               for stage in pipeline.PipelineStats.STAGES
+                               if stage in trace.stages),
+                      trace.tokens, round(trace.tokens_per_second(), 1))
+
+    def get_cached(self, irc, msg, model, prompt, max_tokens):
+        if not self.registryValue('cache.enable', msg.channel, irc.network):
+            return None
+        return self.responses.get(model, prompt, max_tokens)
+
+    def set_cached(self, irc, msg, model, prompt, max_tokens, response):
+        if self.registryValue('cache.enable', msg.channel, irc.network):
+            self.responses.set(model, prompt, max_tokens, response,
+                               self.registryValue('cache.ttl'))
+
+    def wait_for_limits(self, irc, msg, tokens):
+        # Requests over the limits are queued by sleeping until the buckets
+        # have room, unless that would take longer than limits.maxwait
+        buckets = [(('global',), self.registryValue('limits.global.requests'),
+                    self.registryValue('limits.global.tokens'))]
+        if msg.channel:
+            buckets.append((('channel', irc.network, msg.channel),
+                            self.registryValue('limits.channel.requests'),
+                            self.registryValue('limits.channel.tokens')))
+        buckets.append((('nick', irc.network, msg.nick),
+                        self.registryValue('limits.nick.requests'),
+                        self.registryValue('limits.nick.tokens')))
+
+        delay = self.limiter.acquire(buckets, tokens,
+                                     self.registryValue('limits.maxwait'))
+        if delay is None:
+            irc.error('Too many requests, try again later.', Raise=True)
+        if delay:
+            time.sleep(delay)
+
+    def run_completion(self, irc, msg, model, prompt, max_tokens, fetch,
+                       history=()):
+        """Calls fetch for the reply once the rate limits allow it, sharing
+        a single call between identical prompts in flight.  Returns (reply,
+        shared), shared being True when another command made the call."""
+        tokens = memory.estimate_tokens(prompt) + (max_tokens or
+                 self.registryValue('openai.maxtokens'))
+        for message in history:
+            tokens += memory.estimate_tokens(message['content'])
+
+        def limited():
+            self.wait_for_limits(irc, msg, tokens)
+            return fetch()
+
+        if history:
+            return limited(), False
+        return self.coalescer.run(cache.cache_key(model, prompt, max_tokens),
+                                  limited)
+
+    def conversation_key(self, irc, msg):
+        # Conversations are kept per nick in each channel, or for the whole
+        # channel when memory.shared is set
+        if not self.registryValue('memory.enable', msg.channel, irc.network):
+            return None
+        if msg.channel and self.registryValue('memory.shared', msg.channel,
+                                              irc.network):
+            return (irc.network, msg.channel, None)
+        return (irc.network, msg.channel, msg.nick)
+
+    def reply_budget(self, irc, **kwargs):
+        # Bytes left for text in a reply once the prefix the server adds
+        # when relaying, the target, the nick prefix and CRLF are counted
         try:
-            completion = openai.ChatCompletion.create(model=model,messages=[{"role": "user", "content": message}])
-            return completion
-        except Exception:
-            raise
+            return 512 - irc._replyOverhead(irc.msg, **kwargs)
+        except AttributeError:
+            # Older Limnoria, assume a long hostmask if ours isn't known yet
+            prefix = irc.prefix or irc.nick + '!' + 'u' * 10 + '@' + 'h' * 63
+            target = irc.msg.channel or irc.msg.nick
+            overhead = len(':{prefix} PRIVMSG {target} :\r\n'.format(
+                prefix=prefix, target=target).encode('utf-8'))
+            if kwargs.get('prefixNick', True) and irc.msg.channel:
+                overhead += len(irc.msg.nick.encode('utf-8')) + 2
+            return 512 - overhead
+
+    def line_splitter(self, irc):
+        return splitter.LineSplitter(self.reply_budget(irc, prefixNick=False),
+                                     self.reply_budget(irc))
 
     def send_reply(self, irc, message):
-        if len(message) > 400:
-            split_index = message[:400].rfind(".")+1
-            if split_index == -1: # If no space or dot found before the 400th character
-                split_index = 399 # Split at the 399th character
-            irc.reply(message[:split_index].strip())
-            remaining_message = message[split_index:]
-            while len(remaining_message) > 400:
-                split_index = message[:400].rfind(".")+1
-                if split_index == -1:
-                    split_index = 399
-                irc.reply(remaining_message[:split_index].strip(), prefixNick=False)
-                remaining_message = remaining_message[split_index:]
-            irc.reply(remaining_message.strip(), prefixNick=False)
-        else:
-            irc.reply(message)
+        self.send_lines(irc, self.line_splitter(irc).split(message))
+
+    def stream_reply(self, irc, chunks, started):
+        """Sends streamed completion text line by line as soon as each line
+        is complete"""
+        line_splitter = self.line_splitter(irc)
+
+        def lines():
+            for chunk in chunks:
+                for line in line_splitter.feed(chunk.replace('\n', ' ')):
+                    yield line
+            for line in line_splitter.flush():
+                yield line
+
+        self.send_lines(irc, lines(), started)
+
+    def stream_completion(self, irc, completion, started, text):
+        """Streams a completion to IRC and returns its full text, text gets
+        the text out of each chunk's choice"""
+        parts = []
 
-    def get_paste(self, irc, highlight, message):
+        def chunks():
+            for chunk in completion:
+                part = text(chunk.choices[0]) or ''
+                parts.append(part)
+                yield part
+
+        self.stream_reply(irc, chunks(), started)
+        return ''.join(parts).strip()
+
+    def send_lines(self, irc, lines, started=None):
+        sent = False
+        for line in lines:
+            if not sent:
+                if started is not None:
+                    self.record_first_line(started)
+                irc.reply(line)
+                sent = True
+            else:
+                irc.reply(line, prefixNick=False)
+        if not sent:
+            irc.error('The API returned an empty response.')
+
+    def record_first_line(self, started):
+        elapsed = time.perf_counter() - started
+        self.first_line_times.append(elapsed)
+        self.log.info('ChatGPT: first streamed line after %.2fs', elapsed)
+
+    def warm_paste(self):
+        # Opens a connection to PrivateBin and fetches its version while the
+        # completion is still running
+        pb_url = self.registryValue('privatebin.url')
+        if pb_url and not self.pastes.warmed(pb_url):
+            world.SupyThread(target=self.pastes.warm, args=(pb_url,),
+                             name='ChatGPT paste warmup').start()
+
+    def send_paste(self, irc, highlight, message):
         shorten = self.registryValue('shorten.enable')
-        shorten_url = self.registryValue('shorten.url')+"/api/v2/links"
+        shorten_url = self.registryValue('shorten.url')
         shorten_api = self.registryValue('shorten.api.key')
         pb_url = self.registryValue('privatebin.url')
 
@@ -104,52 +401,64 @@ class ChatGPT(callbacks.Plugin):
         if shorten and not shorten_url:
             irc.error('Missing Kutt URL, ask the admin to get one and set '
                       'supybot.plugins.ChatGPT.shorten.url', Raise=True)
-            
+
+        full_url = self.pastes.upload(pb_url, message, highlight)
+        if not shorten:
+            irc.reply(full_url)
+            return
+
+        # With followup, the long link goes out right away and the short one
+        # follows once Kutt answers
+        followup = self.registryValue('shorten.followup', irc.msg.channel,
+                                      irc.network)
+        cached_url, short_url = self.pastes.lookup(pb_url, highlight,
+                                                   message)
+        if short_url:
+            irc.reply(short_url)
+            return
+        if followup:
+            irc.reply(full_url)
+
         try:
-            send_response = privatebinapi.send(pb_url, text=message, expiration="never", formatting=highlight)
-            #get_response = privatebinapi.get(send_response["full_url"])
-            
-            if shorten:
-                payload = {"target": send_response["full_url"]}
-                headers = {'X-API-KEY': shorten_api,'Content-Type': 'application/json'}
-                response = requests.post(shorten_url, headers=headers, json=payload).json()
-                short = response['link']
-                return short
-            
-            return send_response["full_url"]
+            short_url = self.pastes.shorten(shorten_url + "/api/v2/links",
+                                            shorten_api, pb_url, highlight,
+                                            message, full_url)
         except Exception:
-            raise
+            self.log.exception('ChatGPT: shortening %s failed', full_url)
+            if not followup:
+                irc.reply(full_url)
+            return
 
+        if followup:
+            irc.reply(short_url, prefixNick=False)
+        else:
+            irc.reply(short_url)
 
     def chatgpt(self, irc, msg, args, message):
         """<prompt>
 
         Returns ChatGPT response to prompt"""
-        model = "gpt-3.5-turbo"
+        self.complete(irc, msg, CHATGPT, message)
 
-        completion = self.get_chatgpt(irc, model, message)
-        messages = ""
-        for choice in completion.choices:
-            messages += choice.message.content.strip()
-        messages = messages.replace('\n', ' ')
+    chatgpt = wrap(chatgpt, ['text'])
 
-        self.send_reply(irc, messages)
+    def forget(self, irc, msg, args):
+        """takes no arguments
 
-    chatgpt = wrap(chatgpt, ['text'])
+        Forgets your conversation with ChatGPT, or the channel's one if
+        conversations are shared"""
+        key = self.conversation_key(irc, msg)
+        if not key or not self.conversations.forget(key):
+            irc.error('There is no conversation to forget.', Raise=True)
+        irc.replySuccess()
+
+    forget = wrap(forget)
 
     def gpt3(self, irc, msg, args, message):
         """<prompt>
 
         Returns text-davinci-003 response to prompt"""
-        model = "text-davinci-003"
-        max_tokens = self.registryValue('openai.maxtokens')
-        completion = self.get_completion(irc, model, max_tokens, message)
-        messages = ""
-        for choice in completion.choices:
-            messages += choice.text.strip()
-        messages = messages.replace('\n', ' ')
-
-        self.send_reply(irc, messages)
+        self.complete(irc, msg, GPT3, message)
 
     gpt3 = wrap(gpt3, ['text'])
 
@@ -157,16 +466,7 @@ class ChatGPT(callbacks.Plugin):
         """<prompt>
 
         Returns Codex response to prompt"""
-        model = "code-davinci-002"
-        
-        max_tokens = 512
-        completion = self.get_completion(irc, model, max_tokens, message)
-        messages = ""
-        for choice in completion.choices:
-            messages += choice.text
-        highlight = "markdown"
-        paste = self.get_paste(irc, highlight, messages)
-        irc.reply(paste)
+        self.complete(irc, msg, CODEX, message)
 
     codex = wrap(codex, ['text'])
 
@@ -174,18 +474,121 @@ class ChatGPT(callbacks.Plugin):
         """<prompt>
 
         Returns Codex response to prompt"""
-        model = "code-davinci-002"
-        
-        max_tokens = 512
-        completion = self.get_completion(irc, model, max_tokens, message)
-        messages = ""
-        for choice in completion.choices:
-            messages += choice.text
-        highlight = "markdown"
-        paste = self.get_paste(irc, highlight, messages)
-        irc.reply(paste)
+        self.complete(irc, msg, CODEXL, message)
 
     codexl = wrap(codexl, ['text'])
+
+    def cachestats(self, irc, msg, args):
+        """takes no arguments
+
+        Returns response cache statistics"""
+        stats = self.responses.stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / lookups * 100 if lookups else 0.0
+        stored = ''
+        if stats['stored'] is not None:
+            stored = ', {stored} stored on disk'.format(**stats)
+
+        irc.reply("Response cache: {size}/{maxsize} entries in memory{stored}, "
+                  "{hits} hits, {misses} misses ({hit_rate:.1f}% hit "
+                  "rate)".format(stored=stored, hit_rate=hit_rate,
+                                 size=stats['size'], maxsize=stats['maxsize'],
+                                 hits=stats['hits'], misses=stats['misses']))
+
+    cachestats = wrap(cachestats, ['admin'])
+
+    def cacheflush(self, irc, msg, args):
+        """takes no arguments
+
+        Removes every cached response"""
+        count = self.responses.flush()
+        irc.reply("Flushed {count} cached responses.".format(count=count))
+
+    cacheflush = wrap(cacheflush, ['admin'])
+
+    def pastestats(self, irc, msg, args):
+        """takes no arguments
+
+        Returns paste and shortening latency per stage"""
+        stats = self.pastes.stats()
+        stages = []
+        for stage in paste.PastePipeline.STAGES:
+            count, avg, max_ = stats[stage]
+            stages.append("{stage}: {count} calls, {avg:.0f}ms avg, "
+                          "{max:.0f}ms max".format(stage=stage, count=count,
+                                                   avg=avg * 1000,
+                                                   max=max_ * 1000))
+        irc.reply("{stages}; {links} cached links".format(
+            stages='; '.join(stages), links=stats['links']))
+
+    pastestats = wrap(pastestats, ['admin'])
+
+    def pipelinestats(self, irc, msg, args):
+        """takes no arguments
+
+        Returns per command request counts, token throughput, the average
+        and 95th percentile time of each stage, and the time to the first
+        line of streamed replies"""
+        stats = self.stats.stats()
+        if not stats:
+            irc.reply('No requests yet.')
+            return
+
+        replies = []
+        for command, entry in sorted(stats.items()):
+            stages = ', '.join('{stage} {avg:.0f}/{p95:.0f}ms'.format(
+                stage=stage, avg=entry[stage][0] * 1000,
+                p95=entry[stage][1] * 1000)
+                for stage in pipeline.PipelineStats.STAGES)
+            replies.append("{command}: {requests} requests ({cache} cached, "
+                           "{shared} shared), {tokens_per_second:.1f} "
+                           "tokens/s, {stages}".format(command=command,
+                                                       stages=stages, **entry))
+        times = sorted(self.first_line_times)
+        if times:
+            replies.append("first streamed line: {count} replies, {p50:.0f}ms "
+                           "p50, {p95:.0f}ms p95".format(
+                               count=len(times),
+                               p50=times[len(times) // 2] * 1000,
+                               p95=times[int(len(times) * 0.95)] * 1000))
+        irc.replies(replies)
+
+    pipelinestats = wrap(pipelinestats, ['admin'])
+
+    def workerstats(self, irc, msg, args):
+        """takes no arguments
+
+        Returns worker pool queue depth and wait times"""
+        if self.workers is None:
+            irc.error('The worker pool is disabled, commands run in their own '
+                      'threads.', Raise=True)
+
+        stats = self.workers.stats()
+        irc.reply("Worker pool: {busy}/{threads} busy, {queued}/{maxqueued} "
+                  "queued from {keys} channels, {completed} done, {rejected} "
+                  "rejected, waited {avg:.0f}ms avg, {p95:.0f}ms p95, "
+                  "{max:.0f}ms max".format(avg=stats['wait_avg'] * 1000,
+                                           p95=stats['wait_p95'] * 1000,
+                                           max=stats['wait_max'] * 1000,
+                                           **stats))
+
+    workerstats = wrap(workerstats, ['admin'])
+
+    def metrics(self, irc, msg, args, name):
+        """[<name>]
+
+        Returns the command, upstream request, token and cache metrics whose
+        name contains <name>, also served at /metrics when
+        plugins.ChatGPT.metrics.port is set. Streamed replies carry no
+        usage, their completion tokens are estimated in
+        openai_estimated_tokens_total."""
+        lines = self.metric_registry.summary(name or '')
+        if not lines:
+            irc.error('No such metric.', Raise=True)
+
+        irc.replies(lines, joiner=' | ')
+
+    metrics = wrap(metrics, ['admin', optional('something')])
     
 
 Class = ChatGPT
@@ -0,0 +1,123 @@
+###
+# Copyright (c) 2023, Solareon
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""Splits text into IRC lines by their UTF-8 size.
+
+IRC limits lines to 512 bytes, so line budgets are in bytes rather than
+characters.  Text is encoded once and cut by index, which keeps splitting
+linear in the length of the text."""
+
+SENTENCE_ENDS = (b'. ', b'! ', b'? ')
+
+
+def _cut(data, start, budget):
+    """Returns (end, resume) for the line starting at start: the line is
+    data[start:end] and the next one starts at resume."""
+    limit = start + budget
+    if len(data) <= limit:
+        return len(data), len(data)
+
+    # Prefer the last sentence boundary, unless it would leave the line
+    # less than half full
+    sentence = max(data.rfind(end, start, limit + 1) for end in SENTENCE_ENDS)
+    if sentence >= 0 and sentence + 1 - start >= budget // 2:
+        return sentence + 1, sentence + 2
+
+    space = data.rfind(b' ', start, limit + 1)
+    if space > start:
+        return space, space + 1
+
+    # Hard split, backing off so a multi-byte character isn't cut
+    end = limit
+    while end > start and data[end] & 0xC0 == 0x80:
+        end -= 1
+    if end == start:
+        # Budget smaller than a single character, send it on its own
+        end = start + 1
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end += 1
+    return end, end
+
+
+class LineSplitter(object):
+    """Incrementally splits text into lines of at most budget bytes.
+
+    Text is fed as it arrives and complete lines are returned as soon as
+    the buffered text no longer fits a single line.  The first line may have
+    its own budget, for the nick prefix on replies."""
+
+    def __init__(self, budget, first_budget=None):
+        self.budget = budget
+        self.first_budget = budget if first_budget is None else first_budget
+        self.lines = 0
+        self._buffer = bytearray()
+
+    def _next_budget(self):
+        return self.first_budget if self.lines == 0 else self.budget
+
+    def _split(self, final):
+        lines = []
+        data = self._buffer
+        start = 0
+        while start < len(data):
+            budget = self._next_budget()
+            if not final and len(data) - start <= budget:
+                break
+            end, resume = _cut(data, start, budget)
+            line = data[start:end].decode('utf-8').strip()
+            start = resume
+            if line:
+                lines.append(line)
+                self.lines += 1
+        del data[:start]
+        return lines
+
+    def feed(self, text):
+        """Buffers text and returns the lines it completed"""
+        self._buffer += text.encode('utf-8')
+        return self._split(final=False)
+
+    def flush(self):
+        """Returns the remaining buffered text as lines"""
+        return self._split(final=True)
+
+    def split(self, text):
+        """Returns text and anything already buffered as lines"""
+        self._buffer += text.encode('utf-8')
+        return self.flush()
+
+
+def split_lines(text, budget, first_budget=None):
+    """Splits text into lines of at most budget UTF-8 bytes, or first_budget
+    for the first line"""
+    return LineSplitter(budget, first_budget).split(text)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -28,11 +28,517 @@
 
 ###
 
+import itertools
+import json
+import random
+import time
+import unittest
+
+import openai
+
 from supybot.test import *
 
+from . import bench, cache, limits, memory, paste, splitter
+
+
+def chat_chunks(text, size=7):
+    """Splits text into streamed ChatCompletion chunks"""
+    return [openai.util.convert_to_openai_object(
+                {'choices': [{'index': 0, 'delta': {'content': text[i:i+size]}}]})
+            for i in range(0, len(text), size)]
+
+
+def random_text(rng, length):
+    """Random text mixing ASCII words, sentences, multi-byte characters and
+    overlong words"""
+    pieces = []
+    size = 0
+    while size < length:
+        kind = rng.random()
+        if kind < 0.6:
+            piece = ''.join(rng.choice('abcdefghij') for _ in range(rng.randint(1, 12)))
+        elif kind < 0.75:
+            piece = ''.join(rng.choice('\u00e9\u4e2d\U0001f600') for _ in range(rng.randint(1, 6)))
+        elif kind < 0.9:
+            piece = rng.choice('.!?,')
+        elif kind < 0.97:
+            piece = rng.choice(' \t') * rng.randint(1, 3)
+        else:
+            piece = 'x' * rng.randint(50, 600)
+        pieces.append(piece)
+        pieces.append(' ' if rng.random() < 0.8 else '')
+        size += len(piece) + 1
+    return ''.join(pieces)
+
+
+class SplitterTestCase(SupyTestCase):
+    def assertSplit(self, text, budget, first_budget, lines):
+        for i, line in enumerate(lines):
+            limit = first_budget if i == 0 else budget
+            self.assertLessEqual(len(line.encode('utf-8')), limit)
+            self.assertTrue(line)
+            self.assertEqual(line, line.strip())
+        # Only whitespace is ever dropped or added
+        self.assertEqual(''.join(''.join(lines).split()), ''.join(text.split()))
+
+    def testSplitProperties(self):
+        rng = random.Random(1234)
+        for _ in range(300):
+            text = random_text(rng, rng.randint(0, 3000))
+            budget = rng.randint(4, 500)
+            first_budget = rng.randint(4, budget)
+            lines = splitter.split_lines(text, budget, first_budget)
+            self.assertSplit(text, budget, first_budget, lines)
+
+    def testStreamingMatchesBatch(self):
+        rng = random.Random(4321)
+        for _ in range(100):
+            text = random_text(rng, rng.randint(0, 3000))
+            budget = rng.randint(4, 500)
+            line_splitter = splitter.LineSplitter(budget)
+            lines = []
+            position = 0
+            while position < len(text):
+                size = rng.randint(1, 20)
+                lines += line_splitter.feed(text[position:position+size])
+                position += size
+            lines += line_splitter.flush()
+            self.assertEqual(lines, splitter.split_lines(text, budget))
+
+    def testSplitPrefersSentences(self):
+        text = 'First sentence here. Second one follows it closely'
+        self.assertEqual(splitter.split_lines(text, 30),
+                         ['First sentence here.', 'Second one follows it closely'])
+        self.assertEqual(splitter.split_lines('words only ' * 4, 16),
+                         ['words only words', 'only words only', 'words only'])
+        self.assertEqual(splitter.split_lines('\u00e9' * 5, 3),
+                         ['\u00e9', '\u00e9', '\u00e9', '\u00e9', '\u00e9'])
+
+    def testSplitBenchmark(self):
+        # Splitting must stay linear: 16 times the text may not take
+        # anywhere near 256 times as long
+        text = random_text(random.Random(99), 4096)
+        timings = []
+        for repeat in (1, 16):
+            started = time.perf_counter()
+            for _ in range(5):
+                splitter.split_lines(text * repeat, 450)
+            timings.append((time.perf_counter() - started) / 5)
+        size = len(text.encode('utf-8'))
+        log.info('splitter: %s bytes in %sms, %s bytes in %sms',
+                 size, round(timings[0] * 1000, 3),
+                 size * 16, round(timings[1] * 1000, 3))
+        self.assertLess(timings[1], timings[0] * 64)
+
+
+class MemoryTestCase(SupyTestCase):
+    def testTrimSummarizesOldTurns(self):
+        store = memory.ConversationStore(10, 60)
+        for i in range(20):
+            store.add('key', 'Question number %s. With details' % i,
+                      'Answer number %s. ' % i + 'blah ' * 20, 200)
+        messages = store.context('key')
+        self.assertEqual(messages[0]['role'], 'system')
+        self.assertRegex(messages[0]['content'],
+                         r'(user: Question|assistant: Answer) number 1\d\.$')
+        self.assertEqual(messages[-1]['content'].split('.')[0],
+                         'Answer number 19')
+        tokens = sum(memory.estimate_tokens(m['content']) for m in messages)
+        self.assertLessEqual(tokens, 200)
+
+    def testStoreIsBounded(self):
+        store = memory.ConversationStore(3, 60)
+        for i in range(10):
+            store.add(i, 'hi', 'hello', 100)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.context(0), [])
+        self.assertEqual(len(store.context(9)), 2)
+        store.idle = -1
+        self.assertEqual(store.context(9), [])
+        self.assertEqual(len(store), 0)
+
+
+class LimitsTestCase(SupyTestCase):
+    def testCoalescerSharesCall(self):
+        coalescer = limits.Coalescer()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'answer'
+
+        def run():
+            results.append(coalescer.run('key', call))
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while coalescer.shared < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [('answer', False), ('answer', True),
+                                           ('answer', True)])
+
+    def testRateLimiterQueues(self):
+        limiter = limits.RateLimiter()
+        buckets = [('nick', 2, 0), ('global', 60, 1000)]
+        self.assertEqual(limiter.acquire(buckets, 100, 30), 0)
+        self.assertEqual(limiter.acquire(buckets, 100, 30), 0)
+        # The nick's bucket is empty, the next request waits for a refill
+        self.assertAlmostEqual(limiter.acquire(buckets, 100, 60), 30, 0)
+        self.assertIsNone(limiter.acquire(buckets, 100, 30))
+        self.assertEqual(limiter.rejections, 1)
+        self.assertIsNone(limiter.acquire([('global', 60, 1000)], 900, 1))
+
+
+class FakeResponse(object):
+    def __init__(self, url, data):
+        self.url = url
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakePasteHTTP(object):
+    """Stands in for PrivateBin and Kutt, recording each request"""
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append(('get', url))
+        return FakeResponse(url, {'@context': {'v': {'@value': 2}}})
+
+    def post(self, url, **kwargs):
+        self.requests.append(('post', url))
+        if 'json' in kwargs:
+            return FakeResponse(url, {'link': 'https://kutt.test/abc'})
+        return FakeResponse(url, {'status': 0, 'id': 'p%s' %
+                                  len(self.requests)})
+
+
+# Client libraries the plugin should only import once a command needs them
+CLIENT_MODULES = ('openai', 'pbincli', 'privatebinapi', 'requests', 'urllib3')
+
+
+class StartupTestCase(SupyTestCase):
+    def testLoadSkipsClientLibraries(self):
+        modules = bench.load_plugin('ChatGPT')['modules']
+        self.assertEqual([module for module in CLIENT_MODULES
+                          if module in modules], [])
+
 
 class ChatGPTTestCase(PluginTestCase):
     plugins = ('ChatGPT',)
+    config = {'supybot.plugins.ChatGPT.openai.api.key': 'sk-test'}
+
+    def setUp(self):
+        super().setUp()
+        self._chat_create = openai.ChatCompletion.create
+        self._create = openai.Completion.create
+        self.chat_requests = []
+
+    def tearDown(self):
+        openai.ChatCompletion.create = self._chat_create
+        openai.Completion.create = self._create
+        super().tearDown()
+
+    def fakeChat(self, text):
+        def create(**kwargs):
+            self.chat_requests.append(kwargs)
+            if kwargs.get('stream'):
+                return iter(chat_chunks(text))
+            return openai.util.convert_to_openai_object({'choices': [
+                {'index': 0, 'message': {'role': 'assistant', 'content': text}}]})
+        openai.ChatCompletion.create = create
+
+    def fakeCompletion(self, text):
+        def create(**kwargs):
+            self.chat_requests.append(kwargs)
+            return openai.util.convert_to_openai_object({'choices': [
+                {'index': 0, 'text': text}]})
+        openai.Completion.create = create
+
+    def testPasteUploadsOnce(self):
+        self.fakeCompletion('print("hello")')
+        cb = self.irc.getCallback('ChatGPT')
+        http = FakePasteHTTP()
+        cb.pastes.http = http
+        with conf.supybot.plugins.ChatGPT.privatebin.url.context(
+                'https://paste.test/'), \
+                conf.supybot.plugins.ChatGPT.shorten.url.context(
+                'https://kutt.test'):
+            self.assertResponse('codex hello', 'https://kutt.test/abc')
+            with conf.supybot.plugins.ChatGPT.cache.enable.context(False):
+                self.assertResponse('codexl hello', 'https://kutt.test/abc')
+            with conf.supybot.plugins.ChatGPT.shorten.followup.context(True):
+                self.fakeCompletion('print("bye")')
+                self.assertRegexp('codexl bye', r'^https://paste\.test/\?p')
+                m = self.irc.takeMsg()
+                self.assertEqual(m.args[1], 'https://kutt.test/abc')
+        # One version check, then an upload and a shortening per distinct paste
+        self.assertEqual([method for (method, url) in http.requests],
+                         ['get', 'post', 'post', 'post', 'post'])
+        self.assertEqual(cb.pastes.stats()['links'], 2)
+        # Links on a previous server aren't reused
+        with conf.supybot.plugins.ChatGPT.privatebin.url.context(
+                'https://other.test/'), \
+                conf.supybot.plugins.ChatGPT.shorten.url.context(
+                'https://kutt.test'):
+            self.assertResponse('codex hello', 'https://kutt.test/abc')
+        self.assertEqual(http.requests[5:], [
+            ('get', 'https://other.test/?jsonld=paste'),
+            ('post', 'https://other.test/'),
+            ('post', 'https://kutt.test/api/v2/links')])
+
+    def testPasteKeyDerivation(self):
+        # The fast key derivation replaces a private pbincli method, fail
+        # here rather than silently fall back when pbincli renames it
+        from pbincli.format import Paste
+        self.assertTrue(hasattr(Paste, '_Paste__deriveKey'))
+        self.assertIsNot(paste.paste_class(), Paste)
+        self.assertIn('_Paste__deriveKey', vars(paste.paste_class()))
+
+    def testPipelineStats(self):
+        self.fakeChat('Hello there.')
+        with conf.supybot.plugins.ChatGPT.memory.enable.context(False):
+            self.assertResponse('chatgpt hello', 'Hello there.')
+            self.assertResponse('chatgpt hello', 'Hello there.')
+        self.assertEqual(len(self.chat_requests), 1)
+        self.assertEqual(self.chat_requests[0]['api_key'], 'sk-test')
+        self.assertRegexp('pipelinestats', r'^chatgpt: 2 requests \(1 cached, '
+                          r'0 shared\), [\d.]+ tokens/s, build [\d/]+ms, '
+                          r'api [\d/]+ms, format [\d/]+ms, deliver [\d/]+ms$')
+
+    def testMetrics(self):
+        def create(**kwargs):
+            return openai.util.convert_to_openai_object({
+                'choices': [{'index': 0, 'message': {
+                    'role': 'assistant', 'content': 'Hi.'}}],
+                'usage': {'prompt_tokens': 8, 'completion_tokens': 3,
+                          'total_tokens': 11}})
+        openai.ChatCompletion.create = create
+        with conf.supybot.plugins.ChatGPT.memory.enable.context(False):
+            self.assertResponse('chatgpt hello', 'Hi.')
+            self.assertResponse('chatgpt hello', 'Hi.')
+        self.assertRegexp('metrics tokens',
+                          r'openai_tokens_total\{model=gpt-[^,]+,'
+                          r'type=completion\}: 3 .*type=prompt\}: 8$')
+        self.assertRegexp('metrics upstream_total',
+                          r'^upstream_total\{host=api\.openai\.com,'
+                          r'outcome=ok\}: 1$')
+        self.assertRegexp('metrics command_seconds',
+                          r'command_seconds\{command=chatgpt\}: 2, avg ')
+        self.assertRegexp('metrics cache_hits',
+                          r'cache_hits_total\{cache=response\}: 1$')
+        self.assertRegexp('metrics stage_seconds',
+                          r'stage_seconds\{command=chatgpt,stage=api\}: 1, ')
+        self.assertError('metrics nosuchmetric')
+
+    def testStreamedReply(self):
+        sentence = 'This is a sentence of forty characters. '
+        self.fakeChat(sentence * 25)
+        with conf.supybot.plugins.ChatGPT.openai.stream.context(True):
+            m = self.getMsg('chatgpt hello')
+            lines = [m.args[1]]
+            while True:
+                m = self.irc.takeMsg()
+                if m is None:
+                    break
+                lines.append(m.args[1])
+        self.assertTrue(self.chat_requests[0]['stream'])
+        self.assertTrue(lines[0].startswith('This is a sentence'))
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(' '.join(lines[1:]).count('sentence'),
+                         25 - lines[0].count('sentence'))
+        cb = self.irc.getCallback('ChatGPT')
+        self.assertEqual(len(cb.first_line_times), 1)
+        self.assertRegexp('pipelinestats', r'^chatgpt: 1 requests.*first '
+                          r'streamed line: 1 replies, \d+ms p50, \d+ms p95$')
+        self.assertRegexp('metrics tokens', r'^openai_estimated_tokens_total'
+                          r'\{model=gpt-[^,]+,type=completion\}: [1-9]\d*$')
+
+    def testConversationMemory(self):
+        self.fakeChat('Docker is a container runtime.')
+        self.assertResponse('chatgpt what is docker',
+                            'Docker is a container runtime.')
+        self.assertResponse('chatgpt and podman?',
+                            'Docker is a container runtime.')
+        self.assertEqual(self.chat_requests[1]['messages'], [
+            {'role': 'user', 'content': 'what is docker'},
+            {'role': 'assistant', 'content': 'Docker is a container runtime.'},
+            {'role': 'user', 'content': 'and podman?'}])
+        self.assertNotError('forget')
+        self.assertResponse('chatgpt hi', 'Docker is a container runtime.')
+        self.assertEqual(len(self.chat_requests[2]['messages']), 1)
+
+    def testResponseCache(self):
+        self.fakeChat('A joke.')
+        with conf.supybot.plugins.ChatGPT.memory.enable.context(False):
+            self.assertResponse('chatgpt Tell me  a joke', 'A joke.')
+            self.assertResponse('chatgpt tell me a joke?', 'A joke.')
+            self.assertEqual(len(self.chat_requests), 1)
+            self.assertRegexp('cachestats', '1/512 entries.*1 hits, 1 misses')
+            with conf.supybot.plugins.ChatGPT.cache.enable.context(False):
+                self.assertResponse('chatgpt tell me a joke', 'A joke.')
+            self.assertEqual(len(self.chat_requests), 2)
+            self.assertResponse('cacheflush', 'Flushed 1 cached responses.')
+            self.assertResponse('chatgpt tell me a joke', 'A joke.')
+            self.assertEqual(len(self.chat_requests), 3)
+
+    def testResponseCachePersists(self):
+        path = conf.supybot.directories.data.dirize('test-responses.sqlite')
+        responses = cache.ResponseCache(10, path)
+        responses.set('model', 'What is docker?', 100, 'A runtime.', 60)
+        responses.set('model', 'expired', 100, 'Gone.', -1)
+        responses.close()
+        responses = cache.ResponseCache(10, path)
+        self.assertEqual(responses.get('model', 'what is Docker', 100),
+                         'A runtime.')
+        self.assertIsNone(responses.get('model', 'what is docker', 200))
+        self.assertIsNone(responses.get('model', 'expired', 100))
+        self.assertEqual(responses.stats()['stored'], 1)
+        responses.close()
+
+    def testRateLimitRefusesAfterMaxWait(self):
+        self.fakeChat('Sure.')
+        with conf.supybot.plugins.ChatGPT.limits.nick.requests.context(1), \
+                conf.supybot.plugins.ChatGPT.limits.maxwait.context(0):
+            self.assertResponse('chatgpt one', 'Sure.')
+            self.assertRegexp('chatgpt two', 'Too many requests')
+        self.assertEqual(len(self.chat_requests), 1)
+
+    def testReplyFitsIrcLine(self):
+        self.fakeChat('\u4e2d\u6587' * 400)
+        m = self.getMsg('chatgpt hello')
+        lines = []
+        while m is not None:
+            self.assertLessEqual(len(str(m).encode('utf-8')) +
+                                 len(':%s ' % self.irc.prefix), 512)
+            lines.append(m.args[1])
+            m = self.irc.takeMsg()
+        self.assertEqual(''.join(lines), '\u4e2d\u6587' * 400)
+
+
+class FakeOpenAI(object):
+    """Routes for a local stand-in of the OpenAI completion APIs, streaming
+    with server-sent events when asked to.  Replies are numbered so no two
+    are the same."""
+    def __init__(self):
+        self.counter = itertools.count()
+        self.routes = {
+            '/v1/chat/completions': lambda *args: self.complete(True, *args),
+            '/v1/completions': lambda *args: self.complete(False, *args),
+        }
+
+    def choice(self, chat, text, stream):
+        if not chat:
+            return {'index': 0, 'text': text, 'finish_reason': None}
+        key = 'delta' if stream else 'message'
+        return {'index': 0, key: {'role': 'assistant', 'content': text},
+                'finish_reason': None}
+
+    def complete(self, chat, method, query, body):
+        request = json.loads(body)
+        text = 'Benchmark reply number %s, a few words long.' % \
+            next(self.counter)
+        if not request.get('stream'):
+            return bench.json_response({
+                'choices': [self.choice(chat, text, False)],
+                'usage': {'prompt_tokens': 8, 'completion_tokens': 12,
+                          'total_tokens': 20}})
+        chunks = []
+        for word in text.split(' '):
+            data = {'choices': [self.choice(chat, word + ' ', True)]}
+            chunks.append(b'data: ' + json.dumps(data).encode('utf-8') +
+                          b'\n\n')
+        chunks.append(b'data: [DONE]\n\n')
+        return bench.FakeResponse(chunks=chunks,
+                                  content_type='text/event-stream')
+
+
+def fake_privatebin(method, query, body):
+    if method == 'GET':
+        return bench.json_response({'@context': {'v': {'@value': 2}}})
+    return bench.json_response({'status': 0, 'id': 'b3nch',
+                                'deletetoken': 'token'})
+
+
+def fake_kutt(method, query, body):
+    return bench.json_response({'link': 'https://kutt.test/b3nch'})
+
+
+@unittest.skipUnless(bench.OUTPUT, 'set SUPYBOT_BENCH to run benchmarks')
+class ChatGPTBenchmark(PluginTestCase):
+    plugins = ('ChatGPT',)
+    config = {'supybot.plugins.ChatGPT.openai.api.key': 'sk-test',
+              'supybot.plugins.ChatGPT.memory.enable': False,
+              'supybot.plugins.ChatGPT.limits.nick.requests': 0,
+              'supybot.plugins.ChatGPT.limits.channel.requests': 0,
+              'supybot.plugins.ChatGPT.limits.global.requests': 0,
+              'supybot.plugins.ChatGPT.limits.global.tokens': 0}
+
+    def setUp(self):
+        super().setUp()
+        self._api_base = openai.api_base
+        self.openai = bench.FakeServer(FakeOpenAI().routes, latency=0.1,
+                                       chunk_latency=0.01)
+        self.pastebin = bench.FakeServer({'/': fake_privatebin,
+                                          '/api/v2/links': fake_kutt},
+                                         latency=0.05)
+        openai.api_base = self.openai.url + '/v1'
+
+    def tearDown(self):
+        openai.api_base = self._api_base
+        self.openai.close()
+        self.pastebin.close()
+        super().tearDown()
+
+    def run_benchmark(self, name, commands, channels=8, requests=100):
+        results = bench.run_load(self.irc, self.prefix, commands, channels,
+                                 requests)
+        bench.report('ChatGPT', name, channels, *results,
+                     upstream_requests=self.openai.requests)
+
+    def testBenchStartup(self):
+        bench.report_startup('ChatGPT', CLIENT_MODULES)
+
+    def testBenchChatCached(self):
+        self.run_benchmark('chatgpt_cached', ['chatgpt hello',
+                                              'chatgpt hi there'])
+
+    def testBenchChatUncached(self):
+        with conf.supybot.plugins.ChatGPT.cache.enable.context(False):
+            self.run_benchmark('chatgpt_uncached', ['chatgpt hello',
+                                                    'chatgpt hi there'])
+
+    def testBenchChatStreamed(self):
+        with conf.supybot.plugins.ChatGPT.cache.enable.context(False), \
+                conf.supybot.plugins.ChatGPT.openai.stream.context(True):
+            self.run_benchmark('chatgpt_streamed', ['chatgpt hello',
+                                                    'chatgpt hi there'])
+
+    def testBenchCodexPaste(self):
+        with conf.supybot.plugins.ChatGPT.cache.enable.context(False), \
+                conf.supybot.plugins.ChatGPT.privatebin.url.context(
+                self.pastebin.url + '/'), \
+                conf.supybot.plugins.ChatGPT.shorten.url.context(
+                self.pastebin.url):
+            self.run_benchmark('codex_paste', ['codex hello', 'codexl hi'],
+                               requests=50)
 
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,135 @@
+###
+# Copyright (c) 2023, Solareon
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from supybot import log, world
+
+
+class WorkerPool(object):
+    """Fixed number of worker threads running queued jobs.
+
+    Jobs are queued per key (a channel or a nick) and workers take one job
+    from each key in turn, so a busy channel can't starve the others.  The
+    total number of queued jobs is bounded, submit refuses jobs beyond
+    that."""
+
+    def __init__(self, name, threads, maxqueued):
+        self.name = name
+        self.maxqueued = maxqueued
+        self.busy = 0
+        self.completed = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=1000)
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._threads = []
+        for i in range(threads):
+            thread = world.SupyThread(target=self._run,
+                                      name='{name} worker #{i}'.format(
+                                          name=name, i=i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, function, *args):
+        """Queues function(*args), returns False if the queue is full"""
+        with self._cond:
+            if self._stopped or self._queued >= self.maxqueued:
+                self.rejected += 1
+                return False
+            self._queues.setdefault(key, deque()).append(
+                (time.monotonic(), function, args))
+            self._queued += 1
+            self._cond.notify()
+            return True
+
+    def _next(self):
+        # Round robin over keys: take the first key's oldest job and move
+        # the key to the back if it has more
+        key, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        if queue:
+            self._queues.move_to_end(key)
+        else:
+            del self._queues[key]
+        self._queued -= 1
+        return job
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queued and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                queued, function, args = self._next()
+                self.busy += 1
+                self.waits.append(time.monotonic() - queued)
+            try:
+                function(*args)
+            except Exception:
+                log.exception('%s: uncaught exception in worker', self.name)
+            finally:
+                with self._cond:
+                    self.busy -= 1
+                    self.completed += 1
+
+    def stop(self):
+        """Stops the workers once their current job is done, dropping queued
+        jobs"""
+        with self._cond:
+            self._stopped = True
+            self._queues.clear()
+            self._queued = 0
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self.waits)
+            return {
+                'threads': len(self._threads),
+                'busy': self.busy,
+                'queued': self._queued,
+                'maxqueued': self.maxqueued,
+                'keys': len(self._queues),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'wait_avg': sum(waits) / len(waits) if waits else 0.0,
+                'wait_p95': waits[int(len(waits) * 0.95)] if waits else 0.0,
+                'wait_max': waits[-1] if waits else 0.0,
+            }
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -43,6 +43,18 @@ __contributors__ = {}
 __url__ = ''
 
 from . import config
+from . import httpclient
+from . import alerts
+from . import cache
+from . import crypto
+from . import fx
+from . import history
+from . import metrics
+from . import portfolio
+from . import providers
+from . import render
+from . import symbols
+from . import workers
 from . import plugin
 if sys.version_info >= (3, 4):
     from importlib import reload
@@ -50,6 +62,18 @@ else:
     from imp import reload
 # In case we're being reloaded.
 reload(config)
+reload(httpclient)
+reload(alerts)
+reload(cache)
+reload(crypto)
+reload(fx)
+reload(history)
+reload(metrics)
+reload(portfolio)
+reload(providers)
+reload(render)
+reload(symbols)
+reload(workers)
 reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
@@ -0,0 +1,197 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import bisect
+import sqlite3
+import threading
+import time
+
+from supybot import ircutils
+
+
+class Alert(object):
+    __slots__ = ('id', 'network', 'channel', 'nick', 'symbol', 'above',
+                 'threshold', 'reference', 'created', 'owner')
+
+    def __init__(self, id, network, channel, nick, symbol, above, threshold,
+                 reference=None, created=None, owner=None):
+        self.id = id
+        self.network = network
+        self.channel = channel
+        self.nick = nick
+        self.symbol = symbol
+        self.above = bool(above)
+        self.threshold = threshold
+        # Price a percent move was measured from, None for plain thresholds
+        self.reference = reference
+        self.created = created or time.time()
+        # Hostmask of whoever added the alert, None for alerts stored
+        # before it was recorded
+        self.owner = owner
+
+
+class ThresholdIndex(object):
+    """Alerts of one symbol sorted by threshold.
+
+    Alerts firing above a price and below a price are kept in two sorted
+    lists, so the alerts a price crosses are a prefix of one and a suffix
+    of the other and are found by bisection."""
+
+    def __init__(self):
+        self.above = []
+        self.below = []
+
+    def __len__(self):
+        return len(self.above) + len(self.below)
+
+    def add(self, alert):
+        side = self.above if alert.above else self.below
+        bisect.insort(side, (alert.threshold, alert.id))
+
+    def remove(self, alert):
+        side = self.above if alert.above else self.below
+        i = bisect.bisect_left(side, (alert.threshold, alert.id))
+        if i < len(side) and side[i] == (alert.threshold, alert.id):
+            del side[i]
+
+    def crossed(self, price):
+        """Returns the ids of alerts triggered at price"""
+        above = bisect.bisect_right(self.above, (price, float('inf')))
+        below = bisect.bisect_left(self.below, (price, float('-inf')))
+        return ([id for threshold, id in self.above[:above]] +
+                [id for threshold, id in self.below[below:]])
+
+
+class AlertStore(object):
+    """Price alerts of every channel, persisted in SQLite when a path is
+    given and indexed by symbol in memory"""
+
+    def __init__(self, path=None):
+        self._alerts = {}
+        self._index = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ':memory:',
+                                   check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS alerts ('
+                         'id INTEGER PRIMARY KEY, network TEXT NOT NULL, '
+                         'channel TEXT NOT NULL, nick TEXT NOT NULL, '
+                         'symbol TEXT NOT NULL, above INTEGER NOT NULL, '
+                         'threshold REAL NOT NULL, reference REAL, '
+                         'created REAL NOT NULL, owner TEXT)')
+        columns = [row[1] for row in
+                   self._db.execute('PRAGMA table_info(alerts)')]
+        if 'owner' not in columns:
+            self._db.execute('ALTER TABLE alerts ADD COLUMN owner TEXT')
+        self._db.commit()
+        for row in self._db.execute('SELECT id, network, channel, nick, '
+                                    'symbol, above, threshold, reference, '
+                                    'created, owner FROM alerts'):
+            self._insert(Alert(*row))
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def _insert(self, alert):
+        self._alerts[alert.id] = alert
+        self._index.setdefault(alert.symbol, ThresholdIndex()).add(alert)
+
+    def _delete(self, alert):
+        del self._alerts[alert.id]
+        index = self._index[alert.symbol]
+        index.remove(alert)
+        if not index:
+            del self._index[alert.symbol]
+
+    def add(self, network, channel, nick, symbol, above, threshold,
+            reference=None, owner=None):
+        with self._lock:
+            alert = Alert(None, network, channel, nick, symbol.upper(),
+                          above, threshold, reference, owner=owner)
+            cursor = self._db.execute(
+                'INSERT INTO alerts (network, channel, nick, symbol, above, '
+                'threshold, reference, created, owner) VALUES (?, ?, ?, ?, '
+                '?, ?, ?, ?, ?)', (alert.network, alert.channel, alert.nick,
+                                   alert.symbol, int(alert.above),
+                                   alert.threshold, alert.reference,
+                                   alert.created, alert.owner))
+            self._db.commit()
+            alert.id = cursor.lastrowid
+            self._insert(alert)
+            return alert
+
+    def remove(self, id):
+        """Removes and returns the alert with that id, or None"""
+        with self._lock:
+            alert = self._alerts.get(id)
+            if alert is not None:
+                self._delete(alert)
+                self._db.execute('DELETE FROM alerts WHERE id = ?', (id,))
+                self._db.commit()
+            return alert
+
+    def get(self, id):
+        with self._lock:
+            return self._alerts.get(id)
+
+    def channel(self, network, channel):
+        """Returns the alerts of a channel sorted by id, channel names
+        compared case-insensitively like IRC does"""
+        channel = ircutils.toLower(channel)
+        with self._lock:
+            return sorted((alert for alert in self._alerts.values()
+                           if alert.network == network and
+                           ircutils.toLower(alert.channel) == channel),
+                          key=lambda alert: alert.id)
+
+    def symbols(self):
+        """Returns every symbol with at least one alert"""
+        with self._lock:
+            return sorted(self._index)
+
+    def trigger(self, prices):
+        """Removes and returns the alerts crossed by prices, a dict of
+        symbol to current price"""
+        triggered = []
+        with self._lock:
+            for symbol, price in prices.items():
+                index = self._index.get(symbol)
+                if index is None or price is None:
+                    continue
+                for id in index.crossed(price):
+                    triggered.append(self._alerts[id])
+            for alert in triggered:
+                self._delete(alert)
+            if triggered:
+                self._db.executemany('DELETE FROM alerts WHERE id = ?',
+                                     [(alert.id,) for alert in triggered])
+                self._db.commit()
+        return triggered
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
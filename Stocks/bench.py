@@ -0,0 +1,278 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+# Load-testing helpers for the benchmarks in test.py.  The benchmarks drive
+# real commands through the supybot test harness against local stand-ins for
+# the upstream services.  They are skipped unless SUPYBOT_BENCH names a file,
+# to which each benchmark appends its results as a line of JSON so runs can be
+# compared between commits:
+#
+#     SUPYBOT_BENCH=bench_output.txt supybot-test --no-network ./Stocks
+
+import http.server
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import parse_qs, urlsplit
+
+from supybot import ircmsgs, log
+
+OUTPUT = os.environ.get('SUPYBOT_BENCH')
+
+
+class FakeResponse(object):
+    """What a route returns: a body, or chunks written latency apart"""
+    def __init__(self, body=b'', status=200, chunks=None,
+                 content_type='application/json'):
+        self.body = body
+        self.status = status
+        self.chunks = chunks
+        self.content_type = content_type
+
+
+def json_response(data, status=200):
+    return FakeResponse(json.dumps(data).encode('utf-8'), status)
+
+
+class FakeServer(object):
+    """A local HTTP server standing in for an upstream API.
+
+    routes maps a path to a function taking (method, query, body) and
+    returning a FakeResponse.  Every response waits latency seconds before
+    its first byte, and streamed chunks wait chunk_latency between each
+    other."""
+
+    def __init__(self, routes, latency=0.0, chunk_latency=0.0):
+        self.routes = routes
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.requests = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def handle_request(self, method):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                route = server.routes.get(url.path)
+                server.requests += 1
+                time.sleep(server.latency)
+                if route is None:
+                    response = FakeResponse(b'{}', 404)
+                else:
+                    response = route(method, parse_qs(url.query), body)
+
+                self.send_response(response.status)
+                self.send_header('Content-Type', response.content_type)
+                if response.chunks is None:
+                    self.send_header('Content-Length', str(len(response.body)))
+                    self.end_headers()
+                    self.wfile.write(response.body)
+                    return
+                # Streams end by closing the connection
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                for chunk in response.chunks:
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+                    time.sleep(server.chunk_latency)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:%s' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       name='Fake upstream', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_load(irc, prefix, commands, channels=8, requests=200, warmup=None,
+             timeout=30):
+    """Sends commands round-robin from `channels` channels at once, each
+    channel sending its next command as soon as the previous one's first
+    reply line arrives, and returns the latencies, run time and memory
+    growth.  The first warmup commands (one per channel by default) are not
+    measured."""
+    if warmup is None:
+        warmup = channels
+    names = ['#bench%s' % i for i in range(channels)]
+    sent = {}
+    latencies = []
+    count = [0]
+
+    def send(channel):
+        command = commands[count[0] % len(commands)]
+        count[0] += 1
+        sent[channel] = time.perf_counter()
+        irc.feedMsg(ircmsgs.privmsg(channel, '@' + command, prefix=prefix))
+
+    tracemalloc.start()
+    baseline = None
+    started = None
+    for channel in names:
+        send(channel)
+    deadline = time.monotonic() + timeout
+    done = 0
+    while done < warmup + requests:
+        if time.monotonic() > deadline:
+            raise AssertionError('Only %s of %s commands answered in %ss' %
+                                 (done, warmup + requests, timeout))
+        msg = irc.takeMsg()
+        if msg is None:
+            time.sleep(0.0005)
+            continue
+        channel = msg.args[0]
+        if msg.command != 'PRIVMSG' or channel not in sent:
+            continue
+        elapsed = time.perf_counter() - sent.pop(channel)
+        done += 1
+        if done == warmup:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            started = time.perf_counter()
+        elif done > warmup:
+            latencies.append(elapsed)
+        if count[0] < warmup + requests:
+            send(channel)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latencies, elapsed, current - baseline, peak - baseline
+
+
+def report(plugin, name, channels, latencies, elapsed, growth, peak,
+           **extra):
+    """Logs a benchmark's results and appends them to SUPYBOT_BENCH"""
+    latencies = sorted(latencies)
+    result = {
+        'plugin': plugin,
+        'benchmark': name,
+        'requests': len(latencies),
+        'channels': channels,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'memory_growth_kb': round(growth / 1024, 1),
+        'memory_peak_kb': round(peak / 1024, 1),
+        'python': platform.python_version(),
+        'time': int(time.time()),
+    }
+    result.update(extra)
+    return record(result)
+
+
+def record(result):
+    line = json.dumps(result, sort_keys=True)
+    log.info('benchmark: %s', line)
+    if OUTPUT:
+        with open(OUTPUT, 'a') as fd:
+            fd.write(line + '\n')
+    return result
+
+
+# Run by load_plugin in a fresh interpreter.  supybot is imported before the
+# clock starts so only the plugin's own cost is measured.
+STARTUP_SCRIPT = '''
+import json, sys, time, tracemalloc
+sys.path.insert(0, sys.argv[1])
+import supybot.callbacks, supybot.commands, supybot.conf
+before = set(sys.modules)
+if sys.argv[3] == 'memory':
+    tracemalloc.start()
+started = time.perf_counter()
+__import__(sys.argv[2])
+elapsed = time.perf_counter() - started
+size, peak = tracemalloc.get_traced_memory()
+print('startup: ' + json.dumps({'elapsed': elapsed, 'size': size,
+                                'peak': peak,
+                                'modules': sorted(set(sys.modules) - before)}))
+'''
+
+
+def load_plugin(plugin, mode='time'):
+    """Imports a plugin package in a new interpreter and returns its
+    import time, the memory allocated by it (mode 'memory', which slows
+    the import down) and the modules it imported"""
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # supybot writes its configuration and logs to the current directory
+    with tempfile.TemporaryDirectory() as cwd:
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT,
+                                 directory, plugin, mode], cwd=cwd,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True,
+                                universal_newlines=True).stdout
+    for line in output.splitlines():
+        if line.startswith('startup: '):
+            return json.loads(line[len('startup: '):])
+    raise RuntimeError('%s did not load' % plugin)
+
+
+def report_startup(plugin, heavy, runs=5):
+    """Logs the median cold import time and the memory of loading a
+    plugin, and which of the heavy modules it imported, and appends them to
+    SUPYBOT_BENCH"""
+    times = sorted(load_plugin(plugin)['elapsed'] for i in range(runs))
+    loaded = load_plugin(plugin, 'memory')
+    return record({
+        'plugin': plugin,
+        'benchmark': 'startup',
+        'import_ms': round(percentile(times, 0.50) * 1000, 3),
+        'memory_kb': round(loaded['size'] / 1024, 1),
+        'memory_peak_kb': round(loaded['peak'] / 1024, 1),
+        'modules': len(loaded['modules']),
+        'heavy_modules': [module for module in heavy
+                          if module in loaded['modules']],
+        'python': platform.python_version(),
+        'time': int(time.time()),
+    })
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,229 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight(object):
+    """A fetch in progress that other threads can wait on"""
+    __slots__ = ('event', 'quote')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.quote = None
+
+
+class QuoteCache(object):
+    """Thread-safe LRU cache of quotes keyed by normalized symbol.
+
+    Every entry carries its own expiry so quotes can live longer while their
+    market is closed.  Symbols being fetched by one thread are marked as in
+    flight, other threads asking for them wait for that fetch instead of
+    going upstream themselves."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, symbol, now):
+        entry = self._entries.get(symbol)
+        if entry is None:
+            return None
+        expires, quote = entry
+        if expires <= now:
+            del self._entries[symbol]
+            return None
+        self._entries.move_to_end(symbol)
+        return quote
+
+    def _set(self, symbol, quote, ttl, now):
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        self._entries[symbol] = (now + ttl, quote)
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, symbol):
+        with self._lock:
+            return self._get(symbol.upper(), time.monotonic())
+
+    def set(self, symbol, quote, ttl):
+        with self._lock:
+            self._set(symbol.upper(), quote, ttl, time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def fetch(self, symbols, fetcher, ttl):
+        """Returns a dict of quotes for symbols, calling fetcher with the list
+        of symbols that are neither cached nor already being fetched.  ttl is
+        called with each fetched quote and returns its lifetime in seconds."""
+        symbols = [symbol.upper() for symbol in symbols]
+        quotes = {}
+        missing = []
+        waiting = {}
+
+        with self._lock:
+            now = time.monotonic()
+            for symbol in symbols:
+                if symbol in quotes or symbol in missing or symbol in waiting:
+                    continue
+                quote = self._get(symbol, now)
+                if quote is not None:
+                    self.hits += 1
+                    quotes[symbol] = quote
+                    continue
+                self.misses += 1
+                if symbol in self._inflight:
+                    waiting[symbol] = self._inflight[symbol]
+                else:
+                    self._inflight[symbol] = _Flight()
+                    missing.append(symbol)
+
+        if missing:
+            fetched = {}
+            try:
+                fetched = fetcher(missing)
+            finally:
+                with self._lock:
+                    now = time.monotonic()
+                    for symbol in missing:
+                        flight = self._inflight.pop(symbol)
+                        flight.quote = fetched.get(symbol)
+                        if flight.quote is not None:
+                            self._set(symbol, flight.quote, ttl(flight.quote),
+                                      now)
+                        flight.event.set()
+            for symbol in missing:
+                if symbol in fetched:
+                    quotes[symbol] = fetched[symbol]
+
+        for symbol, flight in waiting.items():
+            flight.event.wait()
+            if flight.quote is not None:
+                quotes[symbol] = flight.quote
+
+        return quotes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'inflight': len(self._inflight),
+            }
+
+
+class RateStore(object):
+    """Thread-safe store of fetched exchange rates.
+
+    A stored pair also answers its inverse, and two stored pairs sharing a
+    currency answer the cross rate through that pivot, so only pairs that
+    can't be derived from fresh data need to be fetched."""
+
+    def __init__(self):
+        self.names = {}
+        self._rates = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rates)
+
+    def add(self, base, quote, rate, base_name=None, quote_name=None):
+        base, quote = base.upper(), quote.upper()
+        with self._lock:
+            self._rates[(base, quote)] = (rate, time.monotonic())
+            if base_name:
+                self.names[base] = base_name
+            if quote_name:
+                self.names[quote] = quote_name
+
+    def clear(self):
+        with self._lock:
+            self._rates.clear()
+
+    def _expire(self, ttl, now):
+        for pair, (rate, fetched) in list(self._rates.items()):
+            if now - fetched >= ttl:
+                del self._rates[pair]
+
+    def _pair(self, base, quote):
+        # Returns (rate, fetched) for base->quote, using the inverse pair
+        # when only that one is stored
+        if (base, quote) in self._rates:
+            return self._rates[(base, quote)]
+        if (quote, base) in self._rates:
+            rate, fetched = self._rates[(quote, base)]
+            if rate:
+                return (1 / rate, fetched)
+        return None
+
+    def lookup(self, base, quote, ttl):
+        """Returns (rate, age, source) for base->quote where source is
+        'cached', 'inverse' or the pivot currency the rate was derived
+        through, or None if no fresh data covers the pair."""
+        base, quote = base.upper(), quote.upper()
+        with self._lock:
+            now = time.monotonic()
+            self._expire(ttl, now)
+
+            if (base, quote) in self._rates:
+                rate, fetched = self._rates[(base, quote)]
+                return (rate, now - fetched, 'cached')
+
+            pair = self._pair(base, quote)
+            if pair is not None:
+                return (pair[0], now - pair[1], 'inverse')
+
+            currencies = set()
+            for pair in self._rates:
+                currencies.update(pair)
+            currencies.discard(base)
+            currencies.discard(quote)
+            for pivot in sorted(currencies):
+                first = self._pair(base, pivot)
+                second = self._pair(pivot, quote)
+                if first is not None and second is not None:
+                    age = now - min(first[1], second[1])
+                    return (first[0] * second[0], age, pivot)
+
+        return None
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -53,6 +53,196 @@ conf.registerGlobalValue(Stocks.alphavantage.api, 'key',
 conf.registerGlobalValue(Stocks, 'maxsymbols',
     registry.Integer(10, _("""Maximum number of symbols for single request""")))
 conf.registerGlobalValue(Stocks, 'cryptofiat',
-    registry.String('', _("""ISO Currency code for Cryptocurrency to Fiat Pairs""")))
+    registry.String('', _("""Space separated ISO currency codes
+    cryptocurrencies are quoted in, USD if empty""")))
+conf.registerChannelValue(Stocks, 'watchlist',
+    registry.SpaceSeparatedListOfStrings([], _("""Symbols returned by the
+    watchlist command in this channel""")))
+class Layout(registry.OnlySomeStrings):
+    """Must be full, compact or json"""
+    validStrings = ('full', 'compact', 'json')
+
+conf.registerGroup(Stocks, 'format')
+conf.registerChannelValue(Stocks.format, 'layout',
+    Layout('full', _("""How quotes and exchange rates are shown: full with
+    name, change, high, low and market state, compact with price and
+    percent change, or json, one array of objects per line for other
+    bots""")))
+conf.registerGlobalValue(Stocks.format, 'length',
+    registry.PositiveInteger(400, _("""Maximum bytes of a reply line, replies
+    are broken into lines between quotes""")))
+conf.registerGroup(Stocks, 'symbols')
+conf.registerGlobalValue(Stocks.symbols, 'enable',
+    registry.Boolean(True, _("""Resolve company names and aliases given to
+    the stock command to tickers using the local symbol index. Symbols
+    written in capitals are taken as tickers and never rewritten.""")))
+conf.registerGlobalValue(Stocks.symbols, 'file',
+    registry.String('', _("""CSV file of ticker, name, exchange and
+    |-separated aliases the symbol index is loaded from, the file bundled
+    with the plugin if empty. Reload it with the reloadsymbols
+    command.""")))
+conf.registerGlobalValue(Stocks.symbols, 'fuzzy',
+    registry.Boolean(True, _("""Match names with one typo to the closest
+    indexed name""")))
+conf.registerGlobalValue(Stocks.symbols, 'strict',
+    registry.Boolean(False, _("""Reject symbols missing from the symbol
+    index instead of looking them up upstream""")))
+conf.registerGroup(Stocks, 'prefetch')
+conf.registerGlobalValue(Stocks.prefetch, 'enable',
+    registry.Boolean(True, _("""Refresh recently requested index and
+    watchlist symbols in the background so those commands answer from
+    cache""")))
+conf.registerGroup(Stocks.prefetch, 'interval')
+conf.registerGlobalValue(Stocks.prefetch.interval, 'open',
+    registry.PositiveInteger(30, _("""Seconds between background refreshes
+    while any watched market is open""")))
+conf.registerGlobalValue(Stocks.prefetch.interval, 'closed',
+    registry.PositiveInteger(900, _("""Seconds between background refreshes
+    while every watched market is closed""")))
+conf.registerGlobalValue(Stocks.prefetch, 'idle',
+    registry.PositiveInteger(1800, _("""Seconds after their last request
+    that symbols stop being refreshed in the background""")))
+class ForexProvider(registry.OnlySomeStrings):
+    """Must be alphavantage, exchangerate or file"""
+    validStrings = ('alphavantage', 'exchangerate', 'file')
+
+conf.registerGroup(Stocks, 'forex')
+conf.registerGlobalValue(Stocks.forex, 'provider',
+    ForexProvider('alphavantage', _("""Where exchange rates come from:
+    alphavantage fetches one pair per request, exchangerate fetches every
+    rate against a currency with one request from ExchangeRate-API, file
+    reads them from supybot.plugins.Stocks.forex.file. Rates of any other
+    pair are computed from those.""")))
+conf.registerGlobalValue(Stocks.forex, 'file',
+    registry.String('', _("""JSON file of exchange rates used by the file
+    provider, such as ExchangeRate-API's reply or {"base": "USD", "rates":
+    {"EUR": 0.92, ...}}, refreshed outside of the bot. It's read again when
+    it changes.""")))
+conf.registerGlobalValue(Stocks.forex, 'ttl',
+    registry.NonNegativeInteger(900, _("""Seconds a fetched exchange rate is
+    reused, including for inverse and cross rates derived from it""")))
+conf.registerGroup(Stocks, 'cache')
+conf.registerGlobalValue(Stocks.cache, 'size',
+    registry.NonNegativeInteger(512, _("""Maximum number of quotes kept in
+    the quote cache, 0 disables caching. Takes effect on reload.""")))
+conf.registerGroup(Stocks.cache, 'ttl')
+conf.registerGlobalValue(Stocks.cache.ttl, 'regular',
+    registry.NonNegativeInteger(5, _("""Seconds a quote is cached while its
+    market is open""")))
+conf.registerGlobalValue(Stocks.cache.ttl, 'extended',
+    registry.NonNegativeInteger(300, _("""Seconds a quote is cached during
+    pre-market and post-market hours""")))
+conf.registerGlobalValue(Stocks.cache.ttl, 'closed',
+    registry.NonNegativeInteger(7200, _("""Seconds a quote is cached while
+    its market is closed""")))
+conf.registerGroup(Stocks, 'history')
+conf.registerGlobalValue(Stocks.history, 'size',
+    registry.PositiveInteger(64, _("""Maximum number of symbols whose daily
+    price history is kept in memory. Takes effect on reload.""")))
+conf.registerGlobalValue(Stocks.history, 'ttl',
+    registry.NonNegativeInteger(300, _("""Seconds today's bar is reused
+    before it's fetched again, earlier days are never fetched twice""")))
+conf.registerGlobalValue(Stocks.history, 'width',
+    registry.PositiveInteger(30, _("""Maximum number of characters of the
+    sparkline returned by the history command""")))
+conf.registerGroup(Stocks, 'alerts')
+conf.registerGlobalValue(Stocks.alerts, 'persist',
+    registry.Boolean(True, _("""Keep alerts in a SQLite database in the
+    data directory so they survive restarts. Takes effect on reload.""")))
+conf.registerChannelValue(Stocks.alerts, 'max',
+    registry.PositiveInteger(50, _("""Maximum number of pending alerts in
+    the channel""")))
+conf.registerGlobalValue(Stocks.alerts, 'batch',
+    registry.PositiveInteger(100, _("""Maximum number of symbols fetched
+    in one request when polling alerts""")))
+conf.registerGroup(Stocks.alerts, 'interval')
+conf.registerGlobalValue(Stocks.alerts.interval, 'open',
+    registry.PositiveInteger(60, _("""Seconds between alert polls while
+    any market with alerts is open""")))
+conf.registerGlobalValue(Stocks.alerts.interval, 'closed',
+    registry.PositiveInteger(900, _("""Seconds between alert polls while
+    every market with alerts is closed""")))
+conf.registerGroup(Stocks, 'portfolio')
+conf.registerGlobalValue(Stocks.portfolio, 'persist',
+    registry.Boolean(True, _("""Keep portfolios in a SQLite database in
+    the data directory so they survive restarts. Takes effect on
+    reload.""")))
+conf.registerGlobalValue(Stocks.portfolio, 'currency',
+    registry.String('USD', _("""ISO currency code portfolios are valued
+    in, holdings quoted in other currencies are converted at forex
+    rates""")))
+conf.registerGlobalValue(Stocks.portfolio, 'positions',
+    registry.PositiveInteger(10, _("""Maximum number of positions listed
+    by the portfolio command, largest first""")))
+class CryptoProvider(registry.OnlySomeStrings):
+    """Must be coingecko or yahoo"""
+    validStrings = ('coingecko', 'yahoo')
+
+conf.registerGroup(Stocks, 'crypto')
+conf.registerGlobalValue(Stocks.crypto, 'provider',
+    CryptoProvider('coingecko', _("""Where the crypto command gets quotes
+    from: coingecko prices every coin in every fiat currency with one
+    request, yahoo looks up a SYMBOL-FIAT ticker for each pair""")))
+conf.registerGlobalValue(Stocks.crypto, 'ttl',
+    registry.NonNegativeInteger(30, _("""Seconds a crypto quote is
+    cached""")))
+conf.registerGroup(Stocks.crypto, 'coins')
+conf.registerGlobalValue(Stocks.crypto.coins, 'ttl',
+    registry.PositiveInteger(86400, _("""Seconds the list of coins, kept
+    in the data directory, is used before it's fetched again""")))
+conf.registerGroup(Stocks.crypto, 'coingecko')
+conf.registerGroup(Stocks.crypto.coingecko, 'api')
+conf.registerGlobalValue(Stocks.crypto.coingecko.api, 'key',
+    registry.String('', _("""Optional demo API key for coingecko.com"""),
+                    private=True))
+conf.registerGroup(Stocks, 'providers')
+conf.registerGlobalValue(Stocks.providers, 'order',
+    registry.SpaceSeparatedListOfStrings(['yahoo', 'alphavantage'],
+    _("""Quote providers to use, among yahoo, alphavantage and fixture.
+    Requests go to the fastest healthy one, in this order until each has
+    been measured. Takes effect on reload.""")))
+conf.registerGlobalValue(Stocks.providers, 'fixture',
+    registry.String('', _("""JSON file of quotes by symbol served by the
+    fixture provider""")))
+conf.registerGroup(Stocks.providers, 'breaker')
+conf.registerGlobalValue(Stocks.providers.breaker, 'failures',
+    registry.PositiveInteger(3, _("""Consecutive failures after which a
+    provider is skipped. Takes effect on reload.""")))
+conf.registerGlobalValue(Stocks.providers.breaker, 'cooldown',
+    registry.PositiveInteger(30, _("""Seconds a failing provider is
+    skipped before a single request checks whether it recovered. Takes
+    effect on reload.""")))
+conf.registerGroup(Stocks, 'http')
+conf.registerGroup(Stocks.http, 'timeout')
+conf.registerGlobalValue(Stocks.http.timeout, 'connect',
+    registry.PositiveFloat(3.05, _("""Seconds to wait for a connection to
+    an upstream API. Takes effect on reload.""")))
+conf.registerGlobalValue(Stocks.http.timeout, 'read',
+    registry.PositiveFloat(10.0, _("""Seconds to wait for an upstream API to
+    respond. Takes effect on reload.""")))
+conf.registerGlobalValue(Stocks.http, 'retries',
+    registry.NonNegativeInteger(2, _("""Number of times a request failing
+    with a connection error, 429 or 5xx is retried. Takes effect on
+    reload.""")))
+conf.registerGroup(Stocks, 'workers')
+conf.registerGlobalValue(Stocks.workers, 'enable',
+    registry.Boolean(False, _("""Run commands on a fixed pool of worker
+    threads with a bounded queue instead of a new thread per command. Takes
+    effect on reload.""")))
+conf.registerGlobalValue(Stocks.workers, 'threads',
+    registry.PositiveInteger(4, _("""Number of worker threads. Takes effect
+    on reload.""")))
+conf.registerGlobalValue(Stocks.workers, 'queue',
+    registry.PositiveInteger(32, _("""Maximum number of commands waiting for
+    a worker, commands beyond that are refused. Takes effect on
+    reload.""")))
+conf.registerGroup(Stocks, 'metrics')
+conf.registerGlobalValue(Stocks.metrics, 'port',
+    registry.NonNegativeInteger(0, _("""Port serving metrics at /metrics
+    in Prometheus' text format, 0 disables it. Takes effect on
+    reload.""")))
+conf.registerGlobalValue(Stocks.metrics, 'host',
+    registry.String('127.0.0.1', _("""Address the metrics port listens
+    on. Takes effect on reload.""")))
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
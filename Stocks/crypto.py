@@ -0,0 +1,155 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import json
+import os
+import threading
+import time
+
+
+class Coin(object):
+    __slots__ = ('id', 'symbol', 'name')
+
+    def __init__(self, id, symbol, name):
+        self.id = id
+        self.symbol = symbol
+        self.name = name
+
+
+class CoinIndex(object):
+    """Coins known to the crypto provider, looked up by symbol, id or name.
+
+    Coins are given largest first, so a symbol shared by several coins
+    resolves to the largest one.  The list is saved to path so it survives
+    restarts and only has to be fetched again once it's older than the ttl
+    it's checked against."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.fetched = 0
+        self._keys = {}
+        self._count = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        self._load()
+        return self._count
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.path or not os.path.exists(self.path):
+                return
+            try:
+                with open(self.path, encoding='utf-8') as fd:
+                    data = json.load(fd)
+                self._build([Coin(*coin) for coin in data['coins']],
+                            data['fetched'])
+            except (OSError, ValueError, KeyError, TypeError):
+                # A broken file is fetched again
+                pass
+
+    def _build(self, coins, fetched):
+        keys = {}
+        for coin in coins:
+            for key in (coin.symbol, coin.id, coin.name):
+                keys.setdefault(key.lower(), coin)
+        self._keys = keys
+        self._count = len(coins)
+        self.fetched = fetched
+
+    def stale(self, ttl):
+        self._load()
+        return not self._count or time.time() - self.fetched >= ttl
+
+    def update(self, coins):
+        """Replaces the index with coins, a list of Coin largest first"""
+        fetched = time.time()
+        with self._lock:
+            self._build(coins, fetched)
+            self._loaded = True
+            if not self.path:
+                return
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as fd:
+                json.dump({'fetched': fetched, 'coins': [
+                    [coin.id, coin.symbol, coin.name] for coin in coins]}, fd)
+            os.replace(tmp, self.path)
+
+    def lookup(self, query):
+        """Returns the Coin for a symbol, id or name, or None"""
+        self._load()
+        return self._keys.get(query.lower())
+
+
+class CoinGecko(object):
+    """CoinGecko's API, which prices many coins in several currencies with
+    a single request"""
+
+    def __init__(self, http, url, api_key=''):
+        self.http = http
+        self.url = url.rstrip('/')
+        self.headers = {'x-cg-demo-api-key': api_key} if api_key else {}
+
+    def get(self, path, params):
+        response = self.http.get(self.url + path, params=params,
+                                 headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def coins(self, count=250):
+        """Returns the count largest coins by market cap"""
+        return [Coin(coin['id'], coin['symbol'], coin['name'])
+                for coin in self.get('/coins/markets', {
+                    'vs_currency': 'usd',
+                    'order': 'market_cap_desc',
+                    'per_page': count,
+                    'page': 1,
+                })]
+
+    def quotes(self, ids, fiats):
+        """Returns {id: {fiat: (price, 24h change percent)}} for the coins
+        with those ids"""
+        data = self.get('/simple/price', {
+            'ids': ','.join(ids),
+            'vs_currencies': ','.join(fiat.lower() for fiat in fiats),
+            'include_24hr_change': 'true',
+        })
+        quotes = {}
+        for id, prices in data.items():
+            quote = {}
+            for fiat in fiats:
+                price = prices.get(fiat.lower())
+                if price is not None:
+                    quote[fiat.upper()] = (
+                        price, prices.get(fiat.lower() + '_24h_change'))
+            quotes[id] = quote
+        return quotes
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
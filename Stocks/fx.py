@@ -0,0 +1,156 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import json
+import os
+import threading
+import time
+
+
+class RateTable(object):
+    """Exchange rates of every currency of one snapshot against its base.
+
+    Any other base is answered from the same snapshot: the rate from a to b
+    is rate(b) / rate(a), computed for every pair at once as a matrix the
+    first time the table is crossed."""
+
+    def __init__(self, base, rates, fetched=None):
+        self.base = base.upper()
+        rates = dict((code.upper(), float(rate))
+                     for code, rate in rates.items() if rate)
+        rates[self.base] = 1.0
+        self.codes = sorted(rates)
+        self.index = dict((code, i) for i, code in enumerate(self.codes))
+        self.rates = [rates[code] for code in self.codes]
+        self.fetched = fetched or time.time()
+        self._matrix = None
+
+    def __contains__(self, code):
+        return code.upper() in self.index
+
+    def __len__(self):
+        return len(self.codes)
+
+    def matrix(self):
+        # matrix[i, j] converts codes[i] to codes[j].  Building it twice
+        # from two threads is harmless.
+        if self._matrix is None:
+            # Imported here so loading the plugin doesn't pay for NumPy
+            import numpy
+            vector = numpy.asarray(self.rates, dtype=float)
+            self._matrix = vector[numpy.newaxis, :] / vector[:, numpy.newaxis]
+        return self._matrix
+
+    def cross(self, base, quotes):
+        """Returns the rates converting base to each of quotes, None for
+        currencies missing from the snapshot.  base must be in the table."""
+        row = self.matrix()[self.index[base.upper()]]
+        return [float(row[self.index[quote.upper()]])
+                if quote.upper() in self.index else None
+                for quote in quotes]
+
+
+def parse_snapshot(data, fetched=None):
+    """Builds a RateTable from ExchangeRate-API's latest rates, or any JSON
+    object with a base and a rates object, raises ValueError otherwise"""
+    if not isinstance(data, dict):
+        raise ValueError('Not a rates snapshot.')
+    if data.get('result', 'success') != 'success':
+        raise ValueError(data.get('error-type') or 'An error occurred.')
+    base = data.get('base_code') or data.get('base')
+    rates = data.get('rates')
+    if not base or not isinstance(rates, dict):
+        raise ValueError('Not a rates snapshot.')
+    return RateTable(base, rates, fetched)
+
+
+class ExchangeRateAPI(object):
+    """ExchangeRate-API's open endpoint, which returns every rate against a
+    base with a single request and without a key"""
+
+    def __init__(self, http, url):
+        self.http = http
+        self.url = url.rstrip('/')
+
+    def snapshot(self, base):
+        response = self.http.get('{url}/{base}'.format(url=self.url,
+                                                       base=base.upper()))
+        response.raise_for_status()
+        return parse_snapshot(response.json())
+
+
+class RatesFile(object):
+    """A snapshot kept in a JSON file refreshed outside of the bot, such as
+    by a cron job saving ExchangeRate-API's reply.  The file is only parsed
+    again once it changes."""
+
+    def __init__(self):
+        self._key = None
+        self._table = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, path):
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            if self._key != (path, mtime):
+                with open(path, encoding='utf-8') as fd:
+                    self._table = parse_snapshot(json.load(fd), mtime)
+                self._key = (path, mtime)
+            return self._table
+
+
+class TableStore(object):
+    """Fetched snapshots by base currency.  A snapshot answers every base,
+    so one is only fetched when none is fresh."""
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def add(self, table):
+        with self._lock:
+            self._tables[table.base] = table
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+    def lookup(self, base, ttl):
+        """Returns the freshest table covering base that is less than ttl
+        seconds old, or None"""
+        now = time.time()
+        with self._lock:
+            for code, table in list(self._tables.items()):
+                if now - table.fetched >= ttl:
+                    del self._tables[code]
+            tables = [table for table in self._tables.values()
+                      if base in table]
+        if not tables:
+            return None
+        return max(tables, key=lambda table: table.fetched)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
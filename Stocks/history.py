@@ -0,0 +1,234 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import bisect
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import date, timedelta
+
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+SPARKS = '▁▂▃▄▅▆▇█'
+
+RANGE_RE = re.compile(r'^(\d{1,3})(d|w|mo|y)$')
+RANGE_DAYS = {'d': 1, 'w': 7}
+
+
+def parse_range(text, today):
+    """Returns the first day covered by a range such as 5d, 2w, 3mo, 1y or
+    ytd ending today, or None if text isn't a range"""
+    text = text.lower()
+    if text == 'ytd':
+        return date(today.year, 1, 1)
+    match = RANGE_RE.match(text)
+    if not match or not int(match.group(1)):
+        return None
+    count, unit = int(match.group(1)), match.group(2)
+    try:
+        if unit == 'mo':
+            month = today.month - 1 - count
+            return date(today.year + month // 12, month % 12 + 1,
+                        min(today.day, 28))
+        if unit == 'y':
+            return date(today.year - count, today.month, min(today.day, 28))
+        return today - timedelta(days=count * RANGE_DAYS[unit])
+    except (ValueError, OverflowError):
+        return None
+
+
+def weekend(first, last):
+    """Returns whether every day from first to last (ordinal days) is a
+    Saturday or a Sunday, which never have a bar"""
+    return last - first < 2 and all(
+        date.fromordinal(day).weekday() >= 5 for day in range(first, last + 1))
+
+
+def sparkline(values, width):
+    """Renders values as a line of block characters at most width long,
+    keeping the last value of each bucket when there are more values"""
+    if len(values) > width:
+        step = len(values) / width
+        values = [values[min(int((i + 1) * step) - 1, len(values) - 1)]
+                  for i in range(width)]
+    if not values:
+        return ''
+    low, high = min(values), max(values)
+    spread = (high - low) or 1
+    top = len(SPARKS) - 1
+    return ''.join(SPARKS[int(round((value - low) / spread * top))]
+                   for value in values)
+
+
+class BarSeries(object):
+    """Daily OHLCV bars of one symbol stored column-wise in arrays.
+
+    The series covers a contiguous range of days, days without a bar in it
+    (weekends, holidays) are known not to have one.  Fetched ranges are
+    spliced in at either end so only days outside the covered range have to
+    be fetched.  live is the day of a bar fetched while its session was
+    still open, whose close will still move."""
+
+    def __init__(self):
+        self.days = array('l')
+        self.columns = dict((column, array('d')) for column in COLUMNS)
+        self.first = None
+        self.last = None
+        self.live = None
+        self.fetched = 0.0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.days)
+
+    def missing(self, start, end, today, ttl, now):
+        """Returns the (start, end) day ranges that have to be fetched to
+        cover start to end.  A bar fetched during its session is fetched
+        again from its day on once it's older than ttl, and once its day is
+        over so its final close replaces the intraday one."""
+        if self.first is None:
+            return [(start, end)]
+        last = self.last
+        if self.live is not None and (self.live < today or
+                                      now - self.fetched >= ttl):
+            last = min(last, self.live - 1)
+        ranges = []
+        if start < self.first:
+            ranges.append((start, self.first - 1))
+        if end > last:
+            ranges.append((last + 1, end))
+        return ranges
+
+    def splice(self, start, end, bars, now, live=None):
+        """Replaces the days from start to end with bars, a list of (day,
+        open, high, low, close, volume) tuples sorted by day, live being the
+        day of a bar whose session was still open"""
+        left = bisect.bisect_left(self.days, start)
+        right = bisect.bisect_right(self.days, end)
+        self.days[left:right] = array('l', (bar[0] for bar in bars))
+        for i, column in enumerate(COLUMNS, 1):
+            self.columns[column][left:right] = array(
+                'd', (bar[i] for bar in bars))
+        self.first = start if self.first is None else min(self.first, start)
+        self.last = end if self.last is None else max(self.last, end)
+        if live is not None:
+            self.live = live
+            self.fetched = now
+        elif self.live is not None and start <= self.live <= end:
+            self.live = None
+
+    def window(self, start, end):
+        """Returns the columns of the bars from start to end as a dict of
+        arrays, 'day' included"""
+        left = bisect.bisect_left(self.days, start)
+        right = bisect.bisect_right(self.days, end)
+        bars = dict((column, self.columns[column][left:right])
+                    for column in COLUMNS)
+        bars['day'] = self.days[left:right]
+        return bars
+
+
+class HistoryCache(object):
+    """LRU cache of BarSeries keyed by normalized symbol.
+
+    Fetches for one symbol are serialized through the series' lock, so
+    concurrent requests for overlapping ranges fetch the missing days once
+    and the others are served from the cache."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.fetches = 0
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._series)
+
+    def _get(self, symbol):
+        with self._lock:
+            series = self._series.get(symbol)
+            if series is None:
+                series = self._series[symbol] = BarSeries()
+            self._series.move_to_end(symbol)
+            while len(self._series) > max(self.maxsize, 1):
+                self._series.popitem(last=False)
+            return series
+
+    def bars(self, symbol, start, end, fetcher, ttl, today=None):
+        """Returns the bars of symbol from start to end (dates), fetching
+        missing days with fetcher(symbol, start, end), which returns a list
+        of (day, open, high, low, close, volume) tuples with ordinal days and
+        the day of a bar from a still open session, or None.
+
+        A fetch returning no bars isn't cached, the days may only have been
+        missing from the answer, unless it's a weekend that has none.
+        Exceptions raised by fetcher leave the series unchanged and are
+        raised, except for the newest days of a series already holding
+        older ones: the cached bars are returned with 'missing' set to the
+        first day that couldn't be fetched, None otherwise."""
+        symbol = symbol.upper()
+        today = (today or date.today()).toordinal()
+        start, end = start.toordinal(), min(end.toordinal(), today)
+        series = self._get(symbol)
+        missing = None
+        with series.lock:
+            ranges = series.missing(start, end, today, ttl, time.monotonic())
+            for first, last in ranges:
+                if weekend(first, last):
+                    series.splice(first, last, [], time.monotonic())
+                    continue
+                with self._lock:
+                    self.fetches += 1
+                try:
+                    bars, live = fetcher(symbol, date.fromordinal(first),
+                                         date.fromordinal(last))
+                except Exception:
+                    if series.first is None or first <= series.first:
+                        raise
+                    missing = first
+                    continue
+                bars = sorted(bar for bar in bars if first <= bar[0] <= last)
+                if bars:
+                    series.splice(first, last, bars, time.monotonic(), live)
+            if not ranges:
+                with self._lock:
+                    self.hits += 1
+            window = series.window(start, end)
+        window['missing'] = missing
+        return window
+
+    def stats(self):
+        with self._lock:
+            return {
+                'symbols': len(self._series),
+                'maxsize': self.maxsize,
+                'bars': sum(len(series) for series in self._series.values()),
+                'hits': self.hits,
+                'fetches': self.fetches,
+            }
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
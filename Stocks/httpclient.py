@@ -0,0 +1,122 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import functools
+import random
+import threading
+from urllib.parse import urlsplit
+
+# Longest wait honoured from a Retry-After header, in seconds, so a server
+# asking for more can't stall a command beyond the retry budget
+MAX_RETRY_AFTER = 5.0
+
+
+@functools.lru_cache(maxsize=None)
+def jitter_retry():
+    """Returns the JitterRetry class, defined on first use so urllib3 is
+    only imported with the session"""
+    from urllib3.util.retry import Retry
+
+    class JitterRetry(Retry):
+        """Retry whose exponential backoff is spread with random jitter, so
+        retries from concurrent commands don't hit a struggling host in
+        step, and whose Retry-After waits are capped"""
+
+        def get_backoff_time(self):
+            backoff = super(JitterRetry, self).get_backoff_time()
+            return random.uniform(backoff / 2, backoff) if backoff else 0
+
+        def get_retry_after(self, response):
+            retry_after = super(JitterRetry, self).get_retry_after(response)
+            if retry_after is None:
+                return None
+            return min(retry_after, MAX_RETRY_AFTER)
+
+    return JitterRetry
+
+
+class HTTPClient(object):
+    """Plugin-lifetime HTTP client.
+
+    Wraps a single requests.Session so connections are kept alive in a pool
+    per host, applies default connect/read timeouts to every request and
+    retries 429 and 5xx responses to idempotent requests a bounded number
+    of times.  POSTs aren't retried, the server may have already created
+    a paste or link when it errors.  Requests are timed per host into
+    metrics when a metrics.Registry is given."""
+
+    def __init__(self, connect_timeout, read_timeout, retries=2,
+                 pool_size=10, metrics=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.metrics = metrics
+        self.retries = retries
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Created by the first request, so loading the plugin doesn't import
+        # requests
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._connect()
+        return self._session
+
+    def _connect(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        retry = jitter_retry()(total=self.retries, backoff_factor=0.5,
+                               status_forcelist=(429, 500, 502, 503, 504),
+                               raise_on_status=False,
+                               respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+        with self.metrics.timed('upstream', host=urlsplit(url).hostname):
+            return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -21,13 +21,19 @@
 #
 ###
 
+import csv
 import re
-import requests
-from yahooquery import Ticker
-from datetime import datetime, timedelta
+import time
+import functools
+import threading
+from datetime import date, datetime, timedelta
 
-from supybot import utils, plugins, ircutils, callbacks
+from supybot import (utils, plugins, ircdb, ircmsgs, ircutils, callbacks,
+                     conf, schedule, world)
 from supybot.commands import *
+
+from . import (alerts, cache, crypto, fx, history, httpclient, metrics,
+               portfolio, providers, render, symbols, workers)
 try:
     from supybot.i18n import PluginInternationalization
     _ = PluginInternationalization('Stocks')
@@ -36,124 +42,799 @@ except ImportError:
     # without the i18n module
     _ = lambda x: x
 
+
+def Ticker(symbols, **kwargs):
+    # yahooquery brings pandas along, so it's only imported by the first
+    # request instead of when the plugin loads
+    from yahooquery import Ticker
+    return Ticker(symbols, **kwargs)
+
+
+US_INDEXES = ['^DJI', '^GSPC', '^IXIC', '^RUT']
+WORLD_INDEXES = ['^GDAXI', '^FCHI', '^FTSE', '^N225']
+
+# Currencies some exchanges quote in hundredths of
+MINOR_CURRENCIES = {
+    'GBp': ('GBP', 0.01),
+    'GBX': ('GBP', 0.01),
+    'ZAc': ('ZAR', 0.01),
+    'ILA': ('ILS', 0.01),
+}
+
+# Market states during which quotes move and the prefetcher refreshes often
+OPEN_MARKET_STATES = ('REGULAR', 'PRE', 'POST')
+
+ALPHAVANTAGE_URL = 'https://www.alphavantage.co/query'
+COINGECKO_URL = 'https://api.coingecko.com/api/v3'
+EXCHANGERATE_URL = 'https://open.er-api.com/v6/latest'
+
+SYMBOL_RE = re.compile(r'^[\w^=:.\-]{1,10}$')
+FOREX_RE = re.compile(r'^[\w^=:.\-]{1,3}$')
+
+# An alert threshold, a price or a percent move from the current price
+THRESHOLD_RE = re.compile(r'^(\d+(?:\.\d+)?)(%?)$')
+
+
+def same_user(hostmask, other):
+    # Whether two hostmasks are the same person, either literally or by
+    # being recognized as the same registered user
+    if hostmask is None or other is None:
+        return False
+    if ircutils.strEqual(hostmask, other):
+        return True
+    try:
+        return ircdb.users.getUserId(hostmask) == \
+            ircdb.users.getUserId(other)
+    except KeyError:
+        return False
+
+
 class Stocks(callbacks.Plugin):
     """Provides access to stocks data"""
     threaded = True
 
-    def get_forex(self, irc, session, symbol1, symbol2):
+    def __init__(self, irc):
+        self.__parent = super(Stocks, self)
+        self.__parent.__init__(irc)
+        self.metric_registry = metrics.Registry('stocks')
+        self.quote_cache = cache.QuoteCache(self.registryValue('cache.size'))
+        self.rate_store = cache.RateStore()
+        self.crypto_cache = cache.QuoteCache(self.registryValue('cache.size'))
+        self.coin_index = crypto.CoinIndex(
+            conf.supybot.directories.data.dirize('Stocks.coins.json'))
+        self.history_cache = history.HistoryCache(
+            self.registryValue('history.size'))
+        self.symbol_index = symbols.SymbolIndex(
+            self.registryValue('symbols.file') or None)
+        self.http = httpclient.HTTPClient(
+            self.registryValue('http.timeout.connect'),
+            self.registryValue('http.timeout.read'),
+            self.registryValue('http.retries'),
+            metrics=self.metric_registry)
+        self.alphavantage = providers.AlphaVantageProvider(self.http,
+            lambda: ALPHAVANTAGE_URL,
+            lambda: self.registryValue('alphavantage.api.key'))
+        self.router = self.build_router()
+        self.fx_tables = fx.TableStore()
+        self.fx_file = fx.RatesFile()
+        self.fx_lock = threading.Lock()
+        self.watched = {}
+        self.watch_lock = threading.Lock()
+        self.prefetching = False
+        path = conf.supybot.directories.data.dirize('Stocks.sqlite')
+        self.alert_store = alerts.AlertStore(
+            path if self.registryValue('alerts.persist') else None)
+        self.portfolios = portfolio.PortfolioStore(
+            path if self.registryValue('portfolio.persist') else None)
+        self.poll_lock = threading.Lock()
+        self.polling = False
+        if len(self.alert_store):
+            self.start_polling()
+        self.workers = None
+        if self.registryValue('workers.enable'):
+            self.workers = workers.WorkerPool(self.name(),
+                self.registryValue('workers.threads'),
+                self.registryValue('workers.queue'))
+            # Commands are handed to the pool instead of a thread each
+            self.threaded = False
+        self.metric_registry.collect(self.collect_metrics)
+        self.exporter = None
+        port = self.registryValue('metrics.port')
+        if port:
+            try:
+                self.exporter = metrics.Exporter(
+                    self.metric_registry, self.registryValue('metrics.host'),
+                    port)
+            except OSError as e:
+                self.log.error('Stocks: cannot serve metrics on port %s: %s',
+                               port, e)
+
+    def build_router(self):
+        available = {
+            # Looked up when called so Ticker can be replaced in tests
+            'yahoo': providers.YahooProvider(lambda symbols: Ticker(symbols)),
+            'alphavantage': self.alphavantage,
+            'fixture': providers.FixtureProvider(
+                lambda: self.registryValue('providers.fixture')),
+        }
+        chosen = []
+        for name in self.registryValue('providers.order'):
+            provider = available.get(name.lower())
+            if provider is None:
+                self.log.warning('Stocks: ignoring unknown quote provider %s', name)
+            elif provider not in chosen:
+                chosen.append(provider)
+        return providers.Router(chosen or [available['yahoo']],
+                                self.registryValue('providers.breaker.failures'),
+                                self.registryValue('providers.breaker.cooldown'),
+                                metrics=self.metric_registry)
+
+    def collect_metrics(self):
+        # Cache and provider statistics the plugin already keeps, read when
+        # metrics are
+        for name, cache_ in (('quote', self.quote_cache),
+                             ('crypto', self.crypto_cache)):
+            stats = cache_.stats()
+            for key in ('hits', 'misses', 'evictions'):
+                yield ('counter', 'cache_' + key + '_total', {'cache': name},
+                       stats[key])
+            yield ('gauge', 'cache_entries', {'cache': name}, stats['size'])
+        stats = self.history_cache.stats()
+        yield ('counter', 'cache_hits_total', {'cache': 'history'},
+               stats['hits'])
+        yield ('counter', 'cache_misses_total', {'cache': 'history'},
+               stats['fetches'])
+        yield ('gauge', 'cache_entries', {'cache': 'history'}, stats['bars'])
+        yield ('gauge', 'cache_entries', {'cache': 'forex'},
+               len(self.fx_tables))
+        for name, state, latency, error_rate, requests in \
+                self.router.report():
+            yield ('gauge', 'provider_open', {'provider': name},
+                   int(state != 'closed'))
+
+    def die(self):
+        with self.watch_lock:
+            self.prefetching = False
+            self.unschedule_prefetch()
+        with self.poll_lock:
+            self.polling = False
+            self.unschedule_poll()
+        self.alert_store.close()
+        self.portfolios.close()
+        if self.workers is not None:
+            self.workers.stop()
+        self.http.close()
+        if self.exporter is not None:
+            self.exporter.close()
+        self.__parent.die()
+
+    def _timeCommand(self, command, irc, msg, *args, **kwargs):
+        with self.metric_registry.timed('command', command=' '.join(command)):
+            return self.__parent._callCommand(command, irc, msg, *args,
+                                              **kwargs)
+
+    def _callCommand(self, command, irc, msg, *args, **kwargs):
+        if self.workers is None:
+            return self._timeCommand(command, irc, msg, *args, **kwargs)
+        call = functools.partial(self._timeCommand, command, irc, msg,
+                                 *args, **kwargs)
+        if not self.workers.submit((irc.network, msg.channel or msg.nick),
+                                   call):
+            irc.error('Too busy right now, try again later.')
+
+    def watch(self, symbols):
+        # Marks symbols as wanted by the prefetcher, which is started again
+        # if it went idle
+        if not self.registryValue('prefetch.enable'):
+            return
+        now = time.monotonic()
+        with self.watch_lock:
+            for symbol in symbols:
+                self.watched[symbol.upper()] = now
+            if self.prefetching:
+                return
+            self.prefetching = True
+            self.schedule_prefetch(
+                self.registryValue('prefetch.interval.open'))
+
+    def unschedule_prefetch(self):
+        try:
+            schedule.removeEvent('Stocks.prefetch')
+        except KeyError:
+            pass
+
+    def schedule_prefetch(self, interval):
+        self.unschedule_prefetch()
+
+        def start():
+            world.SupyThread(target=self.prefetch,
+                             name='Stocks prefetch').start()
+        schedule.addEvent(start, time.time() + interval,
+                          name='Stocks.prefetch')
+
+    def prefetch(self):
+        # Refreshes every recently requested symbol in one batched fetch and
+        # keeps the results cached until the next refresh
+        idle = self.registryValue('prefetch.idle')
+        now = time.monotonic()
+        with self.watch_lock:
+            for symbol, requested in list(self.watched.items()):
+                if now - requested > idle:
+                    del self.watched[symbol]
+            symbols = sorted(self.watched)
+            if not symbols:
+                # Nobody asked recently, stop until the next request
+                self.prefetching = False
+                return
+
+        try:
+            quotes = self.fetch_quotes(symbols)
+        except Exception:
+            self.log.exception('Stocks: prefetching %s failed',
+                               ', '.join(symbols))
+            quotes = {}
+
+        # supybot.commands shadows any(), so check market states by hand
+        market_states = set(quote.market_state for quote in quotes.values())
+        if not quotes or market_states.intersection(OPEN_MARKET_STATES):
+            interval = self.registryValue('prefetch.interval.open')
+        else:
+            interval = self.registryValue('prefetch.interval.closed')
+
+        for symbol, quote in quotes.items():
+            self.quote_cache.set(symbol, quote,
+                                 max(self.quote_ttl(quote), interval * 2))
+
+        with self.watch_lock:
+            if self.prefetching:
+                self.schedule_prefetch(interval)
+
+    def start_polling(self):
+        # Starts polling alerts again if it went idle
+        with self.poll_lock:
+            if self.polling:
+                return
+            self.polling = True
+            self.schedule_poll(self.registryValue('alerts.interval.open'))
+
+    def unschedule_poll(self):
+        try:
+            schedule.removeEvent('Stocks.alerts')
+        except KeyError:
+            pass
+
+    def schedule_poll(self, interval):
+        self.unschedule_poll()
+
+        def start():
+            world.SupyThread(target=self.poll_alerts,
+                             name='Stocks alerts').start()
+        schedule.addEvent(start, time.time() + interval,
+                          name='Stocks.alerts')
+
+    def poll_alerts(self):
+        # Fetches every symbol with an alert once, in batches, whatever the
+        # number of alerts on it and fires the alerts its price crossed
+        symbols = self.alert_store.symbols()
+        if not symbols:
+            with self.poll_lock:
+                self.polling = False
+            return
+
+        batch = self.registryValue('alerts.batch')
+        quotes = {}
+        for i in range(0, len(symbols), batch):
+            try:
+                quotes.update(self.fetch_quotes(symbols[i:i + batch]))
+            except Exception:
+                self.log.exception('Stocks: polling alerts for %s failed',
+                                   ', '.join(symbols[i:i + batch]))
+
+        for symbol, quote in quotes.items():
+            self.quote_cache.set(symbol, quote, self.quote_ttl(quote))
+
+        prices = dict((symbol, quote.price)
+                      for symbol, quote in quotes.items())
+        for alert in self.alert_store.trigger(prices):
+            self.notify_alert(alert, prices[alert.symbol])
+
+        market_states = set(quote.market_state for quote in quotes.values())
+        if not quotes or market_states.intersection(OPEN_MARKET_STATES):
+            interval = self.registryValue('alerts.interval.open')
+        else:
+            interval = self.registryValue('alerts.interval.closed')
+
+        with self.poll_lock:
+            if self.polling:
+                self.schedule_poll(interval)
+
+    def notify_alert(self, alert, price):
+        irc = world.getIrc(alert.network)
+        if irc is None:
+            self.log.info('Stocks: dropping alert #%s, not connected to %s',
+                          alert.id, alert.network)
+            return
+        if alert.channel not in irc.state.channels:
+            self.log.info('Stocks: dropping alert #%s, not in %s on %s',
+                          alert.id, alert.channel, alert.network)
+            return
+        irc.queueMsg(ircmsgs.privmsg(alert.channel,
+            "{nick}: {message} (alert #{id})".format(
+                nick=alert.nick, message=self.format_alert(alert, price),
+                id=alert.id)))
+
+    def format_alert(self, alert, price=None):
+        # Describes a pending alert, or a triggered one when price is given
+        fired = price is not None
+        if alert.reference:
+            message = "{symbol} {direction} {change:g}% from {reference:g}"
+            if alert.above:
+                direction = 'rose' if fired else 'rises'
+            else:
+                direction = 'fell' if fired else 'falls'
+        else:
+            message = "{symbol} {direction} {threshold:g}"
+            direction = ('is ' if fired else 'goes ') + \
+                ('above' if alert.above else 'below')
+        if fired:
+            message += ", now {price:g}"
+
+        reference = alert.reference or alert.threshold
+        return message.format(
+            symbol=ircutils.bold(alert.symbol),
+            direction=direction,
+            change=round(abs(alert.threshold / reference - 1) * 100, 2),
+            reference=round(reference, 2),
+            threshold=round(alert.threshold, 2),
+            price=round(price or 0, 2),
+        )
+
+    def get_forex(self, irc, symbol1, symbol2):
         api_key = self.registryValue('alphavantage.api.key')
         if not api_key:
             irc.error('Missing API key, ask the admin to get one and set '
                       'supybot.plugins.Stocks.alphavantage.api.key', Raise=True)
+        return self.alphavantage.exchange_rate(symbol1, symbol2)
+
+    def quote_ttl(self, quote):
+        # Quotes barely move while their market is closed, so keep them
+        # around for longer
+        market_state = quote.market_state
+        if market_state == 'REGULAR':
+            return self.registryValue('cache.ttl.regular')
+        elif market_state in ('PRE', 'POST', 'PREPRE', 'POSTPOST'):
+            return self.registryValue('cache.ttl.extended')
+        return self.registryValue('cache.ttl.closed')
+
+    def get_quotes(self, symbols):
+        return self.quote_cache.fetch(symbols, self.fetch_quotes,
+                                      self.quote_ttl)
+
+    def fetch_quotes(self, symbols):
+        # Get data for every symbol from the fastest healthy provider. This
+        # also runs outside of commands, so raise instead of irc.error
         try:
-            return session.get('https://www.alphavantage.co/query?function=CURRENCY_EXCHANGE_RATE&from_currency={symbol1}&to_currency={symbol2}&apikey={api_key}'.format(symbol1=symbol1,symbol2=symbol2,
-                api_key=api_key)).json()
-        except Exception:
-            raise
+            return self.router.quotes(symbols)
+        except providers.ProviderError as e:
+            raise callbacks.Error("{symbols}: {message}".format(symbols=', '.join(symbols), message=e))
 
+    def resolve_symbol(self, symbol):
+        # Maps a company name, alias or misspelt name to its ticker from the
+        # local index.  Returns (symbol, error), where error is set for
+        # symbols rejected without asking upstream.  Input written like a
+        # ticker is only matched against tickers, so listed tickers such as
+        # DOW or GOLD aren't swapped for the index or future they alias.
+        if not self.registryValue('symbols.enable'):
+            return (symbol, None)
+        try:
+            indexed = self.symbol_index.get(symbol)
+            if indexed is None and not (symbol.isupper() and
+                                        SYMBOL_RE.match(symbol)):
+                indexed = self.symbol_index.resolve(
+                    symbol, fuzzy=self.registryValue('symbols.fuzzy'))
+        except (OSError, csv.Error):
+            self.log.exception('Stocks: loading the symbol index from %s '
+                               'failed', self.symbol_index.path)
+            return (symbol, None)
+        if indexed is not None:
+            return (indexed.ticker, None)
+        if not SYMBOL_RE.match(symbol):
+            return (symbol, 'Invalid symbol.')
+        if self.registryValue('symbols.strict'):
+            return (symbol, 'Unknown symbol.')
+        return (symbol, None)
 
-    def get_stocks(self, irc, symbol):
-        # Do regex checking on symbol to ensure it's valid
-        if not re.match(r'^[\w^=:.\-]{1,10}$', symbol):
-            irc.errorInvalid('symbol', symbol, Raise=True)
+    def fetch_history(self, symbol, start, end):
+        # Daily bars from start to end as (day, open, high, low, close,
+        # volume) tuples with ordinal days, and the day of a bar from a
+        # session still open or None; yahooquery's end is exclusive
+        try:
+            bars = Ticker(symbol).history(start=start,
+                                          end=end + timedelta(days=1),
+                                          interval='1d')
+        except Exception as e:
+            raise providers.ProviderError(e)
 
-        # Get data from API
-        ticker = Ticker(symbol)
-
-        if not ticker.price:
-            irc.error("{symbol}: An error occurred.".format(symbol=symbol), Raise=True)
-
-        if 'error' in ticker.price.keys():
-            irc.error("{symbol}: {message}".format(symbol=symbol, message=ticker.price['error']['description']), Raise=True)
-            
-        print("Ticker price data:", ticker.price)
-
-        market_state = ticker.price.get('marketState')  # Access 'marketState' from the dictionary
-        quote_type = ticker.price.get('quoteType')  # Access 'quoteType' from the dictionary
-
-        if quote_type == 'INDEX' or market_state == 'REGULAR':
-            price = ticker.price.get('regularMarketPrice')
-            market_state = 'Open'
-        elif market_state == 'POST':
-            price = ticker.price.get('postMarketPrice')
-            market_state = 'Post-market'
-        elif market_state == 'PRE':
-            price = ticker.price.get('preMarketPrice')
-            market_state = 'Pre-market'
-        else:
-            price = ticker.price.get('regularMarketPrice')
-
-        short_name = ticker.price.get('shortName')
-        close = ticker.price.get('regularMarketPreviousClose')
-        currency = ticker.price.get('currencySymbol')
-        day_high = ticker.price.get('regularMarketDayHigh')
-        day_low = ticker.price.get('regularMarketDayLow')
-        change = round(price - close,2)
-        change_percent = round(change / close * 100, 2)
-
-        message = (
-            '{symbol} : {short_name} {currency}{price:g} '
-        )
+        if isinstance(bars, dict) or bars is None:
+            # Older yahooquery versions answer failed requests with
+            # {symbol: message}
+            self.log.debug('Stocks: no history for %s from %s to %s: %r',
+                           symbol, start, end, bars)
+            message = next(iter(bars.values()), None) if bars else None
+            raise providers.ProviderError(message or 'An error occurred.')
+        if bars.empty:
+            # Unknown symbols, failed requests and ranges without trading
+            # days alike, which the cache doesn't keep
+            return [], None
+
+        rows = []
+        live = None
+        for bar in bars.reset_index().itertuples(index=False):
+            day = bar.date
+            if isinstance(day, datetime):
+                # Daily bars are indexed by date, but the bar of a session
+                # still open by the time of its last trade
+                day = day.date()
+                live = day.toordinal()
+            if bar.close != bar.close:
+                # NaN close for a day without trades
+                continue
+            rows.append((day.toordinal(), bar.open, bar.high, bar.low,
+                         bar.close, bar.volume))
+        return rows, live
+
+    def get_history(self, irc, symbol, period):
+        today = date.today()
+        start = history.parse_range(period, today)
+        if start is None or start.year < 1970:
+            irc.errorInvalid('range', period, Raise=True)
+
+        try:
+            bars = self.history_cache.bars(symbol, start, today,
+                                           self.fetch_history,
+                                           self.registryValue('history.ttl'),
+                                           today)
+        except providers.ProviderError as e:
+            irc.error("{symbol}: {message}".format(symbol=symbol, message=e),
+                      Raise=True)
+        closes = bars['close']
+        if not closes:
+            irc.error("{symbol}: No data found.".format(symbol=symbol), Raise=True)
+
+        message = self.format_history(symbol, period, bars)
+        if bars['missing'] is not None:
+            message += " (no data from {day} on)".format(
+                day=date.fromordinal(bars['missing']).isoformat())
+        return message
 
+    def format_history(self, symbol, period, bars):
+        closes = bars['close']
+        first, last = closes[0], closes[-1]
+        change = round(last - first, 2)
+        change_percent = round(change / first * 100, 2) if first else 0.0
+
+        message = '{symbol} {period}: {sparkline} {first:g} to {last:g} '
         if change >= 0.0:
             message += ircutils.mircColor('\u25b2 {change:g} ({change_percent:g}%)', 'green')
         else:
             message += ircutils.mircColor('\u25bc {change:g} ({change_percent:g}%)', 'red')
+        message += ' High: {high:g} Low: {low:g} ({count} days)'
 
-        message += " High: {day_high} Low: {day_low}"
-        if quote_type != 'INDEX':
-            message += " {market_state}"
-
-        message = message.format(
+        return message.format(
             symbol=ircutils.bold(symbol),
-            short_name=short_name,
-            currency=currency,
-            price=price,
+            period=period.lower(),
+            sparkline=history.sparkline(closes,
+                                        self.registryValue('history.width')),
+            first=round(first, 2),
+            last=round(last, 2),
             change=change,
             change_percent=change_percent,
-            day_high=day_high,
-            day_low=day_low,
-            market_state=market_state,
+            high=round(max(bars['high']), 2),
+            low=round(min(bars['low']), 2),
+            count=len(closes),
         )
 
-        return message
-    
-    def get_forexs(self, irc, session, forex1, forex2):
-        # Do regex checking on symbol to ensure it's valid
-        if not re.match(r'^[\w^=:.\-]{1,3}$', forex1):
-            irc.errorInvalid('forex', forex1, Raise=True)
+    def get_portfolio(self, irc, nick):
+        holdings = self.portfolios.holdings(irc.network, ircutils.toLower(nick))
+        if not holdings:
+            irc.error("{nick} has no portfolio.".format(nick=nick), Raise=True)
+
+        # Every holding is valued from one batched quote fetch and one rate
+        # per currency, never a request per position
+        quotes = self.get_quotes([holding.symbol for holding in holdings])
+        base = self.registryValue('portfolio.currency').upper()
+        rates = {base: 1.0}
+        positions, missing = [], []
+        for holding in holdings:
+            quote = quotes.get(holding.symbol)
+            price = quote and quote.price
+            if not price:
+                missing.append(holding.symbol)
+                continue
+            currency = quote.currency or base
+            currency, scale = MINOR_CURRENCIES.get(currency, (currency.upper(), 1))
+            if currency not in rates:
+                rates[currency] = self.get_rate(irc, currency, base)[2]
+            previous = quote.previous_close or price
+            positions.append((holding, price, previous,
+                              rates[currency] * scale))
+
+        if not positions:
+            irc.error("No data found for {symbols}.".format(symbols=', '.join(missing)), Raise=True)
+
+        values = portfolio.valuate(
+            [holding.quantity for holding, price, previous, rate in positions],
+            [holding.cost for holding, price, previous, rate in positions],
+            [price for holding, price, previous, rate in positions],
+            [previous for holding, price, previous, rate in positions],
+            [rate for holding, price, previous, rate in positions])
+
+        return self.format_portfolio(nick, base, positions, values, missing)
+
+    def format_change(self, change, percent, currency=''):
+        if change >= 0.0:
+            return ircutils.mircColor('\u25b2 {currency}{change:,.2f} ({percent:.2f}%)'.format(
+                currency=currency, change=change, percent=percent), 'green')
+        return ircutils.mircColor('\u25bc {currency}{change:,.2f} ({percent:.2f}%)'.format(
+            currency=currency, change=change, percent=percent), 'red')
+
+    def format_portfolio(self, nick, base, positions, values, missing):
+        currency = render.CURRENCY_SYMBOLS.get(base, base + ' ')
+        messages = ["{nick}: {currency}{value:,.2f} P/L {pl} Day {day}".format(
+            nick=ircutils.bold(nick),
+            currency=currency,
+            value=values['total_value'],
+            pl=self.format_change(values['total_pl'],
+                                  values['total_pl_percent'], currency),
+            day=self.format_change(values['total_day'],
+                                   values['total_day_percent'], currency),
+        )]
+
+        # The largest positions first
+        order = values['weight'].argsort()[::-1]
+        for i in order[:self.registryValue('portfolio.positions')]:
+            holding = positions[i][0]
+            messages.append("{symbol} {quantity:g} {weight:.1f}% {pl}".format(
+                symbol=ircutils.bold(holding.symbol),
+                quantity=holding.quantity,
+                weight=values['weight'][i],
+                pl=self.format_change(values['pl'][i], values['pl_percent'][i],
+                                      currency),
+            ))
+        if len(order) > self.registryValue('portfolio.positions'):
+            messages.append("{count} more".format(
+                count=len(order) - self.registryValue('portfolio.positions')))
+        if missing:
+            messages.append("No data found for {symbols}".format(symbols=', '.join(missing)))
 
-        if not re.match(r'^[\w^=:.\-]{1,3}$', forex2):
-            irc.errorInvalid('forex', forex2, Raise=True)
+        return messages
+
+    def crypto_fiats(self):
+        return [fiat.upper() for fiat in
+                self.registryValue('cryptofiat').split()] or ['USD']
+
+    def get_cryptos(self, irc, queries, fiats):
+        provider = crypto.CoinGecko(self.http, COINGECKO_URL,
+                                    self.registryValue('crypto.coingecko.api.key'))
+
+        # The coin list changes slowly, refresh it now and then and keep
+        # using the old one if that fails
+        if self.coin_index.stale(self.registryValue('crypto.coins.ttl')):
+            try:
+                self.coin_index.update(provider.coins())
+            except Exception:
+                self.log.exception('Stocks: fetching the coin list failed')
+        if not len(self.coin_index):
+            irc.error("The coin list couldn't be fetched, try again later.", Raise=True)
+
+        coins = [(query, self.coin_index.lookup(query)) for query in queries]
+
+        def fetcher(ids):
+            # Cache keys are uppercased, CoinGecko ids are lowercase
+            quotes = provider.quotes([id.lower() for id in ids], fiats)
+            return dict((id.upper(), quote) for id, quote in quotes.items())
+
+        ttl = self.registryValue('crypto.ttl')
+        ids = [coin.id for query, coin in coins if coin is not None]
+        quotes = self.crypto_cache.fetch(ids, fetcher,
+                                         lambda quote: ttl) if ids else {}
+
+        messages = []
+        for query, coin in coins:
+            if coin is None:
+                messages.append("{symbol}: Unknown coin.".format(symbol=query))
+                continue
+
+            quote = quotes.get(coin.id.upper())
+            if not quote:
+                messages.append("{symbol}: No data found.".format(symbol=query))
+                continue
+
+            messages.append(self.format_crypto(coin, quote, fiats))
+
+        return messages
+
+    def format_crypto(self, coin, quote, fiats):
+        prices = []
+        for fiat in fiats:
+            if fiat not in quote:
+                continue
+            price, change = quote[fiat]
+            message = '{currency}{price:g}'
+            if change is not None:
+                if change >= 0.0:
+                    message += ' ' + ircutils.mircColor('\u25b2 {change:g}%', 'green')
+                else:
+                    message += ' ' + ircutils.mircColor('\u25bc {change:g}%', 'red')
+            prices.append(message.format(
+                currency=render.CURRENCY_SYMBOLS.get(fiat, fiat + ' '),
+                price=price,
+                change=round(change or 0, 2)))
+
+        return '{symbol} : {name} {prices}'.format(
+            symbol=ircutils.bold(coin.symbol.upper()),
+            name=coin.name,
+            prices=' / '.join(prices))
+
+    def renderer(self, channel, network):
+        return render.renderer(self.registryValue('format.layout', channel,
+                                                  network))
+
+    def reply_items(self, irc, renderer, items):
+        # Packed into lines between items, so no quote is split across
+        # messages
+        irc.replies(renderer.lines(items, self.registryValue('format.length')),
+                    oneToOne=False)
+
+    def get_stocks(self, irc, symbols, renderer, resolve=False):
+        # Do regex checking on symbols to ensure they're valid, invalid ones
+        # are reported inline instead of failing the whole reply
+        errors = {}
+        if resolve:
+            resolved = []
+            for symbol in symbols:
+                symbol, error = self.resolve_symbol(symbol)
+                if error:
+                    errors[symbol] = error
+                resolved.append(symbol)
+            symbols = resolved
+
+        valid_symbols = []
+        for symbol in symbols:
+            if symbol in errors:
+                continue
+            if SYMBOL_RE.match(symbol) and symbol.upper() not in valid_symbols:
+                valid_symbols.append(symbol.upper())
+
+        quotes = self.get_quotes(valid_symbols) if valid_symbols else {}
+
+        messages = []
+        for symbol in symbols:
+            if symbol in errors:
+                messages.append(renderer.error(symbol, errors[symbol]))
+                continue
+
+            if not SYMBOL_RE.match(symbol):
+                messages.append(renderer.error(symbol, 'Invalid symbol.'))
+                continue
+
+            quote = quotes.get(symbol.upper())
+            if not quote:
+                messages.append(renderer.error(symbol, 'No data found.'))
+                continue
+
+            messages.append(renderer.quote(symbol, quote))
+
+        return messages
+
+    def get_forexs(self, irc, forex1, forexs, renderer):
+        # Do regex checking on symbols to ensure they're valid
+        for forex in [forex1] + forexs:
+            if not FOREX_RE.match(forex):
+                irc.errorInvalid('forex', forex, Raise=True)
+
+        messages = []
+        for rate in self.get_rates(irc, forex1, forexs):
+            if rate[2] is None:
+                messages.append(renderer.error(rate[1], 'Unknown currency.'))
+            else:
+                messages.append(self.format_forex(renderer, *rate))
+        return messages
+
+    def get_table(self, irc, base):
+        # Returns a snapshot of every rate that covers base, fetched once
+        # per forex.ttl or read from the rates file
+        try:
+            if self.registryValue('forex.provider') == 'file':
+                path = self.registryValue('forex.file')
+                if not path:
+                    irc.error('No rates file is set, ask the admin to set '
+                              'supybot.plugins.Stocks.forex.file', Raise=True)
+                table = self.fx_file.snapshot(path)
+            else:
+                with self.fx_lock:
+                    table = self.fx_tables.lookup(
+                        base, self.registryValue('forex.ttl'))
+                    if table is None:
+                        table = fx.ExchangeRateAPI(
+                            self.http, EXCHANGERATE_URL).snapshot(base)
+                        self.fx_tables.add(table)
+        except (OSError, ValueError) as e:
+            irc.error("{base}: {message}".format(base=base, message=e), Raise=True)
+        if base not in table:
+            irc.error("{base}: Unknown currency.".format(base=base), Raise=True)
+        return table
+
+    def get_rates(self, irc, forex1, forexs):
+        # Returns (from, to, rate, note) for forex1 against each of forexs,
+        # rate being None for currencies the rates table doesn't know
+        forex1 = forex1.upper()
+        forexs = [forex.upper() for forex in forexs]
+        if self.registryValue('forex.provider') == 'alphavantage':
+            return [self.get_rate(irc, forex1, forex) for forex in forexs]
+
+        # A single snapshot prices every pair
+        table = self.get_table(irc, forex1)
+        return [(forex1, forex, rate, None)
+                for forex, rate in zip(forexs, table.cross(forex1, forexs))]
+
+    def get_rate(self, irc, forex1, forex2):
+        # Returns (from, to, rate, note) for a currency pair, note saying
+        # how a rate that didn't come straight from the API was obtained
+        forex1, forex2 = forex1.upper(), forex2.upper()
+
+        if self.registryValue('forex.provider') != 'alphavantage':
+            rate = self.get_rates(irc, forex1, [forex2])[0]
+            if rate[2] is None:
+                irc.error("{forex2}: Unknown currency.".format(forex2=forex2), Raise=True)
+            return rate
+
+        # Serve the pair, its inverse or a cross rate from fetched rates
+        # when possible, only new pairs cost an API call
+        rate = self.rate_store.lookup(forex1, forex2,
+                                      self.registryValue('forex.ttl'))
+        if rate:
+            price, age, source = rate
+            age = utils.timeElapsed(max(age, 1), short=True)
+            if source == 'cached':
+                note = 'cached {age} ago'.format(age=age)
+            elif source == 'inverse':
+                note = 'inverse rate, {age} old'.format(age=age)
+            else:
+                note = 'derived via {pivot}, {age} old'.format(pivot=source,
+                                                              age=age)
+            return (forex1, forex2, price, note)
 
         # Get data from API
-        data = self.get_forex(irc, session, forex1, forex2)
+        data = self.get_forex(irc, forex1, forex2)
 
         if not data:
             irc.error("{forex1},{forex2}: An error occurred.".format(forex1=forex1,forex2=forex2), Raise=True)
 
-        if 'Error Message' in data.keys():
-            irc.error("{forex1},{forex2}: {message}".format(forex1=forex1,forex2=forex2, message=data['Error Message']), Raise=True)
+        if 'Realtime Currency Exchange Rate' not in data.keys():
+            # Rate limited responses come back as a 'Note' or 'Information'
+            message = (data.get('Error Message') or data.get('Note') or
+                       data.get('Information') or 'An error occurred.')
+            irc.error("{forex1},{forex2}: {message}".format(forex1=forex1,forex2=forex2, message=message), Raise=True)
 
-        forex1_symbol = data['Realtime Currency Exchange Rate']['1. From_Currency Code']
-        forex1 = data['Realtime Currency Exchange Rate']['2. From_Currency Name']
-        forex2_symbol = data['Realtime Currency Exchange Rate']['3. To_Currency Code']
-        forex2 = data['Realtime Currency Exchange Rate']['4. To_Currency Name']
-        price = float(data['Realtime Currency Exchange Rate']['5. Exchange Rate'])
+        data = data['Realtime Currency Exchange Rate']
+        forex1_symbol = data['1. From_Currency Code']
+        forex2_symbol = data['3. To_Currency Code']
+        price = float(data['5. Exchange Rate'])
+        self.rate_store.add(forex1_symbol, forex2_symbol, price,
+                            data['2. From_Currency Name'],
+                            data['4. To_Currency Name'])
 
-        message = (
-            '{forex1_symbol}:{forex1} to {forex2_symbol}:{forex2} {price:g}'
-        )
+        return (forex1_symbol, forex2_symbol, price, None)
 
-        message = message.format(
-            forex1_symbol=ircutils.bold(forex1_symbol),
-            forex1=forex1,
-            forex2_symbol=ircutils.bold(forex2_symbol),
-            forex2=forex2,
-            price=price,
-        )
-
-        return message
+    def format_forex(self, renderer, forex1_symbol, forex2_symbol, price,
+                     note=None):
+        return renderer.forex(
+            forex1_symbol,
+            self.rate_store.names.get(forex1_symbol, forex1_symbol),
+            forex2_symbol,
+            self.rate_store.names.get(forex2_symbol, forex2_symbol),
+            price, note)
 
     @wrap([many('something')])
     def stock(self, irc, msg, args, symbols):
@@ -167,47 +848,80 @@ class Stocks(callbacks.Plugin):
         if count_symbols > max_symbols:
             irc.error("Too many symbols. Maximum count {}. Your count: {}".format(max_symbols, count_symbols), Raise=True)
 
-        messages = map(lambda symbol: self.get_stocks(irc, symbol), symbols)
+        renderer = self.renderer(msg.channel, irc.network)
+        messages = self.get_stocks(irc, symbols, renderer, resolve=True)
 
-        irc.replies(messages, joiner=' | ')
+        self.reply_items(irc, renderer, messages)
+
+    def history(self, irc, msg, args, symbol, period):
+        """<symbol> [<range>]
+
+        Returns a sparkline of daily closes and the return over <range>,
+        such as 5d, 2w, 3mo, 1y or ytd. Defaults to 1mo."""
+
+        symbol, error = self.resolve_symbol(symbol)
+        if error:
+            irc.error("{symbol}: {error}".format(symbol=symbol, error=error), Raise=True)
+        if not SYMBOL_RE.match(symbol):
+            irc.errorInvalid('symbol', symbol, Raise=True)
+
+        message = self.get_history(irc, symbol.upper(), period or '1mo')
+
+        irc.reply(message)
+
+    history = wrap(history, ['something', optional('something')])
 
     @wrap([many('something')])
     def crypto(self, irc, msg, args, cryptos):
         """<crypto> [<crypto> [<crypto> ...]]
 
-        Returns cryptocurrency data for single or multiple symbols to a configured fiat pair"""
+        Returns cryptocurrency data for single or multiple symbols in the
+        fiat currencies configured in supybot.plugins.Stocks.cryptofiat"""
 
         max_symbols = self.registryValue('maxsymbols')
         count_symbols = len(cryptos)
-        fiat = '-'+self.registryValue('cryptofiat')
+        fiats = self.crypto_fiats()
 
         if count_symbols > max_symbols:
             irc.error("Too many symbols. Maximum count {}. Your count: {}".format(max_symbols, count_symbols), Raise=True)
 
-        messages = map(lambda symbol: self.get_stocks(irc, symbol+fiat), cryptos)
+        if self.registryValue('crypto.provider') == 'yahoo':
+            renderer = self.renderer(msg.channel, irc.network)
+            messages = self.get_stocks(irc, ['{symbol}-{fiat}'.format(symbol=symbol, fiat=fiat)
+                                             for symbol in cryptos for fiat in fiats],
+                                       renderer)
+            self.reply_items(irc, renderer, messages)
+        else:
+            messages = self.get_cryptos(irc, cryptos, fiats)
+            irc.replies(messages, joiner=' | ')
 
-        irc.replies(messages, joiner=' | ')
+    @wrap(["somethingWithoutSpaces", many("somethingWithoutSpaces")])
+    def forex(self, irc, msg, args, symbol1, symbols):
+        """<symbol> <symbol> [<symbol> ...]
 
-    @wrap(["somethingWithoutSpaces", "somethingWithoutSpaces"])
-    def forex(self, irc, msg, args, symbol1, symbol2):
-        """<symbol> <symbol>
+        Returns the rate of the first currency in each of the others"""
 
-        Returns forex data for single symbol pair"""
+        max_symbols = self.registryValue('maxsymbols')
+        count_symbols = len(symbols)
 
-        with requests.Session() as session:
-            message = self.get_forexs(irc, session, symbol1, symbol2)
+        if count_symbols > max_symbols:
+            irc.error("Too many symbols. Maximum count {}. Your count: {}".format(max_symbols, count_symbols), Raise=True)
 
-        irc.reply(message)
+        renderer = self.renderer(msg.channel, irc.network)
+        messages = self.get_forexs(irc, symbol1, symbols, renderer)
+
+        self.reply_items(irc, renderer, messages)
 
     def sindex(self, irc, msg, args):
         """takes no arguments
 
         Returns indexes for us markets"""
 
-        symbols = ['^DJI', '^GSPC', '^IXIC', '^RUT']
-        messages = map(lambda symbol: self.get_stocks(irc, symbol), symbols)
+        renderer = self.renderer(msg.channel, irc.network)
+        self.watch(US_INDEXES)
+        messages = self.get_stocks(irc, US_INDEXES, renderer)
 
-        irc.replies(messages, joiner=' | ')
+        self.reply_items(irc, renderer, messages)
 
     sindex = wrap(sindex)
 
@@ -216,13 +930,293 @@ class Stocks(callbacks.Plugin):
 
         Returns indexes for world markets"""
 
-        symbols = ['^GDAXI', '^FCHI', '^FTSE', '^N225']
-        messages = map(lambda symbol: self.get_stocks(irc, symbol), symbols)
+        renderer = self.renderer(msg.channel, irc.network)
+        self.watch(WORLD_INDEXES)
+        messages = self.get_stocks(irc, WORLD_INDEXES, renderer)
 
-        irc.replies(messages, joiner=' | ')
+        self.reply_items(irc, renderer, messages)
 
     findex = wrap(findex)
 
+    def watchlist(self, irc, msg, args, channel):
+        """[<channel>]
+
+        Returns quotes for the channel's watchlist, configured in
+        supybot.plugins.Stocks.watchlist"""
+
+        symbols = self.registryValue('watchlist', channel, irc.network)
+        if not symbols:
+            irc.error("No watchlist is set for {channel}.".format(channel=channel), Raise=True)
+
+        renderer = self.renderer(channel, irc.network)
+        self.watch(symbols)
+        messages = self.get_stocks(irc, symbols, renderer)
+
+        self.reply_items(irc, renderer, messages)
+
+    watchlist = wrap(watchlist, ['channel'])
+
+    def cachestats(self, irc, msg, args):
+        """takes no arguments
+
+        Returns quote cache statistics"""
+
+        stats = self.quote_cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / lookups * 100 if lookups else 0.0
+
+        irc.reply("Quote cache: {size}/{maxsize} entries, {hits} hits, "
+                  "{misses} misses ({hit_rate:.1f}% hit rate), {evictions} "
+                  "evictions, {inflight} in flight".format(hit_rate=hit_rate,
+                                                          **stats))
+
+    cachestats = wrap(cachestats)
+
+    def portfolio(self, irc, msg, args, nick):
+        """[<nick>]
+
+        Returns the value, profit or loss and day change of the portfolio of
+        <nick>, or yours, with its largest positions. Holdings are managed
+        with the holding command."""
+
+        messages = self.get_portfolio(irc, nick or msg.nick)
+
+        irc.replies(messages, joiner=' | ')
+
+    portfolio = wrap(portfolio, [optional('nick')])
+
+    class holding(callbacks.Commands):
+        def add(self, irc, msg, args, symbol, quantity, cost):
+            """<symbol> <quantity> <cost>
+
+            Adds <quantity> units of <symbol> bought at <cost> per unit, in
+            the currency <symbol> is quoted in, to your portfolio"""
+            plugin = irc.getCallback('Stocks')
+            symbol, error = plugin.resolve_symbol(symbol)
+            if error or not SYMBOL_RE.match(symbol):
+                irc.error("{symbol}: {error}".format(symbol=symbol, error=error or 'Invalid symbol.'), Raise=True)
+            if quantity <= 0:
+                irc.errorInvalid('quantity', quantity, Raise=True)
+            if cost < 0:
+                irc.errorInvalid('cost', cost, Raise=True)
+
+            holding = plugin.portfolios.add(irc.network,
+                                            ircutils.toLower(msg.nick),
+                                            symbol, quantity, cost)
+            irc.reply("You hold {quantity:g} {symbol} at {cost:g}.".format(
+                quantity=holding.quantity, symbol=holding.symbol,
+                cost=round(holding.cost, 4)))
+
+        add = wrap(add, ['something', 'float', 'float'])
+
+        def remove(self, irc, msg, args, symbol, quantity):
+            """<symbol> [<quantity>]
+
+            Removes <quantity> units of <symbol> from your portfolio, all of
+            them if <quantity> isn't given"""
+            plugin = irc.getCallback('Stocks')
+            symbol = plugin.resolve_symbol(symbol)[0]
+            if quantity is not None and quantity <= 0:
+                irc.errorInvalid('quantity', quantity, Raise=True)
+            left = plugin.portfolios.remove(irc.network,
+                                            ircutils.toLower(msg.nick),
+                                            symbol, quantity)
+            if left is None:
+                irc.error("You don't hold {symbol}.".format(symbol=symbol.upper()), Raise=True)
+
+            irc.reply("You hold {left:g} {symbol}.".format(
+                left=left, symbol=symbol.upper()))
+
+        remove = wrap(remove, ['something', optional('float')])
+
+    class alert(callbacks.Commands):
+        def add(self, irc, msg, args, channel, symbol, operator, threshold):
+            """[<channel>] <symbol> {> | <} <price>[%]
+
+            Notifies <channel> when <symbol> goes above or below <price>,
+            or moves up or down by <price> percent from its current price.
+            Alerts fire once. Only users in <channel> and channel
+            operators can add alerts to it."""
+            plugin = irc.getCallback('Stocks')
+            state = irc.state.channels.get(channel)
+            capability = ircdb.makeChannelCapability(channel, 'op')
+            if (state is None or msg.nick not in state.users) and \
+                    not ircdb.checkCapability(msg.prefix, capability):
+                irc.errorNoCapability(capability, Raise=True)
+            match = THRESHOLD_RE.match(threshold)
+            if not match:
+                irc.errorInvalid('price', threshold, Raise=True)
+            symbol, error = plugin.resolve_symbol(symbol)
+            if error or not SYMBOL_RE.match(symbol):
+                irc.error("{symbol}: {error}".format(symbol=symbol, error=error or 'Invalid symbol.'), Raise=True)
+            symbol = symbol.upper()
+
+            maximum = plugin.registryValue('alerts.max', channel, irc.network)
+            if len(plugin.alert_store.channel(irc.network, channel)) >= maximum:
+                irc.error("{channel} already has {maximum} alerts.".format(channel=channel, maximum=maximum), Raise=True)
+
+            above = operator == '>'
+            value, reference = float(match.group(1)), None
+            if match.group(2):
+                quote = plugin.get_quotes([symbol]).get(symbol)
+                reference = quote and quote.price
+                if not reference:
+                    irc.error("{symbol}: No data found.".format(symbol=symbol), Raise=True)
+                if not above and value >= 100:
+                    irc.errorInvalid('percent', threshold, Raise=True)
+                value = reference * (1 + value / 100 if above else
+                                     1 - value / 100)
+
+            alert = plugin.alert_store.add(irc.network, channel, msg.nick,
+                                           symbol, above, value, reference,
+                                           owner=msg.prefix)
+            plugin.start_polling()
+            irc.reply("Alert #{id} added: {alert}.".format(
+                id=alert.id, alert=plugin.format_alert(alert)))
+
+        add = wrap(add, ['channel', 'something', ('literal', ('>', '<')),
+                         'something'])
+
+        def remove(self, irc, msg, args, channel, id):
+            """[<channel>] <id>
+
+            Removes an alert of <channel>. Only whoever added it and channel
+            operators can remove it."""
+            plugin = irc.getCallback('Stocks')
+            alert = plugin.alert_store.get(id)
+            if alert is None or alert.network != irc.network or \
+                    not ircutils.strEqual(alert.channel, channel):
+                irc.error("No alert #{id} in {channel}.".format(id=id, channel=channel), Raise=True)
+            capability = ircdb.makeChannelCapability(channel, 'op')
+            if not same_user(alert.owner, msg.prefix) and \
+                    not ircdb.checkCapability(msg.prefix, capability):
+                irc.errorNoCapability(capability, Raise=True)
+
+            plugin.alert_store.remove(id)
+            irc.replySuccess()
+
+        remove = wrap(remove, ['channel', 'positiveInt'])
+
+        def list(self, irc, msg, args, channel):
+            """[<channel>]
+
+            Returns the pending alerts of <channel>"""
+            plugin = irc.getCallback('Stocks')
+            pending = plugin.alert_store.channel(irc.network, channel)
+            if not pending:
+                irc.reply("No alerts are set for {channel}.".format(channel=channel))
+                return
+
+            irc.replies(["#{id}: {alert}".format(
+                             id=alert.id, alert=plugin.format_alert(alert))
+                         for alert in pending], joiner=' | ')
+
+        list = wrap(list, ['channel'])
+
+    def historystats(self, irc, msg, args):
+        """takes no arguments
+
+        Returns price history cache statistics"""
+
+        stats = self.history_cache.stats()
+        irc.reply("History cache: {symbols}/{maxsize} symbols, {bars} bars, "
+                  "{hits} hits, {fetches} range fetches".format(**stats))
+
+    historystats = wrap(historystats)
+
+    def providerstats(self, irc, msg, args):
+        """takes no arguments
+
+        Returns the latency, error rate and circuit breaker state of every
+        quote provider, in the order they are tried"""
+
+        messages = []
+        for name, state, latency, error_rate, requests in sorted(
+                self.router.report(),
+                key=lambda item: item[2] if item[2] is not None else float('inf')):
+            if latency is None:
+                messages.append("{name}: {state}, no answers, {requests} "
+                                "requests".format(name=name, state=state,
+                                                  requests=requests))
+                continue
+            messages.append("{name}: {state}, {latency:.0f}ms, {errors:.0f}% "
+                            "errors, {requests} requests".format(
+                                name=name, state=state,
+                                latency=latency * 1000,
+                                errors=error_rate * 100, requests=requests))
+
+        irc.replies(messages, joiner=' | ')
+
+    providerstats = wrap(providerstats)
+
+    def workerstats(self, irc, msg, args):
+        """takes no arguments
+
+        Returns worker pool queue depth and wait times"""
+        if self.workers is None:
+            irc.error('The worker pool is disabled, commands run in their own '
+                      'threads.', Raise=True)
+
+        stats = self.workers.stats()
+        irc.reply("Worker pool: {busy}/{threads} busy, {queued}/{maxqueued} "
+                  "queued from {keys} channels, {completed} done, {rejected} "
+                  "rejected, waited {avg:.0f}ms avg, {p95:.0f}ms p95, "
+                  "{max:.0f}ms max".format(avg=stats['wait_avg'] * 1000,
+                                           p95=stats['wait_p95'] * 1000,
+                                           max=stats['wait_max'] * 1000,
+                                           **stats))
+
+    workerstats = wrap(workerstats, ['admin'])
+
+    def metrics(self, irc, msg, args, name):
+        """[<name>]
+
+        Returns the command, upstream request and cache metrics whose name
+        contains <name>, also served at /metrics when
+        plugins.Stocks.metrics.port is set"""
+
+        lines = self.metric_registry.summary(name or '')
+        if not lines:
+            irc.error('No such metric.', Raise=True)
+
+        irc.replies(lines, joiner=' | ')
+
+    metrics = wrap(metrics, ['admin', optional('something')])
+
+    def lookup(self, irc, msg, args, name):
+        """<name>
+
+        Returns the symbols whose company name or alias starts with <name>,
+        from the local symbol index"""
+        try:
+            matches = self.symbol_index.search(name)
+        except (OSError, csv.Error) as e:
+            irc.error("Couldn't load the symbol index: {error}".format(error=e), Raise=True)
+        if not matches:
+            irc.error("No symbol found for {name}.".format(name=name), Raise=True)
+
+        irc.replies(["{ticker}: {name} ({exchange})".format(
+                        ticker=ircutils.bold(symbol.ticker), name=symbol.name,
+                        exchange=symbol.exchange)
+                     for symbol in matches], joiner=' | ')
+
+    lookup = wrap(lookup, ['text'])
+
+    def reloadsymbols(self, irc, msg, args):
+        """takes no arguments
+
+        Reloads the symbol index from supybot.plugins.Stocks.symbols.file,
+        or the file bundled with the plugin"""
+        path = self.registryValue('symbols.file') or symbols.BUNDLED_FILE
+        try:
+            count = self.symbol_index.reload(path)
+        except (OSError, csv.Error) as e:
+            irc.error("Couldn't load {path}: {error}".format(path=path, error=e), Raise=True)
+
+        irc.reply("Loaded {count} symbols from {path}.".format(count=count, path=path))
+
+    reloadsymbols = wrap(reloadsymbols, ['admin'])
+
 Class = Stocks
 
 
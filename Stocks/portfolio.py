@@ -0,0 +1,150 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import sqlite3
+import threading
+
+
+class Holding(object):
+    __slots__ = ('symbol', 'quantity', 'cost')
+
+    def __init__(self, symbol, quantity, cost):
+        self.symbol = symbol
+        self.quantity = quantity
+        # Average price paid per unit, in the symbol's quote currency
+        self.cost = cost
+
+
+class PortfolioStore(object):
+    """Holdings of every nick, kept in SQLite when a path is given"""
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ':memory:',
+                                   check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS holdings ('
+                         'network TEXT NOT NULL, nick TEXT NOT NULL, '
+                         'symbol TEXT NOT NULL, quantity REAL NOT NULL, '
+                         'cost REAL NOT NULL, '
+                         'PRIMARY KEY (network, nick, symbol))')
+        self._db.commit()
+
+    def holdings(self, network, nick):
+        """Returns the holdings of nick sorted by symbol"""
+        with self._lock:
+            return [Holding(*row) for row in self._db.execute(
+                'SELECT symbol, quantity, cost FROM holdings WHERE network = '
+                '? AND nick = ? ORDER BY symbol', (network, nick))]
+
+    def add(self, network, nick, symbol, quantity, cost):
+        """Adds quantity units bought at cost to a holding, averaging the
+        cost with what's already held, and returns the holding"""
+        symbol = symbol.upper()
+        with self._lock:
+            row = self._db.execute('SELECT quantity, cost FROM holdings '
+                                   'WHERE network = ? AND nick = ? AND '
+                                   'symbol = ?',
+                                   (network, nick, symbol)).fetchone()
+            if row is not None:
+                held, paid = row
+                cost = (held * paid + quantity * cost) / (held + quantity)
+                quantity += held
+            self._db.execute('INSERT OR REPLACE INTO holdings VALUES (?, ?, '
+                             '?, ?, ?)', (network, nick, symbol, quantity,
+                                          cost))
+            self._db.commit()
+            return Holding(symbol, quantity, cost)
+
+    def remove(self, network, nick, symbol, quantity=None):
+        """Sells quantity units of a holding, all of them if quantity is
+        None.  Returns the units left, or None if nothing was held."""
+        if quantity is not None and quantity <= 0:
+            raise ValueError('quantity must be positive')
+        symbol = symbol.upper()
+        with self._lock:
+            row = self._db.execute('SELECT quantity FROM holdings WHERE '
+                                   'network = ? AND nick = ? AND symbol = ?',
+                                   (network, nick, symbol)).fetchone()
+            if row is None:
+                return None
+            left = 0 if quantity is None else max(row[0] - quantity, 0)
+            if left:
+                self._db.execute('UPDATE holdings SET quantity = ? WHERE '
+                                 'network = ? AND nick = ? AND symbol = ?',
+                                 (left, network, nick, symbol))
+            else:
+                self._db.execute('DELETE FROM holdings WHERE network = ? AND '
+                                 'nick = ? AND symbol = ?',
+                                 (network, nick, symbol))
+            self._db.commit()
+            return left
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def valuate(quantities, costs, prices, previous, rates):
+    """Values positions given as parallel sequences, prices and costs in
+    each position's currency and rates converting that currency to the
+    portfolio's.  Returns a dict of per-position arrays (value, pl,
+    pl_percent, weight, day) and portfolio totals (total_value, total_cost,
+    total_pl, total_pl_percent, total_day, total_day_percent)."""
+    # Imported here so loading the plugin doesn't pay for NumPy
+    import numpy
+
+    quantities = numpy.asarray(quantities, dtype=float)
+    rates = numpy.asarray(rates, dtype=float)
+    prices = numpy.asarray(prices, dtype=float)
+    units = quantities * rates
+    value = units * prices
+    cost = units * numpy.asarray(costs, dtype=float)
+    day = units * (prices - numpy.asarray(previous, dtype=float))
+
+    total_value = value.sum()
+    total_cost = cost.sum()
+    total_day = day.sum()
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        pl_percent = numpy.where(cost != 0, (value - cost) / cost * 100, 0.0)
+        weight = value / total_value * 100 if total_value else \
+            numpy.zeros_like(value)
+    start = total_value - total_day
+    return {
+        'value': value,
+        'pl': value - cost,
+        'pl_percent': pl_percent,
+        'weight': weight,
+        'day': day,
+        'total_value': total_value,
+        'total_cost': total_cost,
+        'total_pl': total_value - total_cost,
+        'total_pl_percent': ((total_value - total_cost) / total_cost * 100
+                             if total_cost else 0.0),
+        'total_day': total_day,
+        'total_day_percent': total_day / start * 100 if start else 0.0,
+    }
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
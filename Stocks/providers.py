@@ -0,0 +1,318 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import json
+import re
+import threading
+import time
+from datetime import date
+
+
+# What yahooquery answers instead of a dict when none of the symbols exist
+NO_DATA_RE = re.compile(r'no data found|not found', re.IGNORECASE)
+
+
+class ProviderError(Exception):
+    pass
+
+
+class Quote(object):
+    """The fields of a quote the plugin uses, parsed once per fetch so the
+    cache doesn't keep the dozens of others Yahoo sends.
+
+    price is the extended hours price when the market is in pre or post
+    market and there is one, the regular market price otherwise."""
+    __slots__ = ('quote_type', 'market_state', 'currency', 'name', 'price',
+                 'previous_close', 'day_high', 'day_low')
+
+    def __init__(self, quote_type=None, market_state=None, currency=None,
+                 name=None, price=None, previous_close=None, day_high=None,
+                 day_low=None):
+        self.quote_type = quote_type
+        self.market_state = market_state
+        self.currency = currency
+        self.name = name
+        self.price = price
+        self.previous_close = previous_close
+        self.day_high = day_high
+        self.day_low = day_low
+
+    def __repr__(self):
+        return 'Quote({fields})'.format(fields=', '.join(
+            '{name}={value!r}'.format(name=name, value=getattr(self, name))
+            for name in self.__slots__))
+
+    @classmethod
+    def from_yahoo(cls, data):
+        """Parses a quote dict with Yahoo's field names"""
+        get = data.get
+        market_state = get('marketState')
+        price = None
+        if get('quoteType') != 'INDEX':
+            if market_state == 'POST':
+                price = get('postMarketPrice')
+            elif market_state == 'PRE':
+                price = get('preMarketPrice')
+        # Pre/post market prices are missing for symbols without extended
+        # hours trading
+        if price is None:
+            price = get('regularMarketPrice')
+        return cls(get('quoteType'), market_state, get('currency'),
+                   get('shortName'), price, get('regularMarketPreviousClose'),
+                   get('regularMarketDayHigh'), get('regularMarketDayLow'))
+
+
+class Provider(object):
+    name = None
+
+    def quotes(self, symbols):
+        """Returns {SYMBOL: Quote} for the symbols the provider has data
+        for, raises ProviderError or any other exception when the request
+        fails.  Unknown symbols aren't a failure, they are left out."""
+        raise NotImplementedError
+
+
+class YahooProvider(Provider):
+    """Quotes from yahooquery, every symbol in one request"""
+    name = 'yahoo'
+
+    def __init__(self, ticker):
+        # ticker(symbols) returns a yahooquery.Ticker
+        self.ticker = ticker
+
+    def quotes(self, symbols):
+        quotes = self.ticker(symbols).quotes
+        if isinstance(quotes, str) and NO_DATA_RE.search(quotes):
+            # Every symbol is unknown, which says nothing about Yahoo's
+            # health and mustn't open its breaker
+            return {}
+        if not isinstance(quotes, dict):
+            raise ProviderError(quotes or 'An error occurred.')
+        return dict((symbol.upper(), Quote.from_yahoo(quote))
+                    for symbol, quote in quotes.items()
+                    if isinstance(quote, dict))
+
+
+class AlphaVantageProvider(Provider):
+    """Quotes from Alpha Vantage's GLOBAL_QUOTE, one request per symbol.
+
+    url and api_key are functions, so configuration changes apply without
+    a reload."""
+    name = 'alphavantage'
+
+    def __init__(self, http, url, api_key):
+        self.http = http
+        self.url = url
+        self.api_key = api_key
+
+    def query(self, params):
+        api_key = self.api_key()
+        if not api_key:
+            raise ProviderError('Missing Alpha Vantage API key')
+        params = dict(params, apikey=api_key)
+        return self.http.get(self.url(), params=params).json()
+
+    def quotes(self, symbols):
+        quotes = {}
+        today = date.today().isoformat()
+        for symbol in symbols:
+            data = self.query({'function': 'GLOBAL_QUOTE', 'symbol': symbol})
+            if 'Global Quote' not in data:
+                # Rate limited responses come back as a 'Note' or
+                # 'Information' and are worth failing over
+                raise ProviderError(data.get('Note') or
+                                    data.get('Information') or
+                                    data.get('Error Message') or
+                                    'An error occurred.')
+            quote = data['Global Quote']
+            if not quote.get('05. price'):
+                continue
+            quotes[symbol.upper()] = Quote(
+                quote_type='EQUITY',
+                market_state=('REGULAR' if quote.get('07. latest trading '
+                                                     'day') == today
+                              else 'CLOSED'),
+                name=quote.get('01. symbol', symbol),
+                price=float(quote['05. price']),
+                previous_close=float(quote.get('08. previous close') or 0),
+                day_high=float(quote.get('03. high') or 0),
+                day_low=float(quote.get('04. low') or 0))
+        return quotes
+
+    def exchange_rate(self, symbol1, symbol2):
+        return self.query({
+            'function': 'CURRENCY_EXCHANGE_RATE',
+            'from_currency': symbol1,
+            'to_currency': symbol2,
+        })
+
+
+class FixtureProvider(Provider):
+    """Quotes read from a JSON file of {symbol: quote} with Yahoo's field
+    names, for tests and running offline"""
+    name = 'fixture'
+
+    def __init__(self, path):
+        self.path = path
+
+    def quotes(self, symbols):
+        with open(self.path(), encoding='utf-8') as fd:
+            fixture = dict((symbol.upper(), quote)
+                           for symbol, quote in json.load(fd).items())
+        return dict((symbol.upper(),
+                     Quote.from_yahoo(fixture[symbol.upper()]))
+                    for symbol in symbols if symbol.upper() in fixture)
+
+
+class ProviderStats(object):
+    """Moving averages of a provider's latency and error rate, and a
+    circuit breaker.
+
+    The breaker opens after `failures` consecutive failures and the
+    provider is skipped until `cooldown` seconds later, when a single trial
+    request is let through: its success closes the breaker, its failure
+    opens it again."""
+
+    # Weight of the latest request in the moving averages
+    ALPHA = 0.2
+
+    def __init__(self, failures, cooldown):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive = 0
+        self.opened = None
+        self.trial = False
+
+    def state(self, now):
+        if self.opened is None:
+            return 'closed'
+        if self.trial or now - self.opened < self.cooldown:
+            return 'open'
+        return 'half-open'
+
+    def score(self):
+        # Providers that never answered come after those that did, failing
+        # ones are ranked as if they were slower
+        if self.latency is None:
+            return float('inf')
+        return self.latency * (1 + 10 * self.error_rate)
+
+    def record(self, latency, ok):
+        self.requests += 1
+        # Only answers are timed, a provider failing fast isn't fast
+        if ok and self.latency is None:
+            self.latency = latency
+        elif ok:
+            self.latency += self.ALPHA * (latency - self.latency)
+        self.error_rate += self.ALPHA * ((0.0 if ok else 1.0) -
+                                         self.error_rate)
+        self.trial = False
+        if ok:
+            self.consecutive = 0
+            self.opened = None
+            return
+        self.errors += 1
+        self.consecutive += 1
+        if self.opened is not None or self.consecutive >= self.failures:
+            self.opened = time.monotonic()
+
+
+class Router(object):
+    """Sends quote requests to the best provider and fails over to the
+    next one when it errors.
+
+    Providers are tried by the latency of their answers weighted by their
+    error rate, in the given order until they have answered.  Providers
+    whose breaker is open are skipped without a request.  Every request is
+    also timed into metrics when a metrics.Registry is given."""
+
+    def __init__(self, providers, failures=3, cooldown=30, metrics=None):
+        self.providers = list(providers)
+        self.metrics = metrics
+        self.stats = dict((provider.name, ProviderStats(failures, cooldown))
+                          for provider in self.providers)
+        self._lock = threading.Lock()
+
+    def _ranked(self):
+        now = time.monotonic()
+        with self._lock:
+            ranked = [(self.stats[provider.name].score(), i, provider)
+                      for i, provider in enumerate(self.providers)
+                      if self.stats[provider.name].state(now) != 'open']
+        ranked.sort(key=lambda item: item[:2])
+        return [provider for score, i, provider in ranked]
+
+    def _claim(self, provider):
+        # Returns whether provider may be sent a request now, letting a
+        # single request through to a recovering provider
+        stats = self.stats[provider.name]
+        with self._lock:
+            state = stats.state(time.monotonic())
+            if state == 'half-open':
+                stats.trial = True
+            return state != 'open'
+
+    def _record(self, provider, latency, ok):
+        with self._lock:
+            self.stats[provider.name].record(latency, ok)
+        if self.metrics is not None:
+            self.metrics.observe('provider_seconds', latency,
+                                 provider=provider.name)
+            self.metrics.inc('provider_total', provider=provider.name,
+                             outcome='ok' if ok else 'error')
+
+    def quotes(self, symbols):
+        errors = []
+        for provider in self._ranked():
+            if not self._claim(provider):
+                continue
+            started = time.monotonic()
+            try:
+                quotes = provider.quotes(symbols)
+            except Exception as e:
+                self._record(provider, time.monotonic() - started, False)
+                errors.append('{name}: {error}'.format(name=provider.name,
+                                                       error=e))
+                continue
+            self._record(provider, time.monotonic() - started, True)
+            return quotes
+        raise ProviderError('; '.join(errors) or 'No quote provider is '
+                            'available.')
+
+    def report(self):
+        """Returns (name, state, latency, error rate, requests) for every
+        provider"""
+        now = time.monotonic()
+        with self._lock:
+            return [(provider.name, self.stats[provider.name].state(now),
+                     self.stats[provider.name].latency,
+                     self.stats[provider.name].error_rate,
+                     self.stats[provider.name].requests)
+                    for provider in self.providers]
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,179 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import functools
+import json
+
+from supybot import ircutils
+
+# The quotes endpoint only returns ISO currency codes
+CURRENCY_SYMBOLS = {
+    'USD': '$',
+    'CAD': 'CA$',
+    'AUD': 'A$',
+    'EUR': '\u20ac',
+    'GBP': '\u00a3',
+    'JPY': '\u00a5',
+    'CNY': 'CN\u00a5',
+    'INR': '\u20b9',
+    'KRW': '\u20a9',
+}
+
+MARKET_STATES = {
+    'REGULAR': 'Open',
+    'POST': 'Post-market',
+    'PRE': 'Pre-market',
+}
+
+LAYOUTS = ('full', 'compact', 'json')
+
+
+class Renderer(object):
+    """Renders quotes and exchange rates in one layout: full, compact, or
+    json for other bots.
+
+    The templates of a layout are built once with their bold and colors
+    already applied, so rendering an item is a single str.format and
+    rendering a reply is joining items into lines."""
+
+    def __init__(self, layout):
+        self.layout = layout
+        if layout == 'json':
+            self.prefix, self.joiner, self.suffix = '[', ',', ']'
+            return
+        self.prefix, self.joiner, self.suffix = '', ' | ', ''
+
+        symbol = ircutils.bold('{symbol}')
+        if layout == 'compact':
+            head = symbol + ' {currency}{price:g} '
+            up = ircutils.mircColor('\u25b2{percent:g}%', 'green')
+            down = ircutils.mircColor('\u25bc{percent:g}%', 'red')
+            tail = state = ''
+            self.forex_template = (ircutils.bold('{base}') + '/' +
+                                   ircutils.bold('{quote}') + ' {rate:g}')
+        else:
+            head = symbol + ' : {name} {currency}{price:g} '
+            up = ircutils.mircColor('\u25b2 {change:g} ({percent:g}%)',
+                                    'green')
+            down = ircutils.mircColor('\u25bc {change:g} ({percent:g}%)',
+                                      'red')
+            tail = ' High: {day_high} Low: {day_low}'
+            state = ' {market_state}'
+            self.forex_template = (ircutils.bold('{base}') + ':{base_name} '
+                                   'to ' + ircutils.bold('{quote}') +
+                                   ':{quote_name} {rate:g}')
+        # Keyed by (rising, showing the market state), indexes have none
+        self.templates = {
+            (True, True): head + up + tail + state,
+            (True, False): head + up + tail,
+            (False, True): head + down + tail + state,
+            (False, False): head + down + tail,
+        }
+
+    def error(self, symbol, message):
+        if self.layout == 'json':
+            return json.dumps({'symbol': symbol, 'error': message},
+                              separators=(',', ':'))
+        return '{symbol}: {message}'.format(symbol=symbol, message=message)
+
+    def quote(self, symbol, quote):
+        """Renders a providers.Quote, or an error when it has no price"""
+        price = quote.price
+        close = quote.previous_close
+        if price is None or not close:
+            return self.error(symbol, 'An error occurred.')
+
+        change = round(price - close, 2)
+        percent = round(change / close * 100, 2)
+        index = quote.quote_type == 'INDEX'
+        market_state = 'Open' if index else \
+            MARKET_STATES.get(quote.market_state, quote.market_state)
+
+        if self.layout == 'json':
+            return json.dumps({
+                'symbol': symbol,
+                'name': quote.name,
+                'currency': quote.currency,
+                'price': price,
+                'change': change,
+                'percent': percent,
+                'high': quote.day_high,
+                'low': quote.day_low,
+                'state': market_state,
+            }, separators=(',', ':'))
+
+        currency = quote.currency or ''
+        return self.templates[(change >= 0.0, not index)].format(
+            symbol=symbol,
+            name=quote.name,
+            currency=CURRENCY_SYMBOLS.get(currency,
+                                          currency and currency + ' '),
+            price=price,
+            change=change,
+            percent=percent,
+            day_high=quote.day_high,
+            day_low=quote.day_low,
+            market_state=market_state,
+        )
+
+    def forex(self, base, base_name, quote, quote_name, rate, note=None):
+        """Renders an exchange rate, note saying how it was obtained"""
+        if self.layout == 'json':
+            return json.dumps({'base': base, 'quote': quote, 'rate': rate,
+                               'note': note}, separators=(',', ':'))
+        message = self.forex_template.format(base=base, base_name=base_name,
+                                             quote=quote,
+                                             quote_name=quote_name, rate=rate)
+        if note:
+            message += ' ({note})'.format(note=note)
+        return message
+
+    def lines(self, items, length):
+        """Joins rendered items into lines of at most length bytes, breaking
+        only between items.  An item longer than that gets a line of its
+        own."""
+        lines = []
+        line = []
+        size = 0
+        extra = len(self.prefix) + len(self.suffix)
+        for item in items:
+            width = len(item.encode('utf-8'))
+            if line and extra + size + len(self.joiner) + width > length:
+                lines.append(self.prefix + self.joiner.join(line) +
+                             self.suffix)
+                line = []
+                size = 0
+            size += width + (len(self.joiner) if line else 0)
+            line.append(item)
+        if line:
+            lines.append(self.prefix + self.joiner.join(line) + self.suffix)
+        return lines
+
+
+@functools.lru_cache(maxsize=None)
+def renderer(layout):
+    """Returns the shared Renderer of a layout"""
+    return Renderer(layout)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -3,4 +3,5 @@ from supybot.setup import plugin_setup
 
 plugin_setup(
    'Stocks',
+   package_data={'': ['symbols.csv']},
 )
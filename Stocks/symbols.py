@@ -0,0 +1,189 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import bisect
+import csv
+import os
+import re
+import threading
+
+BUNDLED_FILE = os.path.join(os.path.dirname(__file__), 'symbols.csv')
+
+# Trailing words dropped from company names to get the name people type
+NAME_SUFFIXES = frozenset([
+    'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'ltd',
+    'limited', 'plc', 'holdings', 'holding', 'group', 'sa', 'ag', 'nv', 'se',
+    'the', 'class', 'a', 'b', 'c', 'adr',
+])
+
+# Shorter queries are left alone by typo matching, they are mostly tickers
+# that aren't indexed rather than misspelt names
+MIN_FUZZY_LENGTH = 5
+
+
+def normalize(name):
+    """Lowercases name and drops everything but letters and digits"""
+    return re.sub(r'[\W_]+', '', name.lower())
+
+
+def name_key(name):
+    # 'Apple Inc.' -> 'apple', 'The Coca-Cola Company' -> 'cocacola'
+    words = re.findall(r'\w+', name.lower())
+    while len(words) > 1 and words[-1] in NAME_SUFFIXES:
+        words.pop()
+    if len(words) > 1 and words[0] == 'the':
+        words.pop(0)
+    return normalize(''.join(words))
+
+
+def deletes(key):
+    """Returns the strings one deletion away from key"""
+    return set(key[:i] + key[i + 1:] for i in range(len(key)))
+
+
+class Symbol(object):
+    __slots__ = ('ticker', 'name', 'exchange', 'aliases', 'rank')
+
+    def __init__(self, ticker, name, exchange, aliases, rank):
+        self.ticker = ticker
+        self.name = name
+        self.exchange = exchange
+        self.aliases = aliases
+        self.rank = rank
+
+
+class SymbolIndex(object):
+    """Lazily loaded index of known symbols, their names and aliases.
+
+    Keys are normalized names kept in a sorted list for prefix searches.
+    Typos are matched through a map of every key with one character deleted,
+    so a lookup only generates the deletions of the query instead of
+    comparing it with every key.  Rows earlier in the file win ties, list
+    the most traded symbols first."""
+
+    def __init__(self, path=None):
+        self.path = path or BUNDLED_FILE
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._tickers = {}
+        self._keys = {}
+        self._sorted = []
+        self._deletes = {}
+
+    def __len__(self):
+        self._load()
+        return len(self._tickers)
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._build(self.path)
+
+    def reload(self, path=None):
+        """Reads the symbols file again, returns the number of symbols"""
+        with self._lock:
+            if path:
+                self.path = path
+            self._build(self.path)
+        return len(self._tickers)
+
+    def _build(self, path):
+        tickers = {}
+        keys = {}
+        with open(path, newline='', encoding='utf-8') as fd:
+            for row in csv.reader(fd):
+                if not row or row[0].startswith('#'):
+                    continue
+                ticker, name, exchange, aliases = (row + [''] * 4)[:4]
+                ticker = ticker.strip().upper()
+                if not ticker or ticker in tickers:
+                    continue
+                aliases = [alias.strip() for alias in aliases.split('|')
+                           if alias.strip()]
+                symbol = Symbol(ticker, name.strip(), exchange.strip(),
+                                aliases, len(tickers))
+                tickers[ticker] = symbol
+                for key in [name_key(symbol.name)] + [normalize(alias)
+                                                      for alias in aliases]:
+                    if key and key not in keys:
+                        keys[key] = symbol
+
+        deleted = {}
+        for key, symbol in keys.items():
+            if len(key) < MIN_FUZZY_LENGTH:
+                continue
+            for variant in deletes(key) | {key}:
+                deleted.setdefault(variant, symbol)
+
+        # Swap everything in at once so lookups never see a partial index
+        self._tickers = tickers
+        self._keys = keys
+        self._sorted = sorted(keys)
+        self._deletes = deleted
+        self._loaded = True
+
+    def get(self, ticker):
+        """Returns the Symbol for ticker, or None if it isn't indexed"""
+        self._load()
+        return self._tickers.get(ticker.upper())
+
+    def resolve(self, query, fuzzy=True):
+        """Returns the Symbol for a ticker, company name or alias, allowing
+        one typo when fuzzy is set, or None"""
+        self._load()
+        symbol = self._tickers.get(query.upper())
+        if symbol is not None:
+            return symbol
+        key = normalize(query)
+        symbol = self._keys.get(key)
+        if symbol is not None or not fuzzy or len(key) < MIN_FUZZY_LENGTH:
+            return symbol
+        # A deletion, insertion, substitution or swap of adjacent characters
+        # leaves query and key sharing a variant with at most one deletion
+        matches = [self._deletes[variant] for variant in deletes(key) | {key}
+                   if variant in self._deletes]
+        if not matches:
+            return None
+        return min(matches, key=lambda symbol: symbol.rank)
+
+    def search(self, prefix, limit=10):
+        """Returns up to limit Symbols whose name or an alias starts with
+        prefix"""
+        self._load()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        symbols = []
+        start = bisect.bisect_left(self._sorted, prefix)
+        for key in self._sorted[start:]:
+            if not key.startswith(prefix) or len(symbols) >= limit:
+                break
+            symbol = self._keys[key]
+            if symbol not in symbols:
+                symbols.append(symbol)
+        return symbols
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -21,11 +21,882 @@
 #
 ###
 
+import json
+import os
+import sqlite3
+import tracemalloc
+import unittest
+import urllib.request
+from datetime import date, datetime, timedelta
+
+import pandas
+
 from supybot.test import *
 
+from . import (alerts, bench, cache, fx, history, httpclient, metrics,
+               plugin, providers, render, workers)
+
+
+QUOTES = {
+    'AAPL': {
+        'quoteType': 'EQUITY', 'marketState': 'REGULAR', 'currency': 'USD',
+        'shortName': 'Apple Inc.', 'regularMarketPrice': 190.0,
+        'regularMarketPreviousClose': 180.0, 'regularMarketDayHigh': 191.0,
+        'regularMarketDayLow': 179.5,
+    },
+    'MSFT': {
+        'quoteType': 'EQUITY', 'marketState': 'CLOSED', 'currency': 'USD',
+        'shortName': 'Microsoft Corporation', 'regularMarketPrice': 400.0,
+        'regularMarketPreviousClose': 410.0, 'regularMarketDayHigh': 411.0,
+        'regularMarketDayLow': 399.0,
+    },
+    'SAP': {
+        'quoteType': 'EQUITY', 'marketState': 'REGULAR', 'currency': 'EUR',
+        'shortName': 'SAP SE', 'regularMarketPrice': 120.0,
+        'regularMarketPreviousClose': 110.0, 'regularMarketDayHigh': 121.0,
+        'regularMarketDayLow': 109.0,
+    },
+    '^GSPC': {
+        'quoteType': 'INDEX', 'marketState': 'REGULAR', 'currency': 'USD',
+        'shortName': 'S&P 500', 'regularMarketPrice': 5000.0,
+        'regularMarketPreviousClose': 4950.0, 'regularMarketDayHigh': 5010.0,
+        'regularMarketDayLow': 4940.0,
+    },
+}
+
+
+RATES = {('USD', 'EUR'): 0.5, ('USD', 'GBP'): 0.25}
+
+
+def fake_forex(irc, symbol1, symbol2):
+    """Stands in for Stocks.get_forex with an Alpha Vantage shaped reply"""
+    fake_forex.requests.append((symbol1, symbol2))
+    return {'Realtime Currency Exchange Rate': {
+        '1. From_Currency Code': symbol1,
+        '2. From_Currency Name': symbol1 + ' Name',
+        '3. To_Currency Code': symbol2,
+        '4. To_Currency Name': symbol2 + ' Name',
+        '5. Exchange Rate': str(RATES[(symbol1, symbol2)]),
+    }}
+
+
+def exchangerate(requests):
+    """Routes of a fake ExchangeRate-API answering USD rates"""
+    def latest(method, query, body):
+        requests.append('USD')
+        return bench.json_response({'result': 'success', 'base_code': 'USD',
+                                    'rates': {'USD': 1, 'EUR': 0.5,
+                                              'GBP': 0.25, 'JPY': 150}})
+
+    return {'/USD': latest}
+
+
+COINS = [
+    {'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'},
+    {'id': 'ethereum', 'symbol': 'eth', 'name': 'Ethereum'},
+    {'id': 'bitcoin-token', 'symbol': 'btc', 'name': 'Bitcoin Token'},
+]
+
+
+def coingecko(requests):
+    """Routes of a fake CoinGecko API recording the requests made"""
+    def markets(method, query, body):
+        requests.append('markets')
+        return bench.json_response(COINS)
+
+    def price(method, query, body):
+        requests.append((query['ids'][0], query['vs_currencies'][0]))
+        prices = {}
+        for id in query['ids'][0].split(','):
+            prices[id] = {}
+            for fiat in query['vs_currencies'][0].split(','):
+                prices[id][fiat] = 60000.0 if fiat == 'eur' else 65000.0
+                prices[id][fiat + '_24h_change'] = -1.5 if fiat == 'eur' else 1.5
+        return bench.json_response(prices)
+
+    return {'/coins/markets': markets, '/simple/price': price}
+
+
+class FakeTicker:
+    """Stands in for yahooquery.Ticker, recording every request made"""
+    requests = []
+    history_requests = []
+    # Day of the session still open, if any
+    live = None
+
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+
+    @property
+    def quotes(self):
+        FakeTicker.requests.append(self.symbols)
+        return {symbol: dict(QUOTES[symbol]) for symbol in self.symbols
+                if symbol in QUOTES}
+
+    def history(self, start, end, interval):
+        # A weekday bar closing at the day of the month, like yahooquery
+        # indexed by (symbol, date) with an exclusive end, the bar of an
+        # open session by the time of its last trade
+        FakeTicker.history_requests.append((start, end))
+        rows = []
+        day = start
+        while day < end:
+            if day.weekday() < 5:
+                index = day
+                if day == FakeTicker.live:
+                    index = datetime(day.year, day.month, day.day, 15, 30)
+                rows.append((self.symbols[0], index, day.day, day.day + 1,
+                             day.day - 1, float(day.day), 1000))
+            day += timedelta(days=1)
+        if not rows:
+            # yahooquery 2.4 answers ranges without trading days, unknown
+            # symbols and failed requests alike with an empty frame
+            return pandas.DataFrame(columns=['high', 'low', 'volume', 'open',
+                                             'close'])
+        return pandas.DataFrame(rows, columns=[
+            'symbol', 'date', 'open', 'high', 'low', 'close', 'volume',
+        ]).set_index(['symbol', 'date'])
+
+
+class BrokenTicker(FakeTicker):
+    """FakeTicker failing the way yahooquery does when rate limited"""
+    @property
+    def quotes(self):
+        FakeTicker.requests.append(self.symbols)
+        return 'Too Many Requests'
+
+    def history(self, start, end, interval):
+        FakeTicker.history_requests.append((start, end))
+        return pandas.DataFrame(columns=['high', 'low', 'volume', 'open',
+                                         'close'])
+
+
+class OfflineTicker(FakeTicker):
+    """FakeTicker whose requests can't reach Yahoo"""
+    def history(self, start, end, interval):
+        FakeTicker.history_requests.append((start, end))
+        raise ConnectionError('Connection refused')
+
+
+class FixedDate(date):
+    """date whose today() is a Wednesday"""
+    @classmethod
+    def today(cls):
+        return cls(2024, 6, 5)
+
+
+class UnknownTicker(FakeTicker):
+    """FakeTicker answering like yahooquery when no symbol exists"""
+    @property
+    def quotes(self):
+        FakeTicker.requests.append(self.symbols)
+        return 'No data found'
+
 
 class StocksTestCase(PluginTestCase):
     plugins = ('Stocks',)
 
+    def setUp(self):
+        super().setUp()
+        self._ticker = plugin.Ticker
+        plugin.Ticker = FakeTicker
+        FakeTicker.requests = []
+        FakeTicker.history_requests = []
+        FakeTicker.live = None
+
+    def tearDown(self):
+        plugin.Ticker = self._ticker
+        plugin.date = date
+        super().tearDown()
+
+    def testStockBatchesSymbols(self):
+        self.assertRegexp('stock aapl MSFT', 'aapl.*Apple Inc.*MSFT')
+        self.assertEqual(FakeTicker.requests, [['AAPL', 'MSFT']])
+
+    def testStockErrorsInline(self):
+        self.assertRegexp('stock AAPL NOPE b@d',
+                          'Apple Inc.*NOPE: No data found.*b@d: Invalid')
+        self.assertEqual(FakeTicker.requests, [['AAPL', 'NOPE']])
+
+    def testStockLayouts(self):
+        with conf.supybot.plugins.Stocks.format.layout.context('compact'):
+            self.assertRegexp('stock AAPL MSFT',
+                              r'AAPL.? \$190 .*5\.56%.* \| .*MSFT.? \$400 ')
+        with conf.supybot.plugins.Stocks.format.layout.context('json'):
+            m = self.getMsg('stock AAPL NOPE')
+            self.assertEqual(json.loads(m.args[1]), [
+                {'symbol': 'AAPL', 'name': 'Apple Inc.', 'currency': 'USD',
+                 'price': 190.0, 'change': 10.0, 'percent': 5.56,
+                 'high': 191.0, 'low': 179.5, 'state': 'Open'},
+                {'symbol': 'NOPE', 'error': 'No data found.'}])
+
+    def testStockRepliesBreakBetweenQuotes(self):
+        with conf.supybot.plugins.Stocks.format.length.context(100):
+            self.assertRegexp('stock AAPL MSFT ^GSPC', r'Apple Inc.* Open$')
+            self.assertRegexp(' ', r'^[^|]*Microsoft Corporation.* CLOSED$')
+            self.assertRegexp(' ', r'S&P 500.* Low: 4940\.0$')
+
+    def testStockResolvesNames(self):
+        self.assertRegexp('stock apple Microsfot', 'AAPL.*Apple Inc.*MSFT')
+        self.assertEqual(FakeTicker.requests, [['AAPL', 'MSFT']])
+        with conf.supybot.plugins.Stocks.symbols.strict.context(True):
+            self.assertRegexp('stock AAPL NOPE', 'NOPE: Unknown symbol')
+        self.assertEqual(FakeTicker.requests, [['AAPL', 'MSFT']])
+        # Tickers are passed through, even when they are an alias or one
+        # typo away from another symbol
+        self.assertNotError('stock DOW CSCO3 dow')
+        self.assertEqual(FakeTicker.requests[-1], ['DOW', 'CSCO3', '^DJI'])
+
+    def testLookup(self):
+        self.assertRegexp('lookup micro', 'MSFT.*Microsoft Corporation')
+        self.assertError('lookup zzzz')
+
+    def testHistoryCache(self):
+        today = date.today()
+        self.assertRegexp('history AAPL 5d', r'AAPL.? 5d: [\u2581-\u2588]+ ')
+        self.assertRegexp('history apple 3d', 'AAPL.? 3d')
+        self.assertEqual(FakeTicker.history_requests,
+                         [(today - timedelta(days=5), today + timedelta(days=1))])
+        self.assertRegexp('history AAPL 2w', r'AAPL.? 2w: .* High: \d+')
+        self.assertEqual(FakeTicker.history_requests[1:],
+                         [(today - timedelta(days=14), today - timedelta(days=5))])
+        self.assertRegexp('historystats', '1/64 symbols.* 1 hits, 2 range')
+        self.assertError('history AAPL 3x')
+
+    def testHistoryErrorsAreNotCached(self):
+        plugin.Ticker = BrokenTicker
+        self.assertRegexp('history AAPL 5d', 'AAPL: No data found')
+        plugin.Ticker = FakeTicker
+        self.assertRegexp('history AAPL 5d', r'AAPL.? 5d: [\u2581-\u2588]+ ')
+        self.assertEqual(len(FakeTicker.history_requests), 2)
+
+    def testHistoryServesCacheWhenNewestDayFails(self):
+        plugin.date = FixedDate
+        wednesday = FixedDate.today()
+        FakeTicker.live = wednesday
+        with conf.supybot.plugins.Stocks.history.ttl.context(0):
+            self.assertRegexp('history AAPL 5d', r'5d: .* to 5 .*\(4 days\)$')
+            plugin.Ticker = OfflineTicker
+            self.assertRegexp('history AAPL 5d', r'5d: .* to 5 .*\(4 days\) '
+                              r'\(no data from 2024-06-05 on\)$')
+        self.assertEqual(FakeTicker.history_requests[-1],
+                         (wednesday, wednesday + timedelta(days=1)))
+        # Older days failing leaves nothing worth showing
+        self.assertRegexp('history AAPL 2w', 'AAPL: Connection refused')
+
+    def testHistoryWeekendsAreNotFetched(self):
+        saturday = date(2024, 6, 1)
+        requests = []
+
+        def fetcher(symbol, start, end):
+            requests.append((start, end))
+            return [], None
+
+        cache_ = history.HistoryCache(4)
+        bars = cache_.bars('AAPL', saturday, saturday + timedelta(days=1),
+                           fetcher, 60, date(2024, 6, 10))
+        self.assertEqual(list(bars['close']), [])
+        self.assertEqual(requests, [])
+        # Weekdays without bars are asked for again
+        cache_.bars('AAPL', saturday - timedelta(days=1), saturday, fetcher,
+                    60, date(2024, 6, 10))
+        cache_.bars('AAPL', saturday - timedelta(days=1), saturday, fetcher,
+                    60, date(2024, 6, 10))
+        self.assertEqual(requests, [(saturday - timedelta(days=1),) * 2] * 2)
+
+    def testHistoryRefetchesLiveBarAfterClose(self):
+        monday = date(2024, 6, 3).toordinal()
+        tuesday = monday + 1
+        requests = []
+
+        def fetcher(symbol, start, end):
+            requests.append((start.toordinal(), end.toordinal()))
+            if end.toordinal() == monday:
+                # Fetched mid-session
+                return [(monday, 99.0, 101.0, 98.0, 100.0, 10)], monday
+            return [(monday, 99.0, 106.0, 98.0, 105.0, 20),
+                    (tuesday, 105.0, 107.0, 104.0, 106.0, 5)], tuesday
+
+        cache_ = history.HistoryCache(4)
+        day = date.fromordinal
+        bars = cache_.bars('AAPL', day(monday), day(monday), fetcher, 60,
+                           day(monday))
+        self.assertEqual(list(bars['close']), [100.0])
+        cache_.bars('AAPL', day(monday), day(monday), fetcher, 60,
+                    day(monday))
+        self.assertEqual(requests, [(monday, monday)])
+        # The next day the intraday close is replaced by the final one
+        bars = cache_.bars('AAPL', day(monday), day(tuesday), fetcher, 60,
+                           day(tuesday))
+        self.assertEqual(list(bars['close']), [105.0, 106.0])
+        self.assertEqual(requests, [(monday, monday), (monday, tuesday)])
+        cache_.bars('AAPL', day(monday), day(tuesday), fetcher, 60,
+                    day(tuesday))
+        self.assertEqual(len(requests), 2)
+
+    def testSparkline(self):
+        self.assertEqual(history.sparkline([1, 2, 3, 4, 5, 6, 7, 8], 8),
+                         '\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588')
+        self.assertEqual(history.sparkline(list(range(100)), 10)[-1], '\u2588')
+        self.assertEqual(history.sparkline([5, 5], 10), '\u2581\u2581')
+
+    def testPortfolio(self):
+        self.assertResponse('holding add AAPL 10 100', 'You hold 10 AAPL at 100.')
+        self.assertResponse('holding add apple 10 200', 'You hold 20 AAPL at 150.')
+        self.assertNotError('holding add SAP 5 100')
+        # SAP is quoted in EUR, valued through the inverse of USD/EUR
+        self.irc.getCallback('Stocks').rate_store.add('USD', 'EUR', 0.5)
+        self.assertRegexp('portfolio', r'\$5,000\.00 P/L .*1,000\.00 '
+                          r'\(25\.00%\).* Day .*300\.00 \(6\.38%\).*'
+                          r'AAPL.* 20 76\.0%.*SAP.* 5 24\.0%')
+        self.assertEqual(FakeTicker.requests, [['AAPL', 'SAP']])
+        self.assertResponse('holding remove AAPL 5', 'You hold 15 AAPL.')
+        self.assertError('holding remove AAPL -5')
+        self.assertError('holding remove AAPL 0')
+        self.assertResponse('holding remove AAPL 5', 'You hold 10 AAPL.')
+        self.assertError('holding remove MSFT')
+        self.assertError('portfolio somebody')
+
+    def testCryptoSingleRequest(self):
+        requests = []
+        server = bench.FakeServer(coingecko(requests))
+        url = plugin.COINGECKO_URL
+        plugin.COINGECKO_URL = server.url
+        try:
+            with conf.supybot.plugins.Stocks.cryptofiat.context('usd eur'):
+                self.assertRegexp('crypto btc Ethereum nope',
+                                  r'BTC.* : Bitcoin \$65000 .*1\.5%.* / '
+                                  r'\u20ac60000 .*-1\.5%.*ETH.* : Ethereum.*'
+                                  r'nope: Unknown coin')
+                self.assertRegexp('crypto eth', 'Ethereum')
+        finally:
+            plugin.COINGECKO_URL = url
+            server.close()
+        self.assertEqual(requests, ['markets', ('bitcoin,ethereum', 'usd,eur')])
+        self.assertEqual(FakeTicker.requests, [])
+
+    def testProviderFailover(self):
+        path = os.path.join(conf.supybot.directories.data(), 'quotes.json')
+        with open(path, 'w') as fd:
+            json.dump({'aapl': QUOTES['AAPL']}, fd)
+        plugin.Ticker = BrokenTicker
+        cb = self.irc.getCallback('Stocks')
+        with conf.supybot.plugins.Stocks.providers.order.context(
+                ['yahoo', 'fixture']), \
+                conf.supybot.plugins.Stocks.providers.fixture.context(path), \
+                conf.supybot.plugins.Stocks.cache.ttl.regular.context(0):
+            cb.router = cb.build_router()
+            for i in range(4):
+                self.assertRegexp('stock AAPL', 'Apple Inc')
+        # Once the fixture answered it's preferred over failing Yahoo
+        self.assertEqual(len(FakeTicker.requests), 1)
+        self.assertRegexp('providerstats', 'fixture: closed, .* 4 requests.*'
+                          'yahoo: closed, no answers, 1 requests')
+
+    def testUnknownSymbolsKeepBreakerClosed(self):
+        plugin.Ticker = UnknownTicker
+        for i in range(4):
+            self.assertRegexp('stock ZZZZZ', 'ZZZZZ: No data found')
+        self.assertEqual(len(FakeTicker.requests), 4)
+        plugin.Ticker = FakeTicker
+        self.assertRegexp('providerstats', 'yahoo: closed, .* 0% errors, 4 '
+                          'requests')
+        self.assertRegexp('stock AAPL', 'Apple Inc')
+
+    def testStockCache(self):
+        self.assertRegexp('stock AAPL', 'Apple Inc')
+        self.assertRegexp('stock AAPL MSFT', 'Apple Inc.*Microsoft')
+        self.assertEqual(FakeTicker.requests, [['AAPL'], ['MSFT']])
+        self.assertRegexp('cachestats', '2/512 entries, 1 hits, 2 misses')
+
+    def testMetrics(self):
+        self.assertError('metrics nosuchmetric')
+        self.assertRegexp('stock AAPL', 'Apple Inc')
+        self.assertRegexp('stock AAPL', 'Apple Inc')
+        self.assertRegexp('metrics command_seconds',
+                          r'command_seconds\{command=stock\}: 2, avg ')
+        self.assertRegexp('metrics cache', r'cache_hits_total\{cache=quote\}: '
+                          r'1 .*cache_misses_total\{cache=quote\}: 1')
+        self.assertRegexp('metrics provider_total',
+                          r'\{outcome=ok,provider=yahoo\}: 1$')
+
+    def testPrefetchWatchlist(self):
+        cb = self.irc.getCallback('Stocks')
+        with conf.supybot.plugins.Stocks.watchlist.context(['AAPL', '^GSPC']):
+            self.assertRegexp('watchlist #test', 'Apple Inc.*S&P 500')
+        self.assertTrue(cb.prefetching)
+        cb.prefetch()
+        self.assertEqual(FakeTicker.requests, [['AAPL', '^GSPC'],
+                                               ['AAPL', '^GSPC']])
+        self.assertRegexp('watchlist #test', 'No watchlist is set')
+        with conf.supybot.plugins.Stocks.prefetch.idle.context(1):
+            cb.watched['AAPL'] -= 2
+            cb.prefetch()
+            self.assertEqual(sorted(cb.watched), ['^GSPC'])
+            cb.watched['^GSPC'] -= 2
+            cb.prefetch()
+        self.assertFalse(cb.prefetching)
+        self.assertEqual(len(FakeTicker.requests), 3)
+        self.assertRegexp('stock ^GSPC AAPL', 'S&P 500.*Apple Inc')
+        self.assertEqual(len(FakeTicker.requests), 3)
+
+    def testForexRateStore(self):
+        fake_forex.requests = []
+        self.irc.getCallback('Stocks').get_forex = fake_forex
+        self.assertRegexp('forex usd eur', r'USD Name to .*EUR Name 0\.5$')
+        self.assertRegexp('forex EUR USD', r' 2 \(inverse rate, 1')
+        self.assertRegexp('forex USD GBP', r'GBP Name 0\.25$')
+        self.assertRegexp('forex EUR GBP', r' 0\.5 \(derived via USD')
+        self.assertRegexp('forex USD EUR', r' 0\.5 \(cached')
+        self.assertRegexp('forex USD EUR GBP',
+                          r' 0\.5 \(cached.* \| .* 0\.25 \(cached')
+        self.assertEqual(fake_forex.requests, [('USD', 'EUR'), ('USD', 'GBP')])
+
+    def testForexTable(self):
+        requests = []
+        server = bench.FakeServer(exchangerate(requests))
+        url = plugin.EXCHANGERATE_URL
+        plugin.EXCHANGERATE_URL = server.url
+        try:
+            with conf.supybot.plugins.Stocks.forex.provider.context(
+                    'exchangerate'):
+                self.assertRegexp('forex usd eur GBP jpy xyz',
+                                  r'USD.*:USD to .*EUR.*:EUR 0\.5 \| .*GBP.*'
+                                  r':GBP 0\.25 \| .*JPY 150 \| XYZ: Unknown')
+                # Crossed from the USD snapshot, without another request
+                self.assertRegexp('forex EUR USD GBP', r'USD 2 \| .*GBP 0\.5$')
+                self.assertRegexp('forex GBP JPY', r'JPY 600$')
+                self.assertError('forex XYZ USD')
+        finally:
+            plugin.EXCHANGERATE_URL = url
+            server.close()
+        self.assertEqual(requests, ['USD'])
+
+    def testForexFile(self):
+        path = os.path.join(conf.supybot.directories.data(), 'rates.json')
+        with open(path, 'w') as fd:
+            json.dump({'base': 'EUR', 'rates': {'USD': 2, 'GBP': 0.5}}, fd)
+        with conf.supybot.plugins.Stocks.forex.provider.context('file'):
+            self.assertError('forex USD EUR')
+            with conf.supybot.plugins.Stocks.forex.file.context(path):
+                self.assertRegexp('forex USD EUR GBP', r'EUR 0\.5 \| .*GBP '
+                                  r'0\.25$')
+
+    def testRateTable(self):
+        table = fx.RateTable('usd', {'EUR': 0.5, 'GBP': 0.25, 'XXX': 0})
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.cross('GBP', ['USD', 'eur', 'GBP', 'XXX']),
+                         [4.0, 2.0, 1.0, None])
+        self.assertRaises(ValueError, fx.parse_snapshot,
+                          {'result': 'error', 'error-type': 'unsupported-code'})
+
+    def testCacheSharesInflightFetch(self):
+        quote_cache = cache.QuoteCache(8)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def fetcher(symbols):
+            calls.append(symbols)
+            started.set()
+            release.wait(5)
+            return {symbol: QUOTES[symbol] for symbol in symbols}
+
+        def fetch():
+            results.append(quote_cache.fetch(['aapl'], fetcher, lambda q: 0))
+
+        first = threading.Thread(target=fetch)
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=fetch)
+        second.start()
+        while quote_cache.misses < 2:
+            time.sleep(0.001)
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(calls, [['AAPL']])
+        self.assertEqual(results, [{'AAPL': QUOTES['AAPL']}] * 2)
+
+
+class AlertsTestCase(ChannelPluginTestCase):
+    plugins = ('Stocks',)
+
+    def setUp(self):
+        super().setUp()
+        self._ticker = plugin.Ticker
+        plugin.Ticker = FakeTicker
+        FakeTicker.requests = []
+
+    def tearDown(self):
+        plugin.Ticker = self._ticker
+        super().tearDown()
+
+    def testAlertsPollInBatches(self):
+        cb = self.irc.getCallback('Stocks')
+        self.assertRegexp('alert add AAPL > 185', 'Alert #1 added: .*AAPL.* '
+                          'goes above 185')
+        self.assertRegexp('alert add microsoft < 5%', r'Alert #2 .*MSFT.* '
+                          r'falls 5% from 400')
+        self.assertRegexp('alert add AAPL < 100', 'Alert #3')
+        self.assertError('alert add AAPL > x')
+        self.assertRegexp('alert list', '#1: .*#2: .*#3: ')
+        self.assertTrue(cb.polling)
+        FakeTicker.requests = []
+
+        cb.poll_alerts()
+        self.assertEqual(FakeTicker.requests, [['AAPL', 'MSFT']])
+        m = self.irc.takeMsg()
+        self.assertEqual(m.args[0], self.channel)
+        self.assertIn('AAPL', m.args[1])
+        self.assertIn('is above 185, now 190 (alert #1)', m.args[1])
+        self.assertIsNone(self.irc.takeMsg())
+
+        self.assertNotError('alert remove 2')
+        self.assertError('alert remove 2')
+        self.assertNotRegexp('alert list', '#1|#2')
+        self.assertEqual(cb.alert_store.symbols(), ['AAPL'])
+
+    def testAlertChannelsIgnoreCase(self):
+        self.assertRegexp('alert add AAPL > 185', 'Alert #1')
+        channel = self.channel.upper()
+        self.assertRegexp('alert list %s' % channel, '#1: ')
+        self.assertNotError('alert remove %s 1' % channel)
+        self.assertRegexp('alert list', 'No alerts')
+
+    def testAlertPermissions(self):
+        # Hosts without __no_testcap__ get every capability in tests
+        stranger = 'stranger!s@__no_testcap__'
+        self.assertRegexp('alert add AAPL > 185', 'op capability',
+                          frm=stranger)
+        self.assertRegexp('alert add %s AAPL > 185' % self.channel,
+                          'op capability', frm=stranger, private=True)
+        self.assertRegexp('alert list', 'No alerts')
+
+        self.assertRegexp('alert add AAPL > 185', 'Alert #1 added')
+        # Same nick, another hostmask
+        nick = ircutils.nickFromHostmask(self.prefix)
+        self.assertRegexp('alert remove 1', 'op capability',
+                          frm='%s!evil@__no_testcap__' % nick)
+        self.assertNotError('alert remove 1')
+
+    def testAlertOwnerColumnMigration(self):
+        path = conf.supybot.directories.data.dirize('Stocks.alerts-old.db')
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE alerts (id INTEGER PRIMARY KEY, '
+                   'network TEXT NOT NULL, channel TEXT NOT NULL, '
+                   'nick TEXT NOT NULL, symbol TEXT NOT NULL, '
+                   'above INTEGER NOT NULL, threshold REAL NOT NULL, '
+                   'reference REAL, created REAL NOT NULL)')
+        db.execute("INSERT INTO alerts VALUES (1, 'net', '#c', 'nick', "
+                   "'AAPL', 1, 185, NULL, 0)")
+        db.commit()
+        db.close()
+        store = alerts.AlertStore(path)
+        self.assertIsNone(store.get(1).owner)
+        store.add('net', '#c', 'nick', 'MSFT', True, 400, owner='n!u@h')
+        self.assertEqual(alerts.AlertStore(path).get(2).owner, 'n!u@h')
+
+    def testThresholdIndex(self):
+        index = alerts.ThresholdIndex()
+        for id, (above, threshold) in enumerate([(True, 10), (True, 20),
+                                                 (False, 5), (False, 15)]):
+            index.add(alerts.Alert(id, 'net', '#c', 'nick', 'X', above,
+                                   threshold))
+        self.assertEqual(index.crossed(12), [0, 3])
+        self.assertEqual(index.crossed(20), [0, 1])
+        self.assertEqual(index.crossed(5), [2, 3])
+        index.remove(alerts.Alert(3, 'net', '#c', 'nick', 'X', False, 15))
+        self.assertEqual(index.crossed(12), [0])
+        self.assertEqual(len(index), 3)
+
+
+# Client libraries the plugin should only import once a command needs them
+CLIENT_MODULES = ('yahooquery', 'pandas', 'numpy', 'requests', 'urllib3')
+
+
+class StartupTestCase(SupyTestCase):
+    def testLoadSkipsClientLibraries(self):
+        modules = bench.load_plugin('Stocks')['modules']
+        self.assertEqual([module for module in CLIENT_MODULES
+                          if module in modules], [])
+
+
+class QuoteTestCase(SupyTestCase):
+    def testExtendedHoursPrice(self):
+        quote = providers.Quote.from_yahoo(dict(
+            QUOTES['AAPL'], marketState='POST', postMarketPrice=192.5))
+        self.assertEqual(quote.price, 192.5)
+        self.assertEqual(quote.previous_close, 180.0)
+        self.assertEqual(quote.name, 'Apple Inc.')
+        # Symbols without extended hours trading keep the regular price
+        quote = providers.Quote.from_yahoo(dict(QUOTES['AAPL'],
+                                                marketState='PRE'))
+        self.assertEqual(quote.price, 190.0)
+        quote = providers.Quote.from_yahoo(dict(
+            QUOTES['^GSPC'], marketState='POST', postMarketPrice=5100.0))
+        self.assertEqual(quote.price, 5000.0)
+
+
+class RetryTestCase(SupyTestCase):
+    def testRetriesAreBounded(self):
+        from urllib3.response import HTTPResponse
+        retry = httpclient.jitter_retry()(
+            total=2, status_forcelist=(429, 500, 502, 503, 504))
+        self.assertTrue(retry.is_retry('GET', 503))
+        # The server may have created the paste before failing
+        self.assertFalse(retry.is_retry('POST', 503))
+        response = HTTPResponse(status=429, headers={'Retry-After': '3600'})
+        self.assertEqual(retry.get_retry_after(response),
+                         httpclient.MAX_RETRY_AFTER)
+
+
+class RouterTestCase(SupyTestCase):
+    def testBreakerLetsOneTrialThrough(self):
+        class Flaky(providers.Provider):
+            name = 'flaky'
+            failing = True
+            calls = 0
+
+            def quotes(self, symbols):
+                Flaky.calls += 1
+                if Flaky.failing:
+                    raise providers.ProviderError('down')
+                return {'AAPL': QUOTES['AAPL']}
+
+        router = providers.Router([Flaky()], failures=2, cooldown=0.05)
+        for i in range(3):
+            self.assertRaises(providers.ProviderError, router.quotes,
+                              ['AAPL'])
+        self.assertEqual(Flaky.calls, 2)
+        self.assertEqual(router.report()[0][1], 'open')
+        time.sleep(0.06)
+        self.assertEqual(router.report()[0][1], 'half-open')
+        Flaky.failing = False
+        self.assertEqual(router.quotes(['AAPL']), {'AAPL': QUOTES['AAPL']})
+        self.assertEqual(Flaky.calls, 3)
+        self.assertEqual(router.report()[0][1], 'closed')
+
+
+class MetricsTestCase(SupyTestCase):
+    def testRender(self):
+        registry = metrics.Registry('stocks', buckets=(0.1, 1.0))
+        registry.inc('command_total', command='stock', outcome='ok')
+        for value in (0.05, 0.5, 0.5, 5.0):
+            registry.observe('command_seconds', value, command='stock')
+        registry.collect(lambda: [('gauge', 'cache_entries',
+                                   {'cache': 'quote'}, 3)])
+        self.assertEqual(registry.render().splitlines(), [
+            '# TYPE stocks_cache_entries gauge',
+            'stocks_cache_entries{cache="quote"} 3',
+            '# TYPE stocks_command_seconds histogram',
+            'stocks_command_seconds_bucket{command="stock",le="0.1"} 1',
+            'stocks_command_seconds_bucket{command="stock",le="1.0"} 3',
+            'stocks_command_seconds_bucket{command="stock",le="+Inf"} 4',
+            'stocks_command_seconds_sum{command="stock"} 6.05',
+            'stocks_command_seconds_count{command="stock"} 4',
+            '# TYPE stocks_command_total counter',
+            'stocks_command_total{command="stock",outcome="ok"} 1',
+        ])
+
+    def testTimedCountsErrors(self):
+        registry = metrics.Registry('stocks')
+        with registry.timed('upstream', host='example.com'):
+            pass
+        with self.assertRaises(ValueError):
+            with registry.timed('upstream', host='example.com'):
+                raise ValueError
+        self.assertEqual(registry.summary('upstream_total'), [
+            'upstream_total{host=example.com,outcome=error}: 1',
+            'upstream_total{host=example.com,outcome=ok}: 1'])
+
+    def testExporter(self):
+        registry = metrics.Registry('stocks')
+        registry.inc('command_total', command='stock', outcome='ok')
+        exporter = metrics.Exporter(registry, '127.0.0.1', 0)
+        try:
+            url = 'http://127.0.0.1:{port}/metrics'.format(port=exporter.port)
+            with urllib.request.urlopen(url, timeout=5) as response:
+                body = response.read().decode('utf-8')
+        finally:
+            exporter.close()
+        self.assertIn('stocks_command_total{command="stock",outcome="ok"} 1',
+                      body)
+
+
+class WorkerPoolTestCase(SupyTestCase):
+    def testRoundRobinAcrossChannels(self):
+        pool = workers.WorkerPool('Stocks', 1, 5)
+        release = threading.Event()
+        done = threading.Event()
+        order = []
+        try:
+            self.assertTrue(pool.submit('#a', release.wait, 5))
+            while pool.busy == 0:
+                time.sleep(0.001)
+            for job in ('a1', 'a2', 'a3'):
+                self.assertTrue(pool.submit('#a', order.append, job))
+            self.assertTrue(pool.submit('#b', order.append, 'b1'))
+            self.assertTrue(pool.submit('#b', done.set))
+            # The queue holds 5 jobs
+            self.assertFalse(pool.submit('#c', order.append, 'c1'))
+            release.set()
+            done.wait(5)
+            self.assertEqual(order, ['a1', 'b1', 'a2', 'a3'])
+            stats = pool.stats()
+            self.assertEqual(stats['rejected'], 1)
+            self.assertEqual(stats['queued'], 0)
+        finally:
+            release.set()
+            pool.stop()
+
+
+class StocksWorkersTestCase(PluginTestCase):
+    plugins = ('Stocks',)
+
+    def setUp(self):
+        # The pool is set up when the plugin loads
+        conf.supybot.plugins.Stocks.workers.enable.setValue(True)
+        super().setUp()
+        self._ticker = plugin.Ticker
+        plugin.Ticker = FakeTicker
+
+    def tearDown(self):
+        plugin.Ticker = self._ticker
+        super().tearDown()
+        conf.supybot.plugins.Stocks.workers.enable.setValue(False)
+
+    def testCommandsRunOnPool(self):
+        self.assertRegexp('stock AAPL', 'Apple Inc')
+        self.assertRegexp('workerstats', r'1/4 busy, 0/32 queued.* 1 done')
+
+
+class SlowTicker(FakeTicker):
+    """FakeTicker answering after a Yahoo-like delay.  yahooquery's URLs are
+    fixed, so Yahoo is stood in for in process rather than over HTTP."""
+    latency = 0.05
+
+    @property
+    def quotes(self):
+        time.sleep(self.latency)
+        return FakeTicker.quotes.fget(self)
+
+
+def alphavantage(method, query, body):
+    symbol1 = query['from_currency'][0]
+    symbol2 = query['to_currency'][0]
+    return bench.json_response({'Realtime Currency Exchange Rate': {
+        '1. From_Currency Code': symbol1,
+        '2. From_Currency Name': symbol1 + ' Name',
+        '3. To_Currency Code': symbol2,
+        '4. To_Currency Name': symbol2 + ' Name',
+        '5. Exchange Rate': '1.25',
+    }})
+
+
+@unittest.skipUnless(bench.OUTPUT, 'set SUPYBOT_BENCH to run benchmarks')
+class StocksBenchmark(PluginTestCase):
+    plugins = ('Stocks',)
+    config = {'supybot.plugins.Stocks.alphavantage.api.key': 'demo'}
+
+    def setUp(self):
+        super().setUp()
+        self._ticker = plugin.Ticker
+        self._alphavantage = plugin.ALPHAVANTAGE_URL
+        plugin.Ticker = SlowTicker
+        self.alphavantage = bench.FakeServer({'/query': alphavantage},
+                                             latency=0.05)
+        plugin.ALPHAVANTAGE_URL = self.alphavantage.url + '/query'
+
+    def tearDown(self):
+        plugin.Ticker = self._ticker
+        plugin.ALPHAVANTAGE_URL = self._alphavantage
+        self.alphavantage.close()
+        super().tearDown()
+
+    def run_benchmark(self, name, commands, channels=8, requests=400):
+        results = bench.run_load(self.irc, self.prefix, commands, channels,
+                                 requests)
+        bench.report('Stocks', name, channels, *results)
+
+    def testBenchStartup(self):
+        bench.report_startup('Stocks', CLIENT_MODULES)
+
+    def testBenchQuoteCache(self):
+        # Yahoo answers some 80 fields per quote, parse them into a full
+        # cache as the provider does
+        data = dict(QUOTES['AAPL'], **dict(('field%s' % i, float(i))
+                                           for i in range(72)))
+        count = 5000
+        quote_cache = cache.QuoteCache(count)
+        latencies = []
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        for i in range(count):
+            fetched = time.perf_counter()
+            quote = providers.Quote.from_yahoo(dict(data))
+            quote_cache.set('S%s' % i, quote, 3600)
+            latencies.append(time.perf_counter() - fetched)
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        bench.report('Stocks', 'quote_cache', 1, latencies, elapsed,
+                     current - baseline, peak - baseline, quotes=count)
+
+    def testBenchRender(self):
+        # A full reply of maxsymbols quotes, rendered and packed into lines
+        quotes = [('S%s' % i, providers.Quote.from_yahoo(QUOTES[symbol]))
+                  for i, symbol in enumerate(sorted(QUOTES) * 3)][:10]
+        for layout in render.LAYOUTS:
+            renderer = render.renderer(layout)
+            latencies = []
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            for i in range(2000):
+                rendered = time.perf_counter()
+                renderer.lines([renderer.quote(symbol, quote)
+                                for symbol, quote in quotes], 400)
+                latencies.append(time.perf_counter() - rendered)
+            elapsed = time.perf_counter() - started
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            bench.report('Stocks', 'render_' + layout, 1, latencies, elapsed,
+                         current - baseline, peak - baseline,
+                         quotes=len(quotes))
+
+    def testBenchStockCached(self):
+        self.run_benchmark('stock_cached', ['stock AAPL MSFT', 'stock ^GSPC'])
+
+    def testBenchStockUncached(self):
+        with conf.supybot.plugins.Stocks.cache.ttl.regular.context(0), \
+                conf.supybot.plugins.Stocks.cache.ttl.closed.context(0):
+            self.run_benchmark('stock_uncached',
+                               ['stock AAPL MSFT', 'stock ^GSPC'],
+                               requests=200)
+
+    def testBenchForexTable(self):
+        requests = []
+        server = bench.FakeServer(exchangerate(requests), latency=0.05)
+        url = plugin.EXCHANGERATE_URL
+        plugin.EXCHANGERATE_URL = server.url
+        try:
+            with conf.supybot.plugins.Stocks.forex.provider.context(
+                    'exchangerate'):
+                self.run_benchmark('forex_table', ['forex USD EUR GBP JPY',
+                                                   'forex EUR GBP JPY'],
+                                   requests=200)
+        finally:
+            plugin.EXCHANGERATE_URL = url
+            server.close()
+
+    def testBenchForexUncached(self):
+        with conf.supybot.plugins.Stocks.forex.ttl.context(0):
+            self.run_benchmark('forex_uncached', ['forex USD EUR',
+                                                  'forex GBP JPY'],
+                               requests=200)
+
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
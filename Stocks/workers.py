@@ -0,0 +1,128 @@
+###
+# Copyright (c) 2023 Solareon
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+###
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from supybot import log, world
+
+
+class WorkerPool(object):
+    """Fixed number of worker threads running queued jobs.
+
+    Jobs are queued per key (a channel or a nick) and workers take one job
+    from each key in turn, so a busy channel can't starve the others.  The
+    total number of queued jobs is bounded, submit refuses jobs beyond
+    that."""
+
+    def __init__(self, name, threads, maxqueued):
+        self.name = name
+        self.maxqueued = maxqueued
+        self.busy = 0
+        self.completed = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=1000)
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._threads = []
+        for i in range(threads):
+            thread = world.SupyThread(target=self._run,
+                                      name='{name} worker #{i}'.format(
+                                          name=name, i=i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, function, *args):
+        """Queues function(*args), returns False if the queue is full"""
+        with self._cond:
+            if self._stopped or self._queued >= self.maxqueued:
+                self.rejected += 1
+                return False
+            self._queues.setdefault(key, deque()).append(
+                (time.monotonic(), function, args))
+            self._queued += 1
+            self._cond.notify()
+            return True
+
+    def _next(self):
+        # Round robin over keys: take the first key's oldest job and move
+        # the key to the back if it has more
+        key, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        if queue:
+            self._queues.move_to_end(key)
+        else:
+            del self._queues[key]
+        self._queued -= 1
+        return job
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queued and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                queued, function, args = self._next()
+                self.busy += 1
+                self.waits.append(time.monotonic() - queued)
+            try:
+                function(*args)
+            except Exception:
+                log.exception('%s: uncaught exception in worker', self.name)
+            finally:
+                with self._cond:
+                    self.busy -= 1
+                    self.completed += 1
+
+    def stop(self):
+        """Stops the workers once their current job is done, dropping queued
+        jobs"""
+        with self._cond:
+            self._stopped = True
+            self._queues.clear()
+            self._queued = 0
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self.waits)
+            return {
+                'threads': len(self._threads),
+                'busy': self.busy,
+                'queued': self._queued,
+                'maxqueued': self.maxqueued,
+                'keys': len(self._queues),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'wait_avg': sum(waits) / len(waits) if waits else 0.0,
+                'wait_p95': waits[int(len(waits) * 0.95)] if waits else 0.0,
+                'wait_max': waits[-1] if waits else 0.0,
+            }
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79: